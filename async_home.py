@@ -0,0 +1,211 @@
+"""
+异步设备控制：
+- 真实设备通过网络接收命令，每条命令要等待一次往返（round-trip）
+- AsyncSmartHome.control_device_async() 先通过可等待的传输层（transport）把命令发给设备，
+  设备确认后再更新本地状态、写日志（与 control_device 相同）
+- 每台设备（或每种设备类型）可以单独设置超时时间；超时或失败时按次数重试
+- 全局信号量限制同时进行中的命令数量
+- 多条命令用 control_many_async() / run_rule_async() 并发发送，
+  关闭 500 盏灯只需要大约一次往返的时间，而不是 500 次
+
+用法：
+    home = AsyncSmartHome(transport=SimulatedTransport(latency=0.05))
+    asyncio.run(home.control_device_async("L01", "turn_off"))
+"""
+
+import asyncio
+import random
+from automation import resolve_targets
+from logger import log, log_many
+from smart_home import SmartHome
+
+
+class Transport:
+    """
+    传输层接口：把一条命令发给设备并等待确认
+
+    子类实现 send()：成功时返回 True，设备拒绝时返回 False，
+    通信失败时抛出 ConnectionError（超时由调用方处理）
+    """
+
+    async def send(self, device_id, action, kwargs):
+        """
+        :param device_id: 设备ID
+        :param action: 操作类型
+        :param kwargs: 操作参数
+        :return: 设备是否接受命令
+        """
+        raise NotImplementedError
+
+
+class SimulatedTransport(Transport):
+    """
+    本地模拟设备：每条命令等待 latency 秒（加上随机抖动）后确认，
+    可以按比例模拟通信失败，便于测试超时和重试
+    """
+
+    def __init__(self, latency=0.05, jitter=0.0, failure_rate=0.0, seed=None):
+        """
+        :param latency: 每条命令的往返时间（秒）
+        :param jitter: 往返时间的随机抖动范围（秒）
+        :param failure_rate: 通信失败的概率（0 ~ 1）
+        :param seed: 随机数种子
+        """
+        if latency < 0 or jitter < 0:
+            raise ValueError("latency 和 jitter 不能为负数")
+        if not 0 <= failure_rate <= 1:
+            raise ValueError(f"failure_rate 必须在 0 ~ 1 之间: {failure_rate}")
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.sent = 0              # 已发送的命令数（含失败的）
+        self._random = random.Random(seed)
+
+    async def send(self, device_id, action, kwargs):
+        self.sent += 1
+        delay = self.latency
+        if self.jitter:
+            delay += self._random.uniform(0, self.jitter)
+        await asyncio.sleep(delay)
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            raise ConnectionError(f"设备 {device_id} 无响应")
+        return True
+
+
+class AsyncSmartHome(SmartHome):
+    """
+    支持异步控制的智能家居系统：
+    - 同步接口（control_device 等）保持不变，直接修改本地状态
+    - control_device_async() 先等待设备确认，再修改本地状态
+    """
+
+    def __init__(self, transport=None, timeout=2.0, retries=2, retry_delay=0.1,
+                 max_concurrency=1000, **kwargs):
+        """
+        :param transport: 传输层（默认 SimulatedTransport()）
+        :param timeout: 默认的单次命令超时时间（秒）
+        :param retries: 超时或失败后的重试次数
+        :param retry_delay: 第一次重试前的等待时间（秒），之后每次翻倍
+        :param max_concurrency: 同时进行中的命令数量上限
+        :param kwargs: 传给 SmartHome 的参数（storage、journal 等）
+        """
+        if timeout <= 0:
+            raise ValueError(f"timeout 必须大于 0: {timeout}")
+        if retries < 0:
+            raise ValueError(f"retries 不能为负数: {retries}")
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency 必须大于 0: {max_concurrency}")
+        super().__init__(**kwargs)
+        self.transport = transport if transport is not None else SimulatedTransport()
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.max_concurrency = max_concurrency
+        self.timeouts = {}         # 设备ID 或设备类型 -> 超时时间（秒）
+        self._semaphores = {}      # 事件循环 -> 信号量（信号量不能跨事件循环使用）
+
+    def set_timeout(self, key, seconds):
+        """
+        设置单台设备或某种设备类型的超时时间
+
+        :param key: 设备ID 或设备类型（如 "doorlock"）
+        :param seconds: 超时时间（秒），None 表示恢复默认
+        """
+        if key not in self.devices:
+            key = key.lower()
+        if seconds is None:
+            self.timeouts.pop(key, None)
+        elif seconds <= 0:
+            raise ValueError(f"超时时间必须大于 0: {seconds}")
+        else:
+            self.timeouts[key] = seconds
+
+    def timeout_for(self, device):
+        """返回设备的超时时间（设备ID 优先，其次设备类型，最后是默认值）"""
+        if device.device_id in self.timeouts:
+            return self.timeouts[device.device_id]
+        return self.timeouts.get(device.name.lower(), self.timeout)
+
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            self._semaphores.clear()
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    # ---------------------------
+    # 异步控制
+    # ---------------------------
+    async def control_device_async(self, device_id, action, **kwargs):
+        """
+        把命令发给设备，设备确认后再更新本地状态
+
+        :param device_id: 设备ID
+        :param action: 操作类型（turn_on/turn_off/set_attr等）
+        :param kwargs: 额外参数（与 control_device 相同）
+        :return: 是否操作成功
+        """
+        if device_id not in self.devices:
+            print("设备不存在。")
+            return False
+        timeout = self.timeout_for(self.devices[device_id])
+
+        error = None
+        attempts = 0
+        async with self._semaphore():
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+                attempts += 1
+                try:
+                    accepted = await asyncio.wait_for(
+                        self.transport.send(device_id, action, kwargs), timeout)
+                except asyncio.TimeoutError:
+                    error = f"超时（{timeout}s）"
+                    continue
+                except ConnectionError as e:
+                    error = str(e)
+                    continue
+                if not accepted:
+                    print(f"设备 {device_id} 拒绝了操作 {action}。")
+                    return False
+                return self.control_device(device_id, action, **kwargs)
+
+        print(f"设备 {device_id} 操作 {action} 失败：{error}")
+        log(f"设备命令失败 {device_id}.{action}", device=self.devices[device_id],
+            extra_info={"device_id": device_id, "error": error, "attempts": attempts},
+            code="device.command_failed")
+        return False
+
+    async def control_many_async(self, commands):
+        """
+        并发发送多条命令
+
+        :param commands: [(设备ID, 操作类型, 参数字典), ...]
+        :return: 每条命令是否成功的列表（与 commands 顺序相同）
+        """
+        return list(await asyncio.gather(*(
+            self.control_device_async(device_id, action, **(kwargs or {}))
+            for device_id, action, kwargs in commands
+        )))
+
+    async def run_rule_async(self, rule):
+        """
+        并发执行一条声明式规则的动作（不检查条件）
+
+        :param rule: DeclarativeRule 对象或规则定义字典
+        :return: 每个目标设备是否成功的列表
+        """
+        spec = rule.to_dict() if hasattr(rule, "to_dict") else rule
+        params = spec.get("params", {})
+        if spec["action"] == "notify":
+            self.automation.notify(params.get("message", spec.get("description", "")))
+            return []
+        devices = resolve_targets(spec, self)
+        results = await self.control_many_async(
+            [(device.device_id, spec["action"], params) for device in devices])
+        description = spec.get("description", "")
+        log_many([(f"自动化规则触发：{description}", device, None, {"rule": description})
+                  for device, ok in zip(devices, results) if ok])
+        return results
@@ -1,6 +1,677 @@
 # 自动化规则系统：
 # 1. 支持根据条件自动控制设备，比如温度超过某值时打开空调。
 # 2. 规则可以保存成一个列表，方便以后扩展。
+# 3. 声明式规则（条件表达式 + 目标设备 + 动作）可以完整保存到 automation_rules.json，
+#    加载时编译成专用的条件函数和动作函数，运行时不再解释规则。
+# 4. 增量计算：只重新计算依赖已变化状态键的条件（Rete 风格的 alpha 网络）。
+# 5. 事件模式：订阅 SmartHome 的状态变化事件，变化发生时立即触发相关规则。
+# 6. 定时：条件持续一段时间后才触发、延迟执行动作、周期规则（由时间轮 TimerWheel 驱动）。
+# 7. 每条规则记录最近一段时间的条件耗时、动作耗时、触发次数和出错次数（RuleStats），
+#    slowest_rules() / noisiest_rules() 找出最耗时、触发最频繁的规则。
+
+import bisect
+import operator
+import re
+import threading
+import time
+from datetime import datetime
+from logger import log, log_many
+from timer_wheel import TimerWheel
+
+# 内置规则模板（main.py 和 gui.py 共用）
+RULE_TEMPLATES = [
+    {
+        "description": "温度 > 30°C 自动打开空调",
+        "condition": "temperature > 30",
+        "target": {"type": "aircon"},
+        "action": "turn_on",
+        "limit": 1,
+    },
+    {
+        "description": "温度 < 20°C 自动关闭空调",
+        "condition": "temperature < 20",
+        "target": {"type": "aircon"},
+        "action": "turn_off",
+        "limit": 1,
+    },
+    {
+        "description": "无人时自动关灯",
+        "condition": "has_person == false",
+        "target": {"type": "light", "status": "on"},
+        "action": "turn_off",
+    },
+    {
+        "description": "门锁未关闭超过5分钟报警",
+        "condition": "door_locked == false",
+        "duration": 300,
+        "action": "notify",
+        "params": {"message": "门锁已经超过5分钟未关闭！"},
+    },
+    {
+        "description": "每天 23:00 关闭所有灯",
+        "every": 86400,
+        "at": "23:00",
+        "target": {"type": "light", "status": "on"},
+        "action": "turn_off",
+    },
+]
+
+
+# ---------------------------
+# 条件表达式
+# ---------------------------
+# 语法：
+#     expr    := and_expr ("or" and_expr)*
+#     and_expr:= not_expr ("and" not_expr)*
+#     not_expr:= "not" not_expr | compare
+#     compare := atom (("==" | "!=" | "<" | "<=" | ">" | ">=") atom)?
+#     atom    := 数字 | 字符串 | true | false | none | 状态键 | "(" expr ")"
+# 例如：temperature > 30 and has_person == false
+# 状态键可以是 "设备ID.属性名"（例如 D01.temperature、D01.status），
+# 状态中没有该键时从 state["devices"] 中的设备读取。
+
+_TOKEN_RE = re.compile(r"""\s*(?:
+    (?P<num>-?\d+(?:\.\d+)?)
+  | (?P<str>'[^']*'|"[^"]*")
+  | (?P<op>==|!=|<=|>=|<|>|\(|\))
+  | (?P<name>[A-Za-z_][\w.]*)
+)""", re.VERBOSE)
+
+_COMPARE_OPS = {
+    "==": operator.eq, "!=": operator.ne,
+    "<": operator.lt, "<=": operator.le,
+    ">": operator.gt, ">=": operator.ge,
+}
+
+_CONSTANTS = {"true": True, "false": False, "none": None}
+
+
+def _tokenize(text):
+    """把条件表达式切分为 (类型, 值) 列表"""
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN_RE.match(text, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f"规则条件语法错误（位置 {pos}）: {text}")
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "num":
+            tokens.append(("const", float(value) if "." in value else int(value)))
+        elif kind == "str":
+            tokens.append(("const", value[1:-1]))
+        elif kind == "name" and value.lower() in _CONSTANTS:
+            tokens.append(("const", _CONSTANTS[value.lower()]))
+        elif kind == "name" and value.lower() in ("and", "or", "not"):
+            tokens.append(("op", value.lower()))
+        else:
+            tokens.append((kind, value))
+    return tokens
+
+
+class _Parser:
+    """递归下降解析器：条件表达式 -> 语法树（嵌套元组）"""
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("规则条件不能为空")
+        node = self._or()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"规则条件语法错误（多余的内容）: {self.text}")
+        return node
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def _accept(self, value):
+        if self._peek() == ("op", value):
+            self.pos += 1
+            return True
+        return False
+
+    def _or(self):
+        node = self._and()
+        while self._accept("or"):
+            node = ("or", node, self._and())
+        return node
+
+    def _and(self):
+        node = self._not()
+        while self._accept("and"):
+            node = ("and", node, self._not())
+        return node
+
+    def _not(self):
+        if self._accept("not"):
+            return ("not", self._not())
+        return self._compare()
+
+    def _compare(self):
+        left = self._atom()
+        kind, value = self._peek()
+        if kind == "op" and value in _COMPARE_OPS:
+            self.pos += 1
+            return ("cmp", value, left, self._atom())
+        return left
+
+    def _atom(self):
+        kind, value = self._peek()
+        self.pos += 1
+        if kind == "const":
+            return ("const", value)
+        if kind == "name":
+            return ("var", value)
+        if (kind, value) == ("op", "("):
+            node = self._or()
+            if not self._accept(")"):
+                raise ValueError(f"规则条件缺少右括号: {self.text}")
+            return node
+        if kind is None:
+            raise ValueError(f"规则条件不完整: {self.text}")
+        raise ValueError(f"规则条件语法错误（意外的 {value!r}）: {self.text}")
+
+
+def parse_condition(text):
+    """
+    解析条件表达式
+
+    :param text: 条件表达式，例如 "temperature > 30"
+    :return: 语法树
+    """
+    return _Parser(text).parse()
+
+
+def _state_getter(name):
+    """返回读取状态键的函数 getter(current_state)"""
+    if "." not in name:
+        return lambda state: state.get(name)
+    device_id, attr = name.split(".", 1)
+
+    def get(state):
+        if name in state:
+            return state[name]
+        device = (state.get("devices") or {}).get(device_id)
+        if device is None:
+            return None
+        return device.status if attr == "status" else device.attributes.get(attr)
+    return get
+
+
+def lookup_state(state, name):
+    """读取状态键（支持 "设备ID.属性名"）"""
+    return _state_getter(name)(state)
+
+
+def condition_keys(node):
+    """
+    条件依赖的状态键
+
+    :param node: 语法树
+    :return: 状态键集合
+    """
+    kind = node[0]
+    if kind == "var":
+        return {node[1]}
+    if kind == "const":
+        return set()
+    keys = set()
+    for child in node[1:]:
+        if isinstance(child, tuple):
+            keys |= condition_keys(child)
+    return keys
+
+
+def compile_condition(node):
+    """
+    把语法树编译为条件函数 condition(current_state) -> bool
+
+    常见的 "状态键 比较 常量" 形式会编译为单个专用闭包；
+    状态中缺少的键视为 None，与 None 的大小比较结果为 False。
+    """
+    kind = node[0]
+    if kind == "const":
+        value = node[1]
+        return lambda state: value
+    if kind == "var":
+        return _state_getter(node[1])
+    if kind == "not":
+        inner = compile_condition(node[1])
+        return lambda state: not inner(state)
+    if kind == "and":
+        left, right = compile_condition(node[1]), compile_condition(node[2])
+        return lambda state: bool(left(state)) and bool(right(state))
+    if kind == "or":
+        left, right = compile_condition(node[1]), compile_condition(node[2])
+        return lambda state: bool(left(state)) or bool(right(state))
+
+    # 比较
+    _, op, left, right = node
+    func = _COMPARE_OPS[op]
+    if op in ("==", "!="):
+        if left[0] == "var" and right[0] == "const":
+            get, value = _state_getter(left[1]), right[1]
+            return lambda state: func(get(state), value)
+        lhs, rhs = compile_condition(left), compile_condition(right)
+        return lambda state: func(lhs(state), rhs(state))
+    if left[0] == "var" and right[0] == "const":
+        get, value = _state_getter(left[1]), right[1]
+
+        def compare(state):
+            current = get(state)
+            return current is not None and func(current, value)
+        return compare
+    lhs, rhs = compile_condition(left), compile_condition(right)
+
+    def compare(state):
+        a, b = lhs(state), rhs(state)
+        return a is not None and b is not None and func(a, b)
+    return compare
+
+
+# ---------------------------
+# 增量计算（规则网络）
+# ---------------------------
+# 值从 old 变为 new 时，用二分查找找出结果翻转的阈值条件：
+# 对排好序的常量列表，条件成立的常量正好是前缀（> >=）或后缀（< <=）
+_THRESHOLD_BISECT = {
+    ">": bisect.bisect_left, ">=": bisect.bisect_right,
+    "<": bisect.bisect_right, "<=": bisect.bisect_left,
+}
+
+_SWAPPED_OPS = {"<": ">", "<=": ">=", ">": "<", ">=": "<=", "==": "==", "!=": "!="}
+
+_MISSING = object()
+
+
+def _is_number(value):
+    return type(value) in (int, float)
+
+
+def _normalize_atom(node):
+    """把 "常量 比较 状态键" 统一改写为 "状态键 比较 常量"，便于共享"""
+    if node[0] == "cmp" and node[2][0] == "const" and node[3][0] == "var":
+        return ("cmp", _SWAPPED_OPS[node[1]], node[3], node[2])
+    return node
+
+
+class RuleNetwork:
+    """
+    规则网络（Rete 风格的 alpha 网络）：
+    - 每条声明式规则的条件拆成原子条件（例如 temperature > 30），
+      相同的原子条件在所有规则之间只保存、计算一次
+    - 按状态键建立索引：某个键变化时只重新计算依赖它的原子条件
+        - 阈值条件（键 < <= > >= 数字）按常量排序，用二分查找找出结果翻转的条件
+        - 相等条件（键 == != 常量）按常量建哈希表，只看旧值和新值对应的条件
+    - 原子条件结果变化时才重新组合用到它的规则，并维护当前成立的规则集合
+    - 无法分析依赖的函数规则（AutomationRule）每次都完整检查
+    """
+
+    def __init__(self, rules, previous=None):
+        """
+        :param rules: 规则列表（与 AutomationManager.rules 顺序一致）
+        :param previous: 规则列表变化前的网络；两边都有的规则沿用其中"条件成立"的记录，
+                         第一次 update 时条件仍然成立的规则不会再次触发
+        """
+        self.rules = list(rules)
+        self.values = []          # 原子ID -> 当前结果
+        self.true_rules = set()   # 当前条件成立的规则序号
+        self.cleared = []         # 最近一次 update 中条件由成立变为不成立的规则序号
+        self._atom_ids = {}       # 原子条件语法树 -> 原子ID（相同条件共享）
+        self._atom_funcs = []     # 原子ID -> 条件函数
+        self._atom_rules = []     # 原子ID -> 用到它的规则序号列表
+        self._thresholds = {}     # 状态键 -> {比较符: [(常量, 原子ID)]}，构建后排序
+        self._equals = {}         # 状态键 -> {常量: [原子ID]}
+        self._generic = {}        # 状态键 -> [原子ID]（其他形式的条件）
+        self._rule_funcs = []     # 规则序号 -> 组合函数 f(values)（函数规则为 None）
+        self._opaque = []         # 函数规则的序号
+        self._last = {}           # 状态键 -> 上次看到的值
+        self._getters = {}        # 状态键 -> 读取函数
+        self._primed = False
+
+        for idx, rule in enumerate(self.rules):
+            tree = getattr(rule, "tree", None)
+            if tree is None:
+                self._opaque.append(idx)
+                self._rule_funcs.append(None)
+            else:
+                self._rule_funcs.append(self._compile_rule(tree, idx))
+
+        for by_op in self._thresholds.values():
+            for op, entries in by_op.items():
+                entries.sort(key=lambda entry: entry[0])
+                by_op[op] = ([c for c, _ in entries], [a for _, a in entries])
+        self.values = [False] * len(self._atom_funcs)
+        if previous is not None and previous._primed:
+            was_true = {id(previous.rules[idx]) for idx in previous.true_rules}
+            self.true_rules = {idx for idx, rule in enumerate(self.rules) if id(rule) in was_true}
+
+    @property
+    def atom_count(self):
+        """共享后的原子条件数量"""
+        return len(self._atom_funcs)
+
+    def keys(self):
+        """网络依赖的所有状态键"""
+        return self._getters.keys()
+
+    def _compile_rule(self, node, rule_idx):
+        """把规则的布尔结构编译为组合函数，叶子节点登记为原子条件"""
+        kind = node[0]
+        if kind == "not":
+            inner = self._compile_rule(node[1], rule_idx)
+            return lambda values: not inner(values)
+        if kind in ("and", "or"):
+            left = self._compile_rule(node[1], rule_idx)
+            right = self._compile_rule(node[2], rule_idx)
+            if kind == "and":
+                return lambda values: left(values) and right(values)
+            return lambda values: left(values) or right(values)
+        atom = self._add_atom(node)
+        if rule_idx not in self._atom_rules[atom]:
+            self._atom_rules[atom].append(rule_idx)
+        return lambda values: values[atom]
+
+    def _add_atom(self, node):
+        """登记原子条件（已存在则直接返回ID）并建立状态键索引"""
+        node = _normalize_atom(node)
+        atom = self._atom_ids.get(node)
+        if atom is not None:
+            return atom
+        atom = len(self._atom_funcs)
+        self._atom_ids[node] = atom
+        self._atom_funcs.append(compile_condition(node))
+        self._atom_rules.append([])
+        for key in condition_keys(node):
+            self._getters.setdefault(key, _state_getter(key))
+
+        if node[0] == "cmp" and node[2][0] == "var" and node[3][0] == "const":
+            op, key, value = node[1], node[2][1], node[3][1]
+            if op in _THRESHOLD_BISECT and _is_number(value):
+                self._thresholds.setdefault(key, {}).setdefault(op, []).append((value, atom))
+                return atom
+            if op in ("==", "!="):
+                try:
+                    self._equals.setdefault(key, {}).setdefault(value, []).append(atom)
+                    return atom
+                except TypeError:
+                    pass
+        for key in condition_keys(node):
+            self._generic.setdefault(key, []).append(atom)
+        return atom
+
+    def _eval_atoms(self, atoms, state):
+        """
+        计算原子条件，更新 self.values；耗时和异常记到用到该原子条件的每条规则的 stats 上
+        （共享的原子条件在每条规则上都计入全部耗时），每条规则每次计为一次条件检查
+
+        :return: 结果发生变化的原子ID列表
+        """
+        changed = []
+        spent = {}     # 规则序号 -> 这次计算用到的原子条件的总耗时
+        for atom in atoms:
+            start = _perf_counter()
+            try:
+                value = bool(self._atom_funcs[atom](state))
+            except Exception as e:
+                value = False
+                now = _perf_counter()
+                for idx in self._atom_rules[atom]:
+                    self.rules[idx].stats.failed("条件", e, now)
+            elapsed = _perf_counter() - start
+            for idx in self._atom_rules[atom]:
+                spent[idx] = spent.get(idx, 0.0) + elapsed
+            if value != self.values[atom]:
+                self.values[atom] = value
+                changed.append(atom)
+        now = _perf_counter()
+        for idx, elapsed in spent.items():
+            self.rules[idx].stats.checked(now - elapsed, now)
+        return changed
+
+    def _dirty_atoms(self, key, old, new):
+        """状态键从 old 变为 new 时，结果可能变化的原子条件"""
+        dirty = set(self._generic.get(key, ()))
+        for op, (consts, atoms) in self._thresholds.get(key, {}).items():
+            if _is_number(old) and _is_number(new):
+                find = _THRESHOLD_BISECT[op]
+                lo, hi = sorted((find(consts, old), find(consts, new)))
+                dirty.update(atoms[lo:hi])
+            else:
+                dirty.update(atoms)
+        table = self._equals.get(key)
+        if table:
+            for value in (old, new):
+                try:
+                    dirty.update(table.get(value, ()))
+                except TypeError:
+                    dirty.update(a for atoms in table.values() for a in atoms)
+        return dirty
+
+    def changed_keys(self, state):
+        """与上次相比值发生变化的状态键（调用方不知道哪些键变化时使用）"""
+        return [key for key, get in self._getters.items()
+                if get(state) != self._last.get(key, _MISSING)]
+
+    def update(self, state, changed_keys=None):
+        """
+        根据变化的状态键更新网络
+
+        :param state: 当前系统状态
+        :param changed_keys: 变化的状态键（None 表示与上次的状态逐键比较）
+        :return: 条件由不成立变为成立的规则序号列表（按规则顺序）；
+                 由成立变为不成立的规则序号记在 self.cleared 中
+        """
+        self.cleared = []
+        if not self._primed:
+            # 第一次：计算全部原子条件（沿用的规则与 true_rules 中的记录比较）
+            self._primed = True
+            for key, get in self._getters.items():
+                self._last[key] = get(state)
+            affected = set(range(len(self.rules)))
+            self._eval_atoms(range(len(self._atom_funcs)), state)
+        else:
+            if changed_keys is None:
+                changed_keys = self.changed_keys(state)
+            dirty = set()
+            for key in changed_keys:
+                get = self._getters.get(key)
+                if get is None:
+                    continue
+                new = get(state)
+                old = self._last.get(key, _MISSING)
+                self._last[key] = new
+                dirty |= self._dirty_atoms(key, old, new)
+            affected = set()
+            for atom in self._eval_atoms(dirty, state):
+                affected.update(self._atom_rules[atom])
+
+        fired = []
+        for idx in affected:
+            func = self._rule_funcs[idx]
+            if func is not None:
+                self._set_truth(idx, func(self.values), fired)
+        for idx in self._opaque:
+            self._set_truth(idx, self.rules[idx].check(state), fired)
+        fired.sort()
+        return fired
+
+    def _set_truth(self, idx, value, fired):
+        if value:
+            if idx not in self.true_rules:
+                self.true_rules.add(idx)
+                fired.append(idx)
+        elif idx in self.true_rules:
+            self.true_rules.discard(idx)
+            self.cleared.append(idx)
+
+
+def resolve_targets(spec, home):
+    """
+    找出规则当前作用的设备
+
+    :param spec: 规则定义
+    :param home: SmartHome 对象
+    :return: 设备对象列表
+    """
+    target = spec.get("target", {})
+    if target.get("ids"):
+        devices = [home.devices[d] for d in target["ids"] if d in home.devices]
+    else:
+        devices = home.devices_of_type(target.get("type"))
+    status = target.get("status")
+    if status is not None:
+        devices = [d for d in devices if d.status == status]
+    limit = spec.get("limit")
+    return devices[:limit] if limit else devices
+
+
+def compile_action(spec, home, notify):
+    """
+    把规则的动作部分编译为动作函数 action(current_state) -> None
+
+    :param spec: 规则定义（见 DeclarativeRule）
+    :param home: SmartHome 对象，用于查找和控制设备
+    :param notify: 提醒回调 notify(message)，用于 "notify" 动作
+    """
+    description = spec.get("description", "")
+    params = dict(spec.get("params", {}))
+
+    if spec["action"] == "notify":
+        message = params.get("message", description)
+
+        def act(state):
+            notify(message)
+            log(f"自动化规则触发：{description}", extra_info={"reason": message})
+        return act
+
+    if home is None:
+        raise ValueError("控制设备的规则需要关联 SmartHome")
+    action = spec["action"]
+
+    def act(state):
+        devices = resolve_targets(spec, home)
+        if not devices:
+            return
+        results = home.control_many([(device.device_id, action, params) for device in devices])
+        log_many([(f"自动化规则触发：{description}", device, None, {"rule": description})
+                  for device, ok in zip(devices, results) if ok])
+    return act
+
+
+# 规则统计的时间窗口（秒）
+RULE_STATS_WINDOW = 300.0
+
+_perf_counter = time.perf_counter
+
+
+class RuleStats:
+    """
+    规则的滚动统计：最近 window 秒内的条件检查次数和耗时、动作执行次数和耗时、出错次数
+    - 窗口分成 slots 段，每段一个计数桶，过期的桶在下次写入时清零复用，内存固定
+    - 时间使用 time.perf_counter()（与计时共用一次调用）
+    - 不加锁：多个线程同时检查同一条规则时计数可能有极少误差
+    """
+
+    __slots__ = ("span", "_epochs", "_buckets", "last_error", "last_triggered")
+
+    # 每个桶：[检查次数, 检查总耗时, 检查最大耗时, 执行次数, 执行总耗时, 执行最大耗时, 出错次数]
+    _EMPTY = (0, 0.0, 0.0, 0, 0.0, 0.0, 0)
+
+    def __init__(self, window=RULE_STATS_WINDOW, slots=30):
+        """
+        :param window: 统计窗口（秒）
+        :param slots: 窗口分成的段数
+        """
+        self.span = window / slots
+        self._epochs = [None] * slots
+        self._buckets = [list(self._EMPTY) for _ in range(slots)]
+        self.last_error = None        # 最近一次出错的说明
+        self.last_triggered = None    # 最近一次执行动作的时间（time.time()）
+
+    @property
+    def window(self):
+        return self.span * len(self._epochs)
+
+    def _bucket(self, now):
+        epoch = int(now // self.span)
+        i = epoch % len(self._epochs)
+        bucket = self._buckets[i]
+        if self._epochs[i] != epoch:
+            self._epochs[i] = epoch
+            bucket[:] = self._EMPTY
+        return bucket
+
+    def checked(self, start, end):
+        """记录一次条件检查（start、end 为 perf_counter 时间）"""
+        epoch = int(end // self.span)
+        i = epoch % len(self._epochs)
+        bucket = self._buckets[i]
+        if self._epochs[i] != epoch:   # 与 _bucket 相同，展开以减少每次检查的开销
+            self._epochs[i] = epoch
+            bucket[:] = self._EMPTY
+        elapsed = end - start
+        bucket[0] += 1
+        bucket[1] += elapsed
+        if elapsed > bucket[2]:
+            bucket[2] = elapsed
+
+    def executed(self, start, end):
+        """记录一次动作执行"""
+        bucket = self._bucket(end)
+        elapsed = end - start
+        bucket[3] += 1
+        bucket[4] += elapsed
+        if elapsed > bucket[5]:
+            bucket[5] = elapsed
+        self.last_triggered = time.time()
+
+    def failed(self, stage, error, now):
+        """记录一次出错（stage 为 "条件" 或 "动作"）"""
+        self._bucket(now)[6] += 1
+        self.last_error = f"{stage}：{error}"
+
+    def summary(self, now=None):
+        """
+        窗口内的统计
+
+        :return: {"checks", "check_avg_us", "check_max_us", "triggers", "triggers_per_min",
+                  "action_avg_us", "action_max_us", "errors", "total_ms", "last_error", "last_triggered"}
+        """
+        current = int((time.perf_counter() if now is None else now) // self.span)
+        oldest = current - len(self._epochs) + 1
+        checks = triggers = errors = 0
+        check_time = check_max = action_time = action_max = 0.0
+        for epoch, bucket in zip(self._epochs, self._buckets):
+            if epoch is None or not oldest <= epoch <= current:
+                continue
+            checks += bucket[0]
+            check_time += bucket[1]
+            check_max = max(check_max, bucket[2])
+            triggers += bucket[3]
+            action_time += bucket[4]
+            action_max = max(action_max, bucket[5])
+            errors += bucket[6]
+        return {
+            "checks": checks,
+            "check_avg_us": check_time / checks * 1e6 if checks else 0.0,
+            "check_max_us": check_max * 1e6,
+            "triggers": triggers,
+            "triggers_per_min": triggers / self.window * 60,
+            "action_avg_us": action_time / triggers * 1e6 if triggers else 0.0,
+            "action_max_us": action_max * 1e6,
+            "errors": errors,
+            "total_ms": (check_time + action_time) * 1000,
+            "last_error": self.last_error,
+            "last_triggered": self.last_triggered,
+        }
+
 
 class AutomationRule:
     """
@@ -8,59 +679,202 @@ class AutomationRule:
     - condition: 条件函数，接收 current_state 参数，返回 True/False
     - action: 动作函数，接收 current_state 参数，执行相应操作
     - description: 规则描述，便于用户理解和管理
+    - duration / delay / every: 定时设置（见 __init__），由 AutomationManager 的时间轮处理
+    - stats: 滚动统计（RuleStats），check() 和 execute() 记录耗时和出错次数
     """
 
-    def __init__(self, condition, action, description="未命名规则"):
+    def __init__(self, condition, action, description="未命名规则",
+                 duration=None, delay=None, every=None, at=None):
         """
         初始化规则
         
         :param condition: 条件函数，函数签名：condition(current_state) -> bool
         :param action: 动作函数，函数签名：action(current_state) -> None
         :param description: 规则描述文本
+        :param duration: 条件需要持续满足的秒数，期间条件不再满足则重新计时（可选）
+        :param delay: 条件满足后延迟多少秒执行动作（可选）
+        :param every: 周期规则：每隔多少秒检查一次条件（可选，不参与 run_all 和事件触发）
+        :param at: 周期规则的对齐时间 "HH:MM" 或 "HH:MM:SS"（本地时间，可选），
+                   例如 every=86400, at="23:00" 表示每天 23:00
         """
+        timing = [name for name, value in
+                  (("duration", duration), ("delay", delay), ("every", every)) if value is not None]
+        if len(timing) > 1:
+            raise ValueError(f"duration、delay、every 只能指定一个: {', '.join(timing)}")
+        for name, value in (("duration", duration), ("delay", delay), ("every", every)):
+            if value is not None and (not isinstance(value, (int, float)) or value <= 0):
+                raise ValueError(f"{name} 必须是大于 0 的秒数: {value!r}")
+        if at is not None:
+            if every is None:
+                raise ValueError("at 只能用于周期规则（every）")
+            _parse_clock(at)
         self.condition = condition
         self.action = action
         self.description = description
+        self.duration = duration
+        self.delay = delay
+        self.every = every
+        self.at = at
+        self.stats = RuleStats()
 
     def check(self, current_state):
         """
-        检查条件是否满足
+        检查条件是否满足（记录耗时；出错时记录并视为不满足）
         
         :param current_state: 当前系统状态
         :return: True 如果条件满足，False 否则
         """
+        start = _perf_counter()
         try:
             return self.condition(current_state)
         except Exception as e:
-            print(f"规则检查出错: {e}")
+            self.stats.failed("条件", e, _perf_counter())
+            print(f"规则 {self.description} 检查出错: {e}")
             return False
+        finally:
+            self.stats.checked(start, _perf_counter())
 
     def execute(self, current_state):
         """
-        执行动作
+        执行动作（成功时记录触发次数和耗时；出错时只记录出错次数）
         
         :param current_state: 当前系统状态
         """
+        start = _perf_counter()
         try:
             self.action(current_state)
         except Exception as e:
-            print(f"规则执行出错: {e}")
+            self.stats.failed("动作", e, _perf_counter())
+            print(f"规则 {self.description} 执行出错: {e}")
+        else:
+            self.stats.executed(start, _perf_counter())
+
+    def timing_text(self):
+        """定时设置的说明（没有定时设置时返回空字符串）"""
+        if self.duration:
+            return f"持续 {self.duration:g} 秒后触发"
+        if self.delay:
+            return f"延迟 {self.delay:g} 秒执行"
+        if self.every:
+            return f"每 {self.every:g} 秒" + (f"，对齐 {self.at}" if self.at else "")
+        return ""
+
+    def first_delay(self, now=None):
+        """
+        周期规则第一次检查前的等待时间（秒）：
+        没有 at 时为一个周期；有 at 时对齐到本地时间 at 加整数个周期
+
+        :param now: 当前时间（datetime，默认为现在）
+        """
+        if not self.at:
+            return self.every
+        now = now or datetime.now()
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        elapsed = (now - midnight).total_seconds() - _parse_clock(self.at)
+        return self.every - elapsed % self.every
 
     def __repr__(self):
         """返回规则的字符串表示"""
         return f"AutomationRule(描述: {self.description})"
 
 
+def _parse_clock(text):
+    """把 "HH:MM" 或 "HH:MM:SS" 转为当天的秒数"""
+    try:
+        parts = [int(part) for part in str(text).split(":")]
+    except ValueError:
+        parts = []
+    if len(parts) not in (2, 3) or not (0 <= parts[0] < 24 and all(0 <= p < 60 for p in parts[1:])):
+        raise ValueError(f"时间格式应为 HH:MM 或 HH:MM:SS: {text!r}")
+    hours, minutes, seconds = (parts + [0])[:3]
+    return hours * 3600 + minutes * 60 + seconds
+
+
+class DeclarativeRule(AutomationRule):
+    """
+    声明式规则：可以完整保存和恢复
+
+    规则定义（字典）：
+        description  规则描述
+        condition    条件表达式，例如 "temperature > 30 and has_person == true"
+        target       目标设备：{"type": "aircon"} 或 {"ids": ["D01", "D02"]}，
+                     可选 "status" 只作用于当前为该状态的设备
+        action       动作：turn_on / turn_off / set_attr / 设备的其他方法 / notify
+        params       动作参数，例如 {"key": "temperature", "value": 24}（可选）
+        limit        最多作用于几个设备（可选）
+        duration     条件持续满足多少秒后才触发（可选）
+        delay        条件满足后延迟多少秒执行动作（可选）
+        every        周期规则：每隔多少秒检查一次条件（可选，此时 condition 可以省略）
+        at           周期规则的对齐时间，例如 "23:00"（可选）
+    """
+
+    def __init__(self, spec, home=None, notify=print):
+        """
+        :param spec: 规则定义字典
+        :param home: SmartHome 对象（控制设备的动作需要）
+        :param notify: 提醒回调
+        """
+        # 周期规则可以没有条件（到时间就执行）
+        condition = spec.get("condition") or ("true" if spec.get("every") else None)
+        if not condition or not spec.get("action"):
+            raise ValueError("规则定义缺少 condition 或 action")
+        target = spec.get("target", {})
+        if not isinstance(target, dict):
+            raise ValueError(f"target 应该是字典，例如 {{\"type\": \"aircon\"}}，而不是 {target!r}")
+        if spec["action"] != "notify" and not target.keys() & {"type", "ids"}:
+            raise ValueError("控制设备的规则需要指定 target.type 或 target.ids")
+        self.spec = dict(spec)
+        self.tree = parse_condition(condition)
+        description = spec.get("description") or f"{condition} -> {spec['action']}"
+        self.spec["description"] = description
+        super().__init__(compile_condition(self.tree), compile_action(self.spec, home, notify),
+                         description, duration=spec.get("duration"), delay=spec.get("delay"),
+                         every=spec.get("every"), at=spec.get("at"))
+
+    def to_dict(self):
+        """返回可以保存为 JSON 的规则定义"""
+        return dict(self.spec)
+
+
 class AutomationManager:
     """
     自动化管理器：
     - 维护一个规则列表
     - 提供添加规则、删除规则和运行所有规则的方法
+    - 规则列表写时复制：增删规则时整体替换 self.rules，
+      其他线程正在遍历的旧列表不受影响（可以在后台线程运行规则）
+    - 定时规则（duration/delay/every）由 self.scheduler 时间轮处理；
+      时间轮需要有人推进：scheduler.start() 启动后台线程，或由界面定期调用 scheduler.advance()
     """
 
-    def __init__(self):
-        """初始化管理器，创建空的规则列表"""
+    def __init__(self, home=None, notify=None, scheduler=None):
+        """
+        初始化管理器，创建空的规则列表
+
+        :param home: SmartHome 对象（声明式规则控制设备时使用）
+        :param notify: 提醒回调 notify(message)，默认打印到控制台
+        :param scheduler: 时间轮（默认新建一个 TimerWheel）
+        """
         self.rules = []
+        self.home = home
+        self._rules_lock = threading.Lock()      # 增删规则（读-改-写）时使用
+        self._eval_lock = threading.RLock()      # 增量计算、事件处理（规则网络有内部状态）
+        self.notify = notify or self._print_notice
+        self._network = None   # 增量计算用的规则网络，规则列表被替换后重建
+        self._network_rules = None   # 构建 _network 时的规则列表
+        self.event_mode = False
+        self.max_cascade = 10  # 事件模式下规则连锁触发的最大轮数
+        self._cascade = None   # 正在处理的连锁中已经触发过的规则序号
+        self._pending = []     # 连锁处理期间新产生的变化
+        self.scheduler = scheduler if scheduler is not None else TimerWheel()
+        self.state_provider = None   # 定时器到期时获取当前状态的函数（默认用最近一次的状态）
+        self._timers = {}      # 规则 -> 等待中的定时器（持续条件计时、延迟动作、周期规则）
+        self._held = set()     # 持续条件已经触发、等待条件解除的规则（每次持续只触发一次）
+        self._last_state = None
+
+    @staticmethod
+    def _print_notice(message):
+        print(f"⚠️ 警告：{message}")
 
     def add_rule(self, rule):
         """
@@ -70,12 +884,39 @@ class AutomationManager:
         :return: 是否添加成功
         """
         if isinstance(rule, AutomationRule):
-            self.rules.append(rule)
+            with self._rules_lock:
+                self.rules = self.rules + [rule]
+            if rule.every:
+                self._schedule_periodic(rule)
             return True
         else:
             print("错误：只能添加 AutomationRule 对象。")
             return False
 
+    def add_rule_spec(self, spec):
+        """
+        添加一条声明式规则（编译失败时打印错误）
+
+        :param spec: 规则定义字典（见 DeclarativeRule）
+        :return: 是否添加成功
+        """
+        try:
+            # 提醒回调在触发时再取，便于界面在创建规则后替换 notify
+            rule = DeclarativeRule(spec, self.home, lambda message: self.notify(message))
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"规则定义无效: {e}")
+            return False
+        return self.add_rule(rule)
+
+    def to_specs(self):
+        """
+        导出所有声明式规则的定义
+
+        :return: (规则定义列表, 无法保存的函数规则数量)
+        """
+        specs = [rule.to_dict() for rule in self.rules if isinstance(rule, DeclarativeRule)]
+        return specs, len(self.rules) - len(specs)
+
     def remove_rule(self, index):
         """
         删除指定索引的规则
@@ -83,13 +924,16 @@ class AutomationManager:
         :param index: 规则在列表中的索引（从0开始）
         :return: 是否删除成功
         """
-        if 0 <= index < len(self.rules):
-            removed_rule = self.rules.pop(index)
-            print(f"已删除规则: {removed_rule.description}")
-            return True
-        else:
-            print("规则索引无效。")
-            return False
+        with self._rules_lock:
+            rules = self.rules
+            if not 0 <= index < len(rules):
+                print("规则索引无效。")
+                return False
+            removed_rule = rules[index]
+            self.rules = rules[:index] + rules[index + 1:]
+        self._drop_timer(removed_rule)
+        print(f"已删除规则: {removed_rule.description}")
+        return True
 
     def list_rules(self):
         """
@@ -97,12 +941,20 @@ class AutomationManager:
         
         :return: 规则描述列表
         """
-        if not self.rules:
+        rules = self.rules
+        if not rules:
             return ["当前没有自动化规则。"]
         
         rule_list = []
-        for idx, rule in enumerate(self.rules):
-            rule_list.append(f"{idx + 1}. {rule.description}")
+        for idx, rule in enumerate(rules):
+            text = f"{idx + 1}. {rule.description}"
+            timing = rule.timing_text()
+            if timing:
+                text += f"（{timing}）"
+            remaining = self.remaining(rule)
+            if remaining is not None:
+                text += f" - 剩余 {remaining:.0f} 秒"
+            rule_list.append(text)
         return rule_list
 
     def run_all(self, current_state):
@@ -114,12 +966,266 @@ class AutomationManager:
         :return: 触发的规则数量
         """
         triggered_count = 0
-        for rule in self.rules:
+        self._last_state = current_state
+        for rule in self.rules:   # 写时复制：遍历期间其他线程增删规则不影响这次运行
+            if rule.every:
+                continue          # 周期规则按自己的时间表检查
             if rule.check(current_state):
-                rule.execute(current_state)
-                triggered_count += 1
+                if self._trigger(rule, current_state):
+                    triggered_count += 1
+            elif rule.duration:
+                self._clear(rule)
         return triggered_count
 
+    def run_changed(self, current_state, changed_keys=None):
+        """
+        增量运行规则：只重新计算依赖已变化状态键的规则
+
+        与 run_all 不同，规则只在条件由不满足变为满足时触发一次，
+        条件持续满足期间不会重复执行动作。
+
+        :param current_state: 当前系统状态
+        :param changed_keys: 发生变化的状态键，例如 ["temperature"]；
+                             None 表示与上次运行时的状态逐键比较
+        :return: 触发的规则数量
+        """
+        with self._eval_lock:
+            network = self._current_network()
+            fired = network.update(current_state, changed_keys)
+            self._last_state = current_state
+            for idx in network.cleared:
+                self._clear(network.rules[idx])
+            triggered = 0
+            for idx in fired:
+                rule = network.rules[idx]
+                if not rule.every and self._trigger(rule, current_state):
+                    triggered += 1
+            return triggered
+
+    def _current_network(self):
+        """返回与当前规则列表对应的规则网络（规则列表被替换后重建，保留仍在列表中的规则的状态）"""
+        rules = self.rules
+        if self._network is None or self._network_rules is not rules:
+            self._network = RuleNetwork(rules, self._network)
+            self._network_rules = rules
+        return self._network
+
+    # ---------------------------
+    # 事件模式
+    # ---------------------------
+    def enable_events(self):
+        """开启事件模式：订阅 SmartHome 的状态变化，变化时立即触发规则"""
+        if self.home is None:
+            print("事件模式需要关联 SmartHome。")
+            return False
+        self.home.subscribe(self.on_change)
+        self.event_mode = True
+        return True
+
+    def disable_events(self):
+        """关闭事件模式"""
+        if self.home is not None:
+            self.home.unsubscribe(self.on_change)
+        self.event_mode = False
+        return True
+
+    def on_change(self, current_state, changed_keys):
+        """
+        状态变化事件的处理函数
+
+        规则动作引起的新变化不会立即递归处理，而是在当前这一轮规则执行完后
+        作为下一轮处理（连锁）。为避免规则互相触发形成死循环：
+        - 同一次连锁中每条规则最多触发一次
+        - 连锁超过 max_cascade 轮后停止
+
+        :param current_state: 当前系统状态
+        :param changed_keys: 发生变化的状态键
+        :return: 触发的规则数量
+        """
+        with self._eval_lock:
+            if self._cascade is not None:
+                # 正在执行规则动作，留到下一轮处理
+                self._pending.extend(changed_keys)
+                return 0
+            return self._run_cascade(current_state, changed_keys)
+
+    def _run_cascade(self, current_state, changed_keys):
+        """按轮处理一次连锁（见 on_change）"""
+        network = self._current_network()
+        self._cascade = set()
+        triggered = 0
+        try:
+            pending = list(changed_keys)
+            rounds = 0
+            while pending:
+                rounds += 1
+                if rounds > self.max_cascade:
+                    print(f"自动化规则连锁触发超过 {self.max_cascade} 轮，已停止。")
+                    break
+                self._pending = []
+                fired = network.update(current_state, pending)
+                self._last_state = current_state
+                for idx in network.cleared:
+                    self._clear(network.rules[idx])
+                for idx in fired:
+                    rule = network.rules[idx]
+                    if rule.every:
+                        continue
+                    if idx in self._cascade:
+                        print(f"规则 {rule.description} 在同一次连锁中再次满足条件，已跳过。")
+                        continue
+                    self._cascade.add(idx)
+                    if self._trigger(rule, current_state):
+                        triggered += 1
+                pending = self._pending
+        finally:
+            self._cascade = None
+            self._pending = []
+        return triggered
+
+    # ---------------------------
+    # 定时规则
+    # ---------------------------
+    def _state(self):
+        """定时器到期时使用的当前状态"""
+        if self.state_provider is not None:
+            return self.state_provider()
+        if self._last_state is not None:
+            return self._last_state
+        return self.home.state if self.home is not None else {}
+
+    def _trigger(self, rule, current_state):
+        """
+        规则条件满足时调用：
+        - 普通规则立即执行动作
+        - 持续条件规则开始计时（已经在计时或本次持续已触发过时不重复计时）
+        - 延迟规则安排延迟执行（已经安排过时不重复安排）
+
+        :return: 是否立即执行了动作
+        """
+        if rule.duration or rule.delay:
+            with self._eval_lock:
+                if rule not in self._timers and rule not in self._held:
+                    if rule.duration:
+                        timer = self.scheduler.call_later(rule.duration, self._fire_held, rule)
+                    else:
+                        timer = self.scheduler.call_later(rule.delay, self._fire_delayed, rule)
+                    self._timers[rule] = timer
+            return False
+        rule.execute(current_state)
+        return True
+
+    def _clear(self, rule):
+        """持续条件规则的条件不再满足：取消计时，下次满足时重新开始"""
+        if rule.duration:
+            self._drop_timer(rule)
+
+    def _drop_timer(self, rule):
+        """取消规则的定时器"""
+        with self._eval_lock:
+            self._held.discard(rule)
+            timer = self._timers.pop(rule, None)
+            if timer is not None:
+                self.scheduler.cancel(timer)
+
+    def _claim(self, rule):
+        """定时器回调开始时调用：规则的定时器还是正在触发的这一个时取走它"""
+        timer = self._timers.get(rule)
+        if timer is None or timer.pending:
+            return False    # 已经取消（或取消后重新计时，新的定时器还没到期）
+        del self._timers[rule]
+        return True
+
+    def _fire_held(self, rule):
+        """持续条件计时结束：条件仍然满足时执行动作"""
+        with self._eval_lock:
+            if not self._claim(rule):
+                return
+            state = self._state()
+            if not rule.check(state):
+                return
+            self._held.add(rule)
+            rule.execute(state)
+
+    def _fire_delayed(self, rule):
+        """延迟时间到：执行动作"""
+        with self._eval_lock:
+            if self._claim(rule):
+                rule.execute(self._state())
+
+    def _schedule_periodic(self, rule):
+        with self._eval_lock:
+            self._timers[rule] = self.scheduler.call_every(
+                rule.every, self._fire_periodic, rule, first=rule.first_delay())
+
+    def _fire_periodic(self, rule):
+        """周期规则到时间：条件满足时执行动作"""
+        with self._eval_lock:
+            if rule not in self._timers:
+                return
+            state = self._state()
+            if rule.check(state):
+                rule.execute(state)
+
+    def remaining(self, rule):
+        """规则的定时器距离到期的秒数（没有等待中的定时器时返回 None）"""
+        timer = self._timers.get(rule)
+        return None if timer is None else self.scheduler.remaining(timer)
+
+    # ---------------------------
+    # 规则统计
+    # ---------------------------
+    def rule_stats(self):
+        """
+        每条规则最近一段时间的统计（见 RuleStats.summary）
+
+        增量计算和事件模式下条件由规则网络共享计算，只有 run_all、定时器和函数规则的检查计入条件耗时
+
+        :return: [(规则序号, 规则, 统计字典), ...]
+        """
+        now = time.perf_counter()
+        return [(idx, rule, rule.stats.summary(now)) for idx, rule in enumerate(self.rules)]
+
+    def slowest_rules(self, n=5):
+        """最耗时的 n 条规则（按窗口内条件和动作的总耗时排序，没有耗时的规则不列出）"""
+        stats = [item for item in self.rule_stats() if item[2]["total_ms"] > 0]
+        stats.sort(key=lambda item: item[2]["total_ms"], reverse=True)
+        return stats[:n]
+
+    def noisiest_rules(self, n=5):
+        """触发和出错次数之和最多的 n 条规则（没有触发也没有出错的规则不列出）"""
+        stats = [item for item in self.rule_stats() if item[2]["triggers"] or item[2]["errors"]]
+        stats.sort(key=lambda item: (item[2]["triggers"] + item[2]["errors"], item[2]["errors"]),
+                   reverse=True)
+        return stats[:n]
+
+    def stats_report(self, n=5):
+        """
+        规则统计报告（命令行和图形界面共用）
+
+        :return: 文本行列表
+        """
+        lines = [f"最耗时的规则（最近 {RULE_STATS_WINDOW / 60:g} 分钟）："]
+        for idx, rule, s in self.slowest_rules(n):
+            text = (f"  {idx + 1}. {rule.description}：共 {s['total_ms']:.1f} 毫秒，"
+                    f"条件 {s['checks']} 次 平均 {s['check_avg_us']:.1f} 微秒")
+            if s["triggers"]:
+                text += f"，动作平均 {s['action_avg_us'] / 1000:.2f} 毫秒（最长 {s['action_max_us'] / 1000:.2f}）"
+            lines.append(text)
+        if len(lines) == 1:
+            lines.append("  暂无数据")
+        lines.append("触发最频繁的规则：")
+        start = len(lines)
+        for idx, rule, s in self.noisiest_rules(n):
+            text = (f"  {idx + 1}. {rule.description}：触发 {s['triggers']} 次"
+                    f"（{s['triggers_per_min']:.1f} 次/分钟）")
+            if s["errors"]:
+                text += f"，出错 {s['errors']} 次，最近：{s['last_error']}"
+            lines.append(text)
+        if len(lines) == start:
+            lines.append("  暂无数据")
+        return lines
+
     def get_rules_count(self):
         """获取规则总数"""
         return len(self.rules)
@@ -0,0 +1,206 @@
+"""
+批量规则计算：
+- 每个家庭一个 SmartHome，但阈值规则模板（"温度 > 30°C 自动打开空调" 等）对所有家庭都相同
+- 把 N 个家庭的传感器数据按列存放（temperature、has_person、door_locked 各一列），
+  每条规则编译成一次整列比较，得到 N 个家庭的布尔掩码
+- 安装了 NumPy 时使用向量化计算，否则逐个家庭计算（结果相同）
+- 定时规则（duration/delay/every）依赖各家庭自己的时间轮，不参与批量计算
+
+用法：
+    evaluator = BatchEvaluator(RULE_TEMPLATES)
+    pairs = evaluator.evaluate({"temperature": [...], "has_person": [...], "door_locked": [...]})
+    evaluator.dispatch(pairs, homes)
+"""
+
+import operator
+from automation import (
+    DeclarativeRule, parse_condition, compile_condition, compile_action
+)
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 是可选依赖
+    np = None
+
+# 比较符 -> (NumPy 函数名, 逐个比较用的函数)
+_OPS = {
+    "==": ("equal", operator.eq), "!=": ("not_equal", operator.ne),
+    "<": ("less", operator.lt), "<=": ("less_equal", operator.le),
+    ">": ("greater", operator.gt), ">=": ("greater_equal", operator.ge),
+}
+
+
+class BatchEvaluator:
+    """
+    批量规则计算器：
+    - 规则在创建时编译一次（NumPy 掩码函数 + 逐行计算用的条件函数）
+    - evaluate() 返回满足条件的 (家庭序号, 规则序号) 列表
+    - dispatch() 在对应的 SmartHome 上执行规则动作
+    """
+
+    def __init__(self, rules, use_numpy=True):
+        """
+        :param rules: 规则定义字典或 DeclarativeRule 对象的列表（定时规则会被跳过，
+                      规则序号指 self.specs 中的位置）
+        :param use_numpy: 是否使用 NumPy（未安装时自动退回逐行计算）
+        """
+        specs = [rule.to_dict() if isinstance(rule, DeclarativeRule) else dict(rule)
+                 for rule in rules]
+        self.specs = [spec for spec in specs
+                      if not spec.keys() & {"duration", "delay", "every"}]
+        self.trees = [parse_condition(spec["condition"]) for spec in self.specs]
+        self.use_numpy = use_numpy and np is not None
+        self._row_funcs = [compile_condition(tree) for tree in self.trees]
+        self._mask_funcs = ([self._compile_mask(tree) for tree in self.trees]
+                            if self.use_numpy else None)
+        self._actions = {}    # (家庭序号, 规则序号) -> 动作函数（第一次执行时编译）
+
+    # ---------------------------
+    # 编译
+    # ---------------------------
+    def _compile_mask(self, node):
+        """
+        把语法树编译为掩码函数 mask(columns, n) -> 长度为 n 的布尔数组
+
+        缺少的列视为全部为 None：比较结果为 False（与逐行计算一致）
+        """
+        kind = node[0]
+        if kind == "const":
+            value = node[1]
+            return lambda columns, n: np.full(n, bool(value))
+        if kind == "var":
+            name = node[1]
+            return lambda columns, n: _truthy(columns.get(name), n)
+        if kind == "not":
+            inner = self._compile_mask(node[1])
+            return lambda columns, n: ~inner(columns, n)
+        if kind in ("and", "or"):
+            left = self._compile_mask(node[1])
+            right = self._compile_mask(node[2])
+            if kind == "and":
+                return lambda columns, n: left(columns, n) & right(columns, n)
+            return lambda columns, n: left(columns, n) | right(columns, n)
+
+        # 比较：只支持 "列 比较 常量" 和 "列 比较 列"
+        _, op, left, right = node
+        if left[0] == "const" and right[0] == "var":
+            op = {"<": ">", "<=": ">=", ">": "<", ">=": "<="}.get(op, op)
+            left, right = right, left
+        if left[0] != "var":
+            raise ValueError(f"批量计算不支持的条件: {node}")
+        name = left[1]
+        if right[0] == "const":
+            value = right[1]
+
+            def compare(columns, n):
+                column = columns.get(name)
+                if column is None:
+                    if op in ("==", "!="):
+                        return np.full(n, (value is None) == (op == "=="))
+                    return np.zeros(n, dtype=bool)
+                return _compare(op, column, value)
+            return compare
+        if right[0] != "var":
+            raise ValueError(f"批量计算不支持的条件: {node}")
+        other = right[1]
+
+        def compare_columns(columns, n):
+            a, b = columns.get(name), columns.get(other)
+            if a is None or b is None:
+                return np.zeros(n, dtype=bool)
+            return _compare(op, a, b)
+        return compare_columns
+
+    # ---------------------------
+    # 计算
+    # ---------------------------
+    def masks(self, columns):
+        """
+        计算每条规则的掩码
+
+        :param columns: {状态键: 长度为 N 的数组或列表}
+        :return: 每条规则一个长度为 N 的布尔数组（未使用 NumPy 时为列表）
+        """
+        n = _column_length(columns)
+        if self.use_numpy:
+            columns = {key: np.asarray(value) for key, value in columns.items()}
+            return [func(columns, n) for func in self._mask_funcs]
+        keys = list(columns)
+        rows = [dict(zip(keys, values)) for values in zip(*(columns[k] for k in keys))]
+        return [[bool(_safe_check(func, row)) for row in rows] for func in self._row_funcs]
+
+    def evaluate(self, columns):
+        """
+        计算所有家庭的所有规则
+
+        :param columns: {状态键: 长度为 N 的数组或列表}，例如
+                        {"temperature": [...], "has_person": [...], "door_locked": [...]}
+        :return: 满足条件的 (家庭序号, 规则序号) 列表，按家庭序号、规则序号排序
+        """
+        masks = self.masks(columns)
+        if not masks:
+            return []
+        if self.use_numpy:
+            homes, rules = np.nonzero(np.stack(masks, axis=1))
+            return list(zip(homes.tolist(), rules.tolist()))
+        return [(home, rule) for home, flags in enumerate(zip(*masks))
+                for rule, flag in enumerate(flags) if flag]
+
+    def dispatch(self, pairs, homes, states=None):
+        """
+        在对应的 SmartHome 上执行规则动作
+
+        :param pairs: evaluate() 的结果
+        :param homes: 家庭序号 -> SmartHome 对象（列表或字典）
+        :param states: 家庭序号 -> 当前状态（可选，传给动作函数）
+        :return: 执行的动作数量
+        """
+        count = 0
+        for home_idx, rule_idx in pairs:
+            action = self._actions.get((home_idx, rule_idx))
+            if action is None:
+                home = homes[home_idx]
+                action = compile_action(self.specs[rule_idx], home, home.automation.notify)
+                self._actions[(home_idx, rule_idx)] = action
+            action(states[home_idx] if states is not None else {})
+            count += 1
+        return count
+
+
+def _column_length(columns):
+    lengths = {len(value) for value in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError("各列长度必须相同")
+    return lengths.pop() if lengths else 0
+
+
+def _truthy(column, n):
+    """列的真值（None / NaN 视为 False）"""
+    if column is None:
+        return np.zeros(n, dtype=bool)
+    if column.dtype == object:
+        return np.array([bool(v) for v in column], dtype=bool)
+    if column.dtype.kind == "f":
+        return np.nan_to_num(column, nan=0.0).astype(bool)
+    return column.astype(bool)
+
+
+def _compare(op, column, value):
+    """整列比较；大小比较时 None / NaN 的结果为 False（与逐行计算一致）"""
+    numpy_name, func = _OPS[op]
+    if column.dtype != object and getattr(value, "dtype", None) != object:
+        with np.errstate(invalid="ignore"):
+            return np.asarray(getattr(np, numpy_name)(column, value), dtype=bool)
+    # 含 None 的列：逐个比较
+    values = value if isinstance(value, np.ndarray) else [value] * len(column)
+    if op in ("==", "!="):
+        return np.array([func(a, b) for a, b in zip(column, values)], dtype=bool)
+    return np.array([a is not None and b is not None and func(a, b)
+                     for a, b in zip(column, values)], dtype=bool)
+
+
+def _safe_check(func, row):
+    try:
+        return func(row)
+    except Exception:
+        return False
@@ -0,0 +1,963 @@
+"""
+智能家居控制系统 - 性能基准测试
+
+用法：
+    python benchmark.py memory [--devices N]
+    python benchmark.py startup [--sizes 10000 100000 1000000]
+    python benchmark.py logger [--count N]
+    python benchmark.py logquery [--events N]
+    python benchmark.py rules [--rules N] [--ticks N]
+    python benchmark.py batch [--homes N]
+    python benchmark.py async [--lights N] [--latency S]
+    python benchmark.py bulk [--lights N]
+    python benchmark.py stress [--threads N] [--seconds S]
+    python benchmark.py timers [--timers N]
+    python benchmark.py history [--devices N] [--samples N]
+    python benchmark.py save [--devices N] [--changed N]
+    python benchmark.py suite [--scales 1000:100 10000:1000 ...] [--output FILE] [--baseline FILE]
+    python benchmark.py compare baseline.json results.json [--tolerance 0.25]
+    python benchmark.py metrics [--ops N]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from async_home import AsyncSmartHome, SimulatedTransport
+from automation import AutomationManager, RuleNetwork, RULE_TEMPLATES
+from batch_eval import BatchEvaluator
+from device import (
+    Light, AirConditioner, DoorLock, Camera,
+    SmartCurtain, MusicPlayer, MoodLight
+)
+from device_store import DeviceStore
+import snapshot
+from logger import Logger
+from metrics import LatencyHistogram
+from smart_home import SmartHome
+from timer_wheel import TimerWheel
+from history import AttributeHistory
+
+# 生成合成设备时轮流使用的设备类型
+DEVICE_CLASSES = [Light, AirConditioner, DoorLock, Camera, SmartCurtain, MusicPlayer, MoodLight]
+
+
+def make_device(index):
+    """生成第 index 个合成设备（类型轮流分配，每 10 个设备共享一个给其他用户）"""
+    device_class = DEVICE_CLASSES[index % len(DEVICE_CLASSES)]
+    device = device_class(f"D{index:07d}")
+    if index % 10 == 0:
+        device.share(f"user{index % 100}")
+    return device
+
+
+def _traced_bytes(build):
+    """测量 build() 返回的对象在内存中占用的字节数"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return after - before
+
+
+def bench_memory(n):
+    """比较普通字典存储与列式 DeviceStore 的每设备内存占用"""
+
+    def build_dict():
+        return {f"D{i:07d}": make_device(i) for i in range(n)}
+
+    def build_store():
+        store = DeviceStore()
+        for i in range(n):
+            store[f"D{i:07d}"] = make_device(i)
+        return store
+
+    dict_bytes = _traced_bytes(build_dict)
+    store_bytes = _traced_bytes(build_store)
+    return {
+        "devices": n,
+        "dict_bytes_per_device": dict_bytes / n,
+        "compact_bytes_per_device": store_bytes / n,
+        "ratio": dict_bytes / store_bytes if store_bytes else None,
+    }
+
+
+def make_snapshot_data(n_devices, n_users=None):
+    """生成含 n_devices 个设备、n_users 个用户的系统数据（data.json 结构，默认每 10 个设备一个用户）"""
+    if n_users is None:
+        n_users = max(1, n_devices // 10)
+    users = {f"user{i}": {"username": f"user{i}", "devices": []} for i in range(n_users)}
+    devices = {}
+    for i in range(n_devices):
+        device = make_device(i)
+        users[f"user{i % n_users}"]["devices"].append(device.device_id)
+        devices[device.device_id] = {
+            "name": device.name,
+            "device_id": device.device_id,
+            "status": device.status,
+            "attributes": device.attributes,
+            "shared_users": device.shared_users,
+        }
+    return {"users": users, "devices": devices}
+
+
+def _timed(func):
+    """返回 func() 的耗时（秒）"""
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def bench_startup(sizes):
+    """比较 JSON 与二进制快照的文件大小、解析耗时和 SmartHome 冷启动耗时（含懒加载模式）"""
+    results = []
+    old_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for n in sizes:
+                data = make_snapshot_data(n)
+                with open("data.json", "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=4, ensure_ascii=False)
+                snapshot.dump(data, "data.bin")
+                del data
+
+                def parse_json():
+                    with open("data.json", "r", encoding="utf-8") as f:
+                        json.load(f)
+
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results.append({
+                        "devices": n,
+                        "json_bytes": os.path.getsize("data.json"),
+                        "binary_bytes": os.path.getsize("data.bin"),
+                        "json_parse_s": _timed(parse_json),
+                        "binary_parse_s": _timed(lambda: snapshot.load("data.bin")),
+                        "json_startup_s": _timed(lambda: SmartHome(snapshot_format="json")),
+                        "binary_startup_s": _timed(lambda: SmartHome(snapshot_format="binary")),
+                        "lazy_startup_s": _timed(lambda: SmartHome(storage="lazy")),
+                    })
+        finally:
+            os.chdir(old_cwd)
+    return results
+
+
+def bench_logger(count):
+    """比较同步写入与缓冲写入模式下 log_action 每秒可调用的次数"""
+    device = make_device(0)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode, kwargs in (("sync", {}), ("buffered", {"buffered": True})):
+            logger = Logger(log_file=os.path.join(tmp, f"{mode}.txt"), **kwargs)
+            start = time.perf_counter()
+            for i in range(count):
+                logger.log_action("打开设备 light", device=device,
+                                  extra_info={"device_id": device.device_id, "old_status": "off"})
+            enqueue_s = time.perf_counter() - start
+            logger.close()
+            total_s = time.perf_counter() - start
+            results[mode] = {
+                "calls_per_s": count / enqueue_s,
+                "total_s": total_s,
+            }
+    return results
+
+
+def bench_log_query(n_events):
+    """比较文本日志与结构化日志（JSONL）按设备、按操作过滤的耗时"""
+    devices = [make_device(i) for i in range(100)]
+    target = devices[42].device_id
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in ("text", "jsonl"):
+            logger = Logger(log_file=os.path.join(tmp, f"logs.{fmt}"), buffered=True, fmt=fmt)
+            for i in range(n_events):
+                device = devices[i % len(devices)]
+                logger.log_action(f"打开设备 {device.name}", device=device,
+                                  extra_info={"device_id": device.device_id, "old_status": "off"})
+            logger.close()
+            by_device = _timed(lambda: sum(1 for _ in logger.iter_events(device_id=target)))
+            by_action = _timed(lambda: sum(1 for _ in logger.iter_events(action="device.turn_off")))
+            results[fmt] = {
+                "file_bytes": os.path.getsize(logger.log_file),
+                "by_device_s": by_device,
+                "by_action_s": by_action,
+            }
+    return results
+
+
+def make_rule_specs(n_rules, seed=0):
+    """生成 n_rules 条随机阈值规则（温度、湿度、亮度、是否有人的组合）"""
+    rng = random.Random(seed)
+    specs = []
+    for i in range(n_rules):
+        condition = (f"temperature {rng.choice('<>')} {rng.randint(10, 35)} "
+                     f"and humidity {rng.choice('<>')} {rng.randint(20, 80)}")
+        if i % 3 == 0:
+            condition += f" and has_person == {rng.choice(['true', 'false'])}"
+        if i % 5 == 0:
+            condition = f"({condition}) or lux < {rng.randint(0, 500)}"
+        specs.append({"condition": condition, "action": "notify", "params": {"message": str(i)}})
+    return specs
+
+
+def bench_rules(n_rules, ticks):
+    """比较每个周期全量检查所有规则与按变化的状态键增量计算的耗时（只统计条件计算）"""
+    manager = AutomationManager(notify=lambda message: None)
+    for spec in make_rule_specs(n_rules):
+        manager.add_rule_spec(spec)
+    network = RuleNetwork(manager.rules)
+    state = {"temperature": 25, "humidity": 50, "has_person": True, "lux": 300}
+    network.update(state)
+
+    rng = random.Random(1)
+    temperatures = [round(25 + rng.uniform(-0.5, 0.5), 2) for _ in range(ticks)]
+
+    def full():
+        for t in temperatures:
+            state["temperature"] = t
+            for rule in manager.rules:
+                rule.check(state)
+
+    def incremental():
+        for t in temperatures:
+            state["temperature"] = t
+            network.update(state, ("temperature",))
+
+    return {
+        "rules": n_rules,
+        "atoms": network.atom_count,
+        "full_us_per_tick": _timed(full) / ticks * 1e6,
+        "incremental_us_per_tick": _timed(incremental) / ticks * 1e6,
+    }
+
+
+def bench_batch(n_homes):
+    """比较逐个家庭运行规则模板与按列批量计算（NumPy / 纯 Python）的耗时"""
+    rng = random.Random(2)
+    columns = {
+        "temperature": [rng.randint(15, 35) for _ in range(n_homes)],
+        "has_person": [rng.random() < 0.6 for _ in range(n_homes)],
+        "door_locked": [rng.random() < 0.9 for _ in range(n_homes)],
+    }
+    states = [{"temperature": t, "has_person": p, "door_locked": d}
+              for t, p, d in zip(columns["temperature"], columns["has_person"],
+                                 columns["door_locked"])]
+    rules = BatchEvaluator(RULE_TEMPLATES, use_numpy=False)._row_funcs
+
+    def per_home():
+        return [(home, idx) for home, state in enumerate(states)
+                for idx, check in enumerate(rules) if check(state)]
+
+    result = {"homes": n_homes, "per_home_s": _timed(per_home)}
+    expected = per_home()
+    python_eval = BatchEvaluator(RULE_TEMPLATES, use_numpy=False)
+    result["python_batch_s"] = _timed(lambda: python_eval.evaluate(columns))
+    numpy_eval = BatchEvaluator(RULE_TEMPLATES)
+    if numpy_eval.use_numpy:
+        import numpy as np
+        arrays = {key: np.asarray(value) for key, value in columns.items()}
+        result["numpy_batch_s"] = _timed(lambda: numpy_eval.evaluate(arrays))
+        result["numpy_masks_s"] = _timed(lambda: numpy_eval.masks(arrays))
+        assert numpy_eval.evaluate(arrays) == expected
+    result["triggered"] = len(expected)
+    return result
+
+
+def bench_async(n_lights, latency):
+    """比较逐条等待与并发发送时，一条关闭 n_lights 盏灯的规则的耗时"""
+    rule = {"condition": "true", "action": "turn_off",
+            "target": {"type": "light", "status": "on"}, "description": "关闭所有灯"}
+    old_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                home = AsyncSmartHome(transport=SimulatedTransport(latency=latency))
+                home.add_user("bench")
+                for i in range(n_lights):
+                    home.add_device("light", f"L{i:04d}", "bench")
+
+                def turn_all_on():
+                    for device in home.devices_of_type("light"):
+                        device.turn_on()
+
+                async def sequential():
+                    for device in home.devices_of_type("light"):
+                        await home.control_device_async(device.device_id, "turn_off")
+
+                turn_all_on()
+                sequential_s = _timed(lambda: asyncio.run(sequential()))
+                turn_all_on()
+                start = time.perf_counter()
+                results = asyncio.run(home.run_rule_async(rule))
+                concurrent_s = time.perf_counter() - start
+        finally:
+            os.chdir(old_cwd)
+    return {"lights": n_lights, "latency_s": latency, "sequential_s": sequential_s,
+            "concurrent_s": concurrent_s, "succeeded": sum(results)}
+
+
+def bench_bulk(n_lights):
+    """比较逐个 control_device 与一次 control_many 开关 n_lights 盏灯的耗时"""
+    old_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                home = SmartHome()
+                home.add_user("bench")
+                for i in range(n_lights):
+                    home.add_device("light", f"L{i:05d}", "bench")
+                device_ids = list(home.devices)
+
+                def one_by_one():
+                    for device_id in device_ids:
+                        home.control_device(device_id, "turn_on")
+
+                def batched():
+                    home.control_many([(device_id, "turn_off", None) for device_id in device_ids])
+
+                result = {"lights": n_lights, "control_device_s": _timed(one_by_one),
+                          "control_many_s": _timed(batched)}
+        finally:
+            os.chdir(old_cwd)
+    return result
+
+
+def check_home(home):
+    """
+    检查 SmartHome 的各个索引是否与用户、设备表一致
+
+    :return: 发现的问题列表（为空表示一致）
+    """
+    problems = []
+    for username, user in home.users.items():
+        for device_id in user.devices:
+            if device_id not in home.devices:
+                problems.append(f"用户 {username} 拥有不存在的设备 {device_id}")
+            elif home._device_owner.get(device_id) != username:
+                problems.append(f"设备 {device_id} 的所有者索引不是 {username}")
+        if len(set(user.devices)) != len(user.devices):
+            problems.append(f"用户 {username} 的设备列表有重复")
+    for device_id in home.devices:
+        owner = home._device_owner.get(device_id)
+        if owner not in home.users or device_id not in home.users[owner].devices:
+            problems.append(f"设备 {device_id} 没有有效的所有者")
+        device = home.devices[device_id]
+        if device_id not in home._type_index.get(device.name.lower(), {}):
+            problems.append(f"设备 {device_id} 不在类型索引中")
+        for username in device.shared_users:
+            if device_id not in home._shared_index.get(username, {}):
+                problems.append(f"设备 {device_id} 共享给 {username} 但不在共享索引中")
+        if device.status not in ("on", "off"):
+            problems.append(f"设备 {device_id} 状态异常: {device.status}")
+    for device_type, device_ids in home._type_index.items():
+        for device_id in device_ids:
+            if device_id not in home.devices:
+                problems.append(f"类型索引中有已删除的设备 {device_id}")
+    for username, device_ids in home._shared_index.items():
+        for device_id in device_ids:
+            if device_id in home.devices and username not in home.devices[device_id].shared_users:
+                problems.append(f"共享索引与设备 {device_id} 的共享列表不一致")
+    return problems
+
+
+def bench_stress(n_threads, seconds, storage="dict"):
+    """
+    多线程压力测试（thread_safe=True）：同时控制设备、共享设备、增删设备和用户、运行自动化规则，
+    结束后检查索引一致性
+
+    :return: 各类操作次数、线程异常和一致性问题
+    """
+    old_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                home = SmartHome(storage=storage, journal=True, thread_safe=True)
+                users = [f"user{i}" for i in range(20)]
+                for username in users:
+                    home.add_user(username)
+                for i in range(500):
+                    home.add_device(("light", "aircon", "doorlock", "curtain")[i % 4],
+                                    f"D{i:04d}", users[i % len(users)])
+                for template in RULE_TEMPLATES:
+                    home.automation.add_rule_spec(template)
+
+                counts = {"control": 0, "share": 0, "add_remove": 0, "users": 0,
+                          "run_all": 0, "rules": 0}
+                errors = []
+                stop = threading.Event()
+
+                def worker(kind, seed):
+                    rng = random.Random(seed)
+                    try:
+                        while not stop.is_set():
+                            device_ids = home.device_ids()
+                            if kind == "control":
+                                home.control_device(rng.choice(device_ids),
+                                                    rng.choice(("turn_on", "turn_off")))
+                            elif kind == "share":
+                                home.share_device(rng.choice(device_ids), rng.choice(users))
+                            elif kind == "add_remove":
+                                device_id = f"X{seed}_{rng.randrange(50)}"
+                                if device_id in home.devices:
+                                    home.remove_device(device_id)
+                                else:
+                                    home.add_device("light", device_id, rng.choice(users))
+                            elif kind == "users":
+                                username = f"temp{seed}"
+                                home.add_user(username)
+                                home.add_device("light", f"T{seed}", username)
+                                home.share_device(rng.choice(device_ids), username)
+                                home.remove_user(username)
+                            elif kind == "run_all":
+                                home.automation.run_all({
+                                    "temperature": rng.randint(15, 35),
+                                    "has_person": rng.random() < 0.5,
+                                    "door_locked": rng.random() < 0.5,
+                                    "devices": home.devices,
+                                })
+                            else:
+                                home.automation.add_rule_spec(RULE_TEMPLATES[0])
+                                home.automation.remove_rule(len(home.automation.rules) - 1)
+                            counts[kind] += 1
+                    except Exception as e:   # 压力测试要记录所有异常
+                        errors.append(f"{kind}: {e!r}")
+
+                kinds = ["control"] * max(1, n_threads - 5) + [
+                    "share", "add_remove", "users", "run_all", "rules"]
+                threads = [threading.Thread(target=worker, args=(kind, i))
+                           for i, kind in enumerate(kinds)]
+                for t in threads:
+                    t.start()
+                time.sleep(seconds)
+                stop.set()
+                for t in threads:
+                    t.join()
+
+                problems = check_home(home)
+                # 快照 + journal 重新加载后应得到相同的系统
+                home.journal.close()
+                reloaded = SmartHome(storage=storage, journal=True)
+                if sorted(reloaded.devices) != sorted(home.devices):
+                    problems.append("重新加载后设备列表不一致")
+                problems += [f"重新加载后：{p}" for p in check_home(reloaded)]
+                reloaded.journal.close()
+        finally:
+            os.chdir(old_cwd)
+    return {"threads": len(kinds), "seconds": seconds, "counts": counts,
+            "errors": errors, "problems": problems}
+
+
+def bench_timers(n_timers, seconds=2.0):
+    """
+    时间轮：添加/取消 n_timers 个定时器的耗时，
+    以及这么多定时器等待时后台线程每个 tick 的开销和延迟
+    """
+    rnd = random.Random(0)
+    delays = [rnd.uniform(1, 86400) for _ in range(n_timers)]
+    wheel = TimerWheel()
+    noop = lambda: None
+
+    start = time.perf_counter()
+    timers = [wheel.call_later(delay, noop) for delay in delays]
+    insert_s = time.perf_counter() - start
+    start = time.perf_counter()
+    for timer in timers[::2]:
+        wheel.cancel(timer)
+    cancel_s = time.perf_counter() - start
+
+    # 再加一些很快到期的定时器，让后台线程有回调可执行
+    for i in range(1000):
+        wheel.call_later(rnd.uniform(0, seconds), noop)
+    wheel.advance()   # 添加定时器期间落后的 tick 不计入统计
+    wheel.stats.update(dict.fromkeys(wheel.stats, 0))
+    wheel.start()
+    time.sleep(seconds)
+    wheel.stop()
+    return {
+        "timers": n_timers,
+        "insert_us": insert_s / n_timers * 1e6,
+        "cancel_us": cancel_s / len(timers[::2]) * 1e6,
+        "pending": len(wheel),
+        "stats": dict(wheel.stats),
+    }
+
+
+def bench_history(n_devices, n_samples):
+    """
+    属性历史：每台设备记录 n_samples 次亮度变化（每 10 秒一次）的耗时，
+    查询耗时，以及内存是否保持在上限以内
+    """
+    results = {}
+    for use_numpy in (False, True):
+        clock = [0.0]
+        history = AttributeHistory(use_numpy=use_numpy, clock=lambda: clock[0])
+        if use_numpy and not history.use_numpy:
+            continue
+        rnd = random.Random(0)
+        start = time.perf_counter()
+        for i in range(n_samples):
+            clock[0] += 10
+            for d in range(n_devices):
+                history.record(f"L{d:05d}", "brightness", rnd.randint(0, 100))
+        record_s = time.perf_counter() - start
+        start = time.perf_counter()
+        for d in range(n_devices):
+            history.stats(f"L{d:05d}", "brightness", window=86400)
+        query_s = time.perf_counter() - start
+        bytes_per_series = history.memory_bytes() / n_devices
+        # 缓冲区创建时按容量分配，之后不再增长：每台设备（这里只有一条序列）正好占用上限
+        assert bytes_per_series == history.max_bytes_per_series(), bytes_per_series
+        results["numpy" if use_numpy else "python"] = {
+            "record_us": record_s / (n_samples * n_devices) * 1e6,
+            "query_us": query_s / n_devices * 1e6,
+            "bytes_per_series": bytes_per_series,
+            "max_bytes_per_series": history.max_bytes_per_series(),
+        }
+    return results
+
+
+def bench_save(n_devices, n_changed):
+    """保存耗时：完整快照、只修改了 n_changed 台设备时的增量保存、没有修改时的保存"""
+    old_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                home = SmartHome(storage="compact")
+                home.add_user("bench")
+                for i in range(n_devices):
+                    home.add_device("light", f"L{i:06d}", "bench")
+                full_s = _timed(home.save_data)
+
+                def change_and_save():
+                    for i in range(n_changed):
+                        home.control_device(f"L{i:06d}", "set_attr", key="brightness", value=i % 100)
+                    start = time.perf_counter()
+                    home.save_data()
+                    return time.perf_counter() - start
+
+                delta_s = change_and_save()
+                noop_s = _timed(home.save_data)
+            result = {"devices": n_devices, "changed": n_changed, "full_s": full_s,
+                      "delta_s": delta_s, "noop_s": noop_s,
+                      "snapshot_bytes": os.path.getsize(home.data_file),
+                      "delta_bytes": os.path.getsize(home.delta_file)}
+        finally:
+            os.chdir(old_cwd)
+    return result
+
+
+def bench_metrics(ops):
+    """
+    性能指标的开销：未启用 / 启用时 control_device 的耗时，以及直方图记录一次的耗时
+    （启用指标会给全局日志记录器换上计时版本，所以先测未启用的情况）
+    """
+    result = {"ops": ops}
+    old_cwd = os.getcwd()
+    for label, enabled in (("disabled", False), ("enabled", True)):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    home = SmartHome(metrics=enabled)
+                    home.add_user("bench")
+                    for i in range(100):
+                        home.add_device("light", f"L{i:03d}", "bench")
+                    calls = [(f"L{i % 100:03d}", i % 100) for i in range(ops)]
+                    result[f"{label}_us"] = _per_op(
+                        lambda device_id, value: home.control_device(
+                            device_id, "set_attr", key="brightness", value=value),
+                        calls)["us_per_op"]
+            finally:
+                os.chdir(old_cwd)
+    histogram = LatencyHistogram()
+    samples = [random.random() * 0.01 for _ in range(ops)]
+    result["record_us"] = _timed(lambda: [histogram.record(v) for v in samples]) / ops * 1e6
+    return result
+
+
+# ---------------------------
+# 核心操作基准套件（JSON 结果，可以与基线比较）
+# ---------------------------
+# 默认规模 (设备数, 用户数)；10^6 设备 / 10^5 用户：--scales 1000000:100000
+SUITE_SCALES = [(1000, 100), (10000, 1000), (100000, 10000)]
+
+
+def _per_op(func, calls, rounds=5):
+    """
+    依次执行 func(*args)，分成 rounds 段计时，返回次数、总耗时、平均微秒数，
+    以及最快一段的平均微秒数（us_per_op，受调度、GC 等偶发干扰最小，用于与基线比较）
+    """
+    size = max(1, -(-len(calls) // rounds))
+    best = None
+    total_s = 0.0
+    for offset in range(0, len(calls), size):
+        chunk = calls[offset:offset + size]
+        start = time.perf_counter()
+        for args in chunk:
+            func(*args)
+        elapsed = time.perf_counter() - start
+        total_s += elapsed
+        per_op = elapsed / len(chunk) * 1e6
+        best = per_op if best is None else min(best, per_op)
+    return {"ops": len(calls), "total_s": total_s,
+            "mean_us": total_s / len(calls) * 1e6 if calls else 0.0,
+            "us_per_op": best or 0.0}
+
+
+def _suite_case(n_devices, n_users, ops, n_rules, storage):
+    """在一个合成家庭（n_devices 个设备、n_users 个用户）上测量各核心操作"""
+    rng = random.Random(n_devices)
+    with open("data.json", "w", encoding="utf-8") as f:
+        json.dump(make_snapshot_data(n_devices, n_users), f, ensure_ascii=False)
+
+    results = {}
+    homes = []
+    results["load_data"] = _per_op(lambda: homes.append(SmartHome(storage=storage)), [()])
+    home = homes.pop()
+    device_ids = list(home.devices)
+    usernames = list(home.users)
+
+    results["get_user_devices"] = _per_op(
+        home.get_user_devices, [(rng.choice(usernames),) for _ in range(ops)])
+    results["control_device"] = _per_op(
+        lambda device_id, value: home.control_device(device_id, "set_attr",
+                                                     key="bench", value=value),
+        [(rng.choice(device_ids), i) for i in range(ops)])
+    results["share_device"] = _per_op(
+        home.share_device, [(rng.choice(device_ids), rng.choice(usernames)) for _ in range(ops)])
+    device_types = ["light", "aircon", "doorlock", "camera", "curtain", "musicplayer"]
+    results["add_device"] = _per_op(
+        home.add_device, [(device_types[i % len(device_types)], f"N{i:07d}", rng.choice(usernames))
+                          for i in range(ops)])
+
+    for spec in make_rule_specs(n_rules):
+        home.automation.add_rule_spec(spec)
+    home.automation.notify = lambda message: None
+    home.state.update({"temperature": 25, "humidity": 50, "has_person": True, "lux": 300})
+    results["run_all"] = _per_op(home.automation.run_all, [(home.state,)] * ops)
+
+    # 前面的操作修改了约 3 × ops 个设备：先测增量保存，再删除快照测完整保存
+    results["save_data"] = _per_op(home.save_data, [()])
+    os.remove(home.data_file)
+    results["save_data_full"] = _per_op(home.save_data, [()])
+
+    logger = Logger(log_file="bench_logs.txt")
+    device = home.devices[device_ids[0]]
+    results["log_action"] = _per_op(
+        lambda i: logger.log_action("打开设备 light", device=device,
+                                    extra_info={"device_id": device.device_id, "value": i}),
+        [(i,) for i in range(ops)])
+    logger.close()
+
+    # 删除用户会级联删除他拥有的设备（平均每个用户 n_devices / n_users 个）
+    victims = rng.sample(usernames, min(ops, len(usernames) // 2))
+    results["remove_user"] = _per_op(home.remove_user, [(u,) for u in victims])
+    return results
+
+
+def bench_suite(scales, ops=1000, n_rules=100, storage="dict"):
+    """
+    在不同规模的合成家庭上测量核心操作的平均耗时
+
+    :param scales: [(设备数, 用户数), ...]
+    :param ops: 每种操作执行的次数（加载、保存各执行一次）
+    :return: 可以直接写成 JSON 的结果字典
+    """
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "storage": storage, "ops": ops, "rules": n_rules,
+        },
+        "results": [],
+    }
+    old_cwd = os.getcwd()
+    for n_devices, n_users in scales:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    operations = _suite_case(n_devices, n_users, ops, n_rules, storage)
+            finally:
+                os.chdir(old_cwd)
+        report["results"].append({"devices": n_devices, "users": n_users,
+                                  "operations": operations})
+    return report
+
+
+def compare_results(baseline, current, tolerance=0.25):
+    """
+    按 (设备数, 用户数, 操作) 比较两次 suite 结果的平均耗时
+
+    :param tolerance: 允许的变慢比例，超过时标记为 "regression"（变快同样比例标记为 "improved"）
+    :return: [{"devices", "users", "operation", "baseline_us", "current_us", "ratio", "status"}, ...]
+    """
+    base = {(r["devices"], r["users"], name): op["us_per_op"]
+            for r in baseline["results"] for name, op in r["operations"].items()}
+    rows = []
+    for r in current["results"]:
+        for name, op in r["operations"].items():
+            before = base.get((r["devices"], r["users"], name))
+            if not before:
+                continue
+            ratio = op["us_per_op"] / before
+            status = "ok"
+            if ratio > 1 + tolerance:
+                status = "regression"
+            elif ratio < 1 / (1 + tolerance):
+                status = "improved"
+            rows.append({"devices": r["devices"], "users": r["users"], "operation": name,
+                         "baseline_us": before, "current_us": op["us_per_op"],
+                         "ratio": ratio, "status": status})
+    return rows
+
+
+def _print_suite(report):
+    for r in report["results"]:
+        print(f"{r['devices']} 台设备，{r['users']} 个用户：")
+        for name, op in r["operations"].items():
+            print(f"  {name:>18}: {op['us_per_op']:>12.1f} 微秒/次（{op['ops']} 次）")
+
+
+def _print_comparison(rows, tolerance):
+    """打印比较结果，返回变慢的项数"""
+    labels = {"ok": "", "regression": "  <-- 变慢", "improved": "  变快"}
+    for row in rows:
+        print(f"{row['devices']:>8}/{row['users']:<7} {row['operation']:>18}: "
+              f"{row['baseline_us']:>12.1f} -> {row['current_us']:>12.1f} 微秒 "
+              f"({row['ratio']:.2f}x){labels[row['status']]}")
+    regressions = sum(row["status"] == "regression" for row in rows)
+    print(f"共比较 {len(rows)} 项，{regressions} 项变慢超过 {tolerance:.0%}。")
+    return regressions
+
+
+def _load_results(path):
+    """
+    读取 suite 结果文件；文件不存在、无法读取或格式不对时打印原因，以退出码 2 结束
+    （与"有变慢的操作"的退出码 1 区分开）
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            report = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"无法读取结果文件 {path}: {e}", file=sys.stderr)
+        raise SystemExit(2)
+    if not isinstance(report, dict) or not isinstance(report.get("results"), list):
+        print(f"{path} 不是 benchmark.py suite 的结果文件（缺少 results 列表）。", file=sys.stderr)
+        raise SystemExit(2)
+    return report
+
+
+def _scale(text):
+    """解析命令行中的规模（设备数:用户数）"""
+    try:
+        devices, users = (int(part) for part in text.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"规模格式应为 设备数:用户数，例如 10000:1000: {text}")
+    return devices, users
+
+
+def main():
+    parser = argparse.ArgumentParser(description="智能家居系统性能基准测试")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_memory = sub.add_parser("memory", help="每设备内存占用对比（字典 vs 列式存储）")
+    p_memory.add_argument("--devices", type=int, default=100000)
+
+    p_startup = sub.add_parser("startup", help="冷启动耗时与快照大小（JSON vs 二进制）")
+    p_startup.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+
+    p_logger = sub.add_parser("logger", help="日志写入吞吐量（同步 vs 缓冲）")
+    p_logger.add_argument("--count", type=int, default=100000)
+
+    p_query = sub.add_parser("logquery", help="日志过滤耗时（文本 vs 结构化 JSONL）")
+    p_query.add_argument("--events", type=int, default=1000000)
+
+    p_rules = sub.add_parser("rules", help="规则计算耗时（全量 vs 增量）")
+    p_rules.add_argument("--rules", type=int, default=5000)
+    p_rules.add_argument("--ticks", type=int, default=1000)
+
+    p_batch = sub.add_parser("batch", help="多个家庭批量计算规则模板（逐个家庭 vs 按列）")
+    p_batch.add_argument("--homes", type=int, default=100000)
+
+    p_async = sub.add_parser("async", help="异步控制：逐条等待 vs 并发发送")
+    p_async.add_argument("--lights", type=int, default=500)
+    p_async.add_argument("--latency", type=float, default=0.05)
+
+    p_bulk = sub.add_parser("bulk", help="批量控制：逐个 control_device vs control_many")
+    p_bulk.add_argument("--lights", type=int, default=10000)
+
+    p_stress = sub.add_parser("stress", help="多线程压力测试（线程安全模式）")
+    p_stress.add_argument("--threads", type=int, default=8)
+    p_stress.add_argument("--seconds", type=float, default=5.0)
+    p_stress.add_argument("--storage", choices=("dict", "compact", "lazy"), default="dict")
+
+    p_timers = sub.add_parser("timers", help="时间轮：添加/取消定时器的耗时与 tick 延迟")
+    p_timers.add_argument("--timers", type=int, default=100000)
+
+    p_history = sub.add_parser("history", help="属性历史：记录/查询耗时与内存上限")
+    p_history.add_argument("--devices", type=int, default=100)
+    p_history.add_argument("--samples", type=int, default=20000)
+
+    p_save = sub.add_parser("save", help="保存耗时：完整快照 vs 只写修改 vs 没有修改")
+    p_save.add_argument("--devices", type=int, default=20000)
+    p_save.add_argument("--changed", type=int, default=10)
+
+    p_suite = sub.add_parser("suite", help="核心操作基准套件（结果写成 JSON，可以与基线比较）")
+    p_suite.add_argument("--scales", type=_scale, nargs="+", default=SUITE_SCALES,
+                         help="设备数:用户数，例如 1000:100 1000000:100000")
+    p_suite.add_argument("--ops", type=int, default=1000)
+    p_suite.add_argument("--rules", type=int, default=100)
+    p_suite.add_argument("--storage", choices=("dict", "compact", "lazy"), default="dict")
+    p_suite.add_argument("--output", default="benchmark_results.json")
+    p_suite.add_argument("--baseline", help="基线结果文件；有变慢的操作时退出码为 1，文件无法读取时为 2")
+    p_suite.add_argument("--tolerance", type=float, default=0.25)
+
+    p_compare = sub.add_parser("compare", help="比较两次 suite 结果，标记变慢的操作")
+    p_compare.add_argument("baseline")
+    p_compare.add_argument("current")
+    p_compare.add_argument("--tolerance", type=float, default=0.25)
+
+    p_metrics = sub.add_parser("metrics", help="性能指标的开销（未启用 vs 启用）")
+    p_metrics.add_argument("--ops", type=int, default=20000)
+
+    args = parser.parse_args()
+
+    if args.command == "memory":
+        result = bench_memory(args.devices)
+        print(f"设备数量: {result['devices']}")
+        print(f"  普通存储: {result['dict_bytes_per_device']:.1f} 字节/设备")
+        print(f"  紧凑存储: {result['compact_bytes_per_device']:.1f} 字节/设备")
+        print(f"  节省倍数: {result['ratio']:.1f}x")
+    elif args.command == "startup":
+        print(f"{'设备数':>10} {'JSON大小':>12} {'二进制大小':>12} {'JSON解析':>10} "
+              f"{'二进制解析':>10} {'JSON启动':>10} {'二进制启动':>10} {'懒加载启动':>10}")
+        for r in bench_startup(args.sizes):
+            print(f"{r['devices']:>10} {r['json_bytes']:>12} {r['binary_bytes']:>12} "
+                  f"{r['json_parse_s']:>9.3f}s {r['binary_parse_s']:>9.3f}s "
+                  f"{r['json_startup_s']:>9.3f}s {r['binary_startup_s']:>9.3f}s "
+                  f"{r['lazy_startup_s']:>9.3f}s")
+    elif args.command == "logger":
+        results = bench_logger(args.count)
+        for mode, r in results.items():
+            print(f"{mode:>10}: {r['calls_per_s']:>12.0f} 次/秒 "
+                  f"（含写盘总耗时 {r['total_s']:.3f}s）")
+    elif args.command == "logquery":
+        for fmt, r in bench_log_query(args.events).items():
+            print(f"{fmt:>6}: 文件 {r['file_bytes']:>12} 字节  按设备过滤 {r['by_device_s']:.3f}s  "
+                  f"按操作过滤 {r['by_action_s']:.3f}s")
+
+    elif args.command == "rules":
+        r = bench_rules(args.rules, args.ticks)
+        print(f"规则数: {r['rules']}（共享后原子条件 {r['atoms']} 个）")
+        print(f"  全量检查: {r['full_us_per_tick']:.1f} 微秒/周期")
+        print(f"  增量计算: {r['incremental_us_per_tick']:.1f} 微秒/周期（只有温度变化）")
+
+    elif args.command == "batch":
+        r = bench_batch(args.homes)
+        print(f"家庭数: {r['homes']}，触发 {r['triggered']} 次（家庭, 规则）")
+        print(f"  逐个家庭计算: {r['per_home_s']:.3f}s")
+        print(f"  按列计算（纯 Python）: {r['python_batch_s']:.3f}s")
+        if "numpy_batch_s" in r:
+            print(f"  按列计算（NumPy）: {r['numpy_batch_s']:.3f}s"
+                  f"（只算掩码 {r['numpy_masks_s']:.4f}s）")
+        else:
+            print("  未安装 NumPy，跳过向量化计算")
+
+    elif args.command == "async":
+        r = bench_async(args.lights, args.latency)
+        print(f"关闭 {r['lights']} 盏灯（每条命令往返 {r['latency_s'] * 1000:.0f} 毫秒），"
+              f"成功 {r['succeeded']} 盏")
+        print(f"  逐条等待: {r['sequential_s']:.3f}s")
+        print(f"  并发发送: {r['concurrent_s']:.3f}s")
+
+    elif args.command == "bulk":
+        r = bench_bulk(args.lights)
+        print(f"开关 {r['lights']} 盏灯")
+        print(f"  逐个 control_device: {r['control_device_s']:.3f}s")
+        print(f"  一次 control_many: {r['control_many_s']:.3f}s")
+
+    elif args.command == "stress":
+        r = bench_stress(args.threads, args.seconds, args.storage)
+        print(f"{r['threads']} 个线程运行 {r['seconds']} 秒：")
+        for kind, count in r["counts"].items():
+            print(f"  {kind}: {count} 次")
+        for error in r["errors"]:
+            print(f"  线程异常 {error}")
+        for problem in r["problems"]:
+            print(f"  不一致：{problem}")
+        if r["errors"] or r["problems"]:
+            raise SystemExit(1)
+        print("  状态一致，没有线程异常。")
+
+    elif args.command == "timers":
+        r = bench_timers(args.timers)
+        stats = r["stats"]
+        print(f"定时器数量: {r['timers']}（取消一半后等待中 {r['pending']} 个）")
+        print(f"  添加: {r['insert_us']:.2f} 微秒/个")
+        print(f"  取消: {r['cancel_us']:.2f} 微秒/个")
+        print(f"  后台线程: 处理 {stats['ticks']} 个 tick，触发 {stats['fired']} 次，"
+              f"落后 {stats['overruns']} 次（合并 {stats['late_ticks']} 个 tick），"
+              f"最大延迟 {stats['max_lag'] * 1000:.1f} 毫秒")
+
+    elif args.command == "history":
+        print(f"{args.devices} 台设备，每台记录 {args.samples} 次亮度变化"
+              f"（约 {args.samples * 10 / 86400:.1f} 天）")
+        for mode, r in bench_history(args.devices, args.samples).items():
+            print(f"  {mode:>6}: 记录 {r['record_us']:.2f} 微秒/次  查询 24 小时 {r['query_us']:.1f} 微秒  "
+                  f"内存 {r['bytes_per_series']:.0f} 字节/序列（上限 {r['max_bytes_per_series']}）")
+
+    elif args.command == "save":
+        r = bench_save(args.devices, args.changed)
+        print(f"{r['devices']} 台设备，修改其中 {r['changed']} 台")
+        print(f"  完整快照: {r['full_s']:.3f}s（{r['snapshot_bytes']} 字节）")
+        print(f"  增量保存: {r['delta_s'] * 1000:.2f} 毫秒（增量文件 {r['delta_bytes']} 字节）")
+        print(f"  没有修改: {r['noop_s'] * 1000:.3f} 毫秒（不写文件）")
+
+    elif args.command == "suite":
+        baseline = _load_results(args.baseline) if args.baseline else None   # 先检查基线，避免白跑
+        report = bench_suite(args.scales, args.ops, args.rules, args.storage)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        _print_suite(report)
+        print(f"结果已写入 {args.output}")
+        if baseline is not None:
+            rows = compare_results(baseline, report, args.tolerance)
+            if _print_comparison(rows, args.tolerance):
+                raise SystemExit(1)
+
+    elif args.command == "metrics":
+        r = bench_metrics(args.ops)
+        print(f"control_device {r['ops']} 次（含写日志）：")
+        print(f"  未启用指标: {r['disabled_us']:.2f} 微秒/次")
+        print(f"  启用指标: {r['enabled_us']:.2f} 微秒/次（含 control_device 和 log_action 计时）")
+        print(f"  直方图记录一次: {r['record_us']:.3f} 微秒")
+
+    elif args.command == "compare":
+        rows = compare_results(_load_results(args.baseline), _load_results(args.current), args.tolerance)
+        if _print_comparison(rows, args.tolerance):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
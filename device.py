@@ -1,12 +1,29 @@
 import random
 
+# 带取值检查的属性设置方法 {设备名称: {属性名: 方法名}}，
+# 场景等按属性名批量修改设备时使用（见 Device.set_attr_checked）
+ATTRIBUTE_SETTERS = {
+    "light": {"brightness": "set_brightness", "color_temp": "set_color_temp"},
+    "aircon": {"temperature": "set_temperature", "mode": "set_mode"},
+    "doorlock": {"locked": "set_locked"},
+    "camera": {"angle": "set_angle", "night_vision": "set_night_vision"},
+    "curtain": {"openness": "set_openness"},
+    "musicplayer": {"volume": "set_volume", "play_mode": "set_play_mode"},
+    "MoodLight": {"color": "set_color"},
+}
+
+
 class Device:
     """
     设备类：所有智能家居设备的基础类
     - 提供基本的开关控制和属性设置功能
     - 支持设备共享给其他用户
+    - 状态或属性变化时通知观察者（由 SmartHome 设置，用于事件驱动的自动化）
     """
 
+    # 变化回调 observer(device, key, value)，key 为 "status" 或属性名
+    _observer = None
+
     def __init__(self, name, device_id):
         self.name = name
         self.device_id = device_id
@@ -21,6 +38,7 @@ class Device:
             return False
         else:
             self.status = "on"
+            self._changed("status")
             return True
 
     def turn_off(self):
@@ -30,16 +48,37 @@ class Device:
             return False
         else:
             self.status = "off"
+            self._changed("status")
             return True
 
     def set_attr(self, key, value):
         """设置设备属性，例如亮度、温度"""
         self.attributes[key] = value
+        self._changed(key)
+
+    def set_attr_checked(self, key, value):
+        """
+        通过设备自己的设置方法修改属性（会检查取值范围），
+        没有对应的设置方法时直接 set_attr
+
+        :return: 设备是否接受这个值
+        """
+        setter = ATTRIBUTE_SETTERS.get(self.name, {}).get(key)
+        if setter is None:
+            self.set_attr(key, value)
+            return True
+        return getattr(self, setter)(value)
 
     def get_attr(self, key, default=None):
         """获取设备属性"""
         return self.attributes.get(key, default)
 
+    def _changed(self, key):
+        """状态或属性修改后调用：通知观察者"""
+        if self._observer is not None:
+            value = self.status if key == "status" else self.attributes.get(key)
+            self._observer(self, key, value)
+
     def share(self, username):
         """把设备共享给其他用户"""
         if username not in self.shared_users:
@@ -68,6 +107,7 @@ class Light(Device):
         """设置亮度（0-100）"""
         if 0 <= brightness <= 100:
             self.attributes["brightness"] = brightness
+            self._changed("brightness")
             return True
         else:
             print("亮度值必须在 0-100 之间。")
@@ -77,6 +117,7 @@ class Light(Device):
         """设置色温（warm/cool）"""
         if temp in ["warm", "cool"]:
             self.attributes["color_temp"] = temp
+            self._changed("color_temp")
             return True
         else:
             print("色温只能是 'warm' 或 'cool'。")
@@ -99,6 +140,7 @@ class AirConditioner(Device):
         """设置温度（16-30度）"""
         if 16 <= temp <= 30:
             self.attributes["temperature"] = temp
+            self._changed("temperature")
             return True
         else:
             print("温度值必须在 16-30 度之间。")
@@ -108,6 +150,7 @@ class AirConditioner(Device):
         """设置模式（cool/heat/fan）"""
         if mode in ["cool", "heat", "fan"]:
             self.attributes["mode"] = mode
+            self._changed("mode")
             return True
         else:
             print("模式只能是 'cool'、'heat' 或 'fan'。")
@@ -135,6 +178,8 @@ class DoorLock(Device):
             self.attributes["locked"] = True
             from datetime import datetime
             self.attributes["last_action_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self._changed("locked")
+            self._changed("last_action_time")
             return True
 
     def unlock(self):
@@ -146,8 +191,14 @@ class DoorLock(Device):
             self.attributes["locked"] = False
             from datetime import datetime
             self.attributes["last_action_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self._changed("locked")
+            self._changed("last_action_time")
             return True
 
+    def set_locked(self, locked):
+        """上锁（True）或解锁（False）"""
+        return self.lock() if locked else self.unlock()
+
     def turn_on(self):
         """打开设备（上锁）"""
         return self.lock()
@@ -173,6 +224,7 @@ class Camera(Device):
         """设置旋转角度（0-360度）"""
         if 0 <= angle <= 360:
             self.attributes["angle"] = angle
+            self._changed("angle")
             return True
         else:
             print("角度值必须在 0-360 之间。")
@@ -181,6 +233,13 @@ class Camera(Device):
     def toggle_night_vision(self):
         """切换夜视模式"""
         self.attributes["night_vision"] = not self.attributes["night_vision"]
+        self._changed("night_vision")
+        return True
+
+    def set_night_vision(self, enabled):
+        """打开（True）或关闭（False）夜视模式"""
+        if bool(enabled) != self.attributes["night_vision"]:
+            self.toggle_night_vision()
         return True
 
 
@@ -205,6 +264,8 @@ class SmartCurtain(Device):
                 self.status = "on"
             else:
                 self.status = "on"  # 部分打开也算开启状态
+            self._changed("openness")
+            self._changed("status")
             return True
         else:
             print("开合度值必须在 0-100 之间。")
@@ -239,6 +300,7 @@ class MusicPlayer(Device):
         """设置音量（0-100）"""
         if 0 <= volume <= 100:
             self.attributes["volume"] = volume
+            self._changed("volume")
             return True
         else:
             print("音量值必须在 0-100 之间。")
@@ -248,6 +310,7 @@ class MusicPlayer(Device):
         """设置播放模式（single/loop/shuffle）"""
         if mode in ["single", "loop", "shuffle"]:
             self.attributes["play_mode"] = mode
+            self._changed("play_mode")
             return True
         else:
             print("播放模式只能是 'single'、'loop' 或 'shuffle'。")
@@ -257,6 +320,8 @@ class MusicPlayer(Device):
         """播放指定歌曲"""
         self.attributes["current_song"] = song_name
         self.status = "on"
+        self._changed("current_song")
+        self._changed("status")
         return True
 
 
@@ -277,6 +342,7 @@ class MoodLight(Device):
         colors = ["red", "blue", "green", "purple", "yellow", "orange", "pink"]
         if color in colors:
             self.attributes["color"] = color
+            self._changed("color")
             return True
         else:
             print(f"颜色只能是以下之一：{', '.join(colors)}")
@@ -286,4 +352,5 @@ class MoodLight(Device):
         """自动随机变换颜色"""
         colors = ["red", "blue", "green", "purple", "yellow", "orange", "pink"]
         self.attributes["color"] = random.choice(colors)
+        self._changed("color")
         return True
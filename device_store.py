@@ -0,0 +1,504 @@
+"""
+紧凑设备存储（列式存储）：
+- 面向超大规模设备（百万级）的内存优化存储模式
+- 常用数值属性（亮度、温度、开合度、音量、角度）保存在定长类型数组中
+- 状态、设备类型、模式、颜色等取值很少的字符串使用枚举编码（字符串只保存一份）
+- 时间戳、歌名等取值不断变化的属性保存在对象列中（每行一个引用，不进入枚举表）
+- 其他类型的值和自定义属性放在稀疏字典中
+- 对外仍然提供 Light / AirConditioner / ... 相同的接口（通过 __slots__ 视图类）
+"""
+
+import threading
+from array import array
+from collections.abc import MutableMapping
+from device import (
+    Device, Light, AirConditioner, DoorLock, Camera,
+    SmartCurtain, MusicPlayer, MoodLight
+)
+
+# 整数列（int16），-32768 表示"没有这个属性"
+INT_COLUMNS = ("brightness", "temperature", "openness", "volume", "angle")
+_ABSENT_INT = -32768
+
+# 布尔列（int8），-1 表示"没有这个属性"
+BOOL_COLUMNS = ("locked", "night_vision", "auto_change")
+
+# 枚举列（int16 编码，字符串或 None），-1 表示"没有这个属性"
+# 只用于取值很少的属性：枚举表只增不减，取值不断变化的属性放在对象列中
+ENUM_COLUMNS = ("mode", "color", "color_temp", "play_mode")
+
+# 对象列（list，任意值），_ABSENT 表示"没有这个属性"
+OBJECT_COLUMNS = ("current_song", "last_action_time")
+_ABSENT = object()
+_ABSENT_CODE = -1
+
+
+class _Interner:
+    """字符串枚举表：相同字符串只保存一次，列中只保存编号（最多 32767 种）"""
+
+    def __init__(self, initial=()):
+        self.values = []
+        self.codes = {}
+        self._lock = threading.Lock()   # 不同设备可能在不同线程中同时写入新值
+        for value in initial:
+            self.intern(value)
+
+    def intern(self, value):
+        """返回字符串对应的编号，不存在时新建（超出 int16 范围时返回 None）"""
+        code = self.codes.get(value)
+        if code is None:
+            with self._lock:
+                code = self.codes.get(value)
+                if code is None:
+                    if len(self.values) >= 32767:
+                        return None
+                    code = len(self.values)
+                    self.values.append(value)
+                    self.codes[value] = code
+        return code
+
+
+class DeviceStore(MutableMapping):
+    """
+    列式设备存储：
+    - 行为与 {设备ID: 设备对象} 字典一致，可以直接替换 SmartHome.devices
+    - 写入时接收普通 Device 对象，把数据拆分到各列
+    - 读取时返回轻量视图对象（DeviceView 子类），视图不保存任何数据
+    """
+
+    def __init__(self):
+        self._rows = {}       # {设备ID: 行号}
+        self._ids = []        # 行号 -> 设备ID（空闲行为 None）
+        self._free = []       # 已删除、可复用的行号
+        self._names = array("h")
+        self._status = array("h")
+        self._name_table = _Interner()
+        self._status_table = _Interner(["off", "on"])
+        self._int_cols = {key: array("h") for key in INT_COLUMNS}
+        self._bool_cols = {key: array("b") for key in BOOL_COLUMNS}
+        self._enum_cols = {key: array("h") for key in ENUM_COLUMNS}
+        self._enum_tables = {key: _Interner() for key in ENUM_COLUMNS}
+        self._obj_cols = {key: [] for key in OBJECT_COLUMNS}
+        self._extras = {}     # 稀疏属性 {行号: {属性名: 值}}
+        self._extras_lock = threading.Lock()   # 保护 _extras（不同设备可以在不同线程中同时修改）
+        self._shared = {}     # 稀疏共享列表 {行号: [用户名]}
+        self.observer = None  # 所有视图共用的变化回调（见 Device._observer）
+
+    # ---------------------------
+    # 字典接口
+    # ---------------------------
+    def __setitem__(self, device_id, device):
+        """写入（或覆盖）一个设备：把普通 Device 对象拆分保存到各列"""
+        row = self._rows.get(device_id)
+        if row is None:
+            row = self._alloc_row(device_id)
+        else:
+            self._clear_row(row)
+
+        self._names[row] = self._name_table.intern(device.name)
+        self.set_status(row, device.status)
+        for key, value in device.attributes.items():
+            self.set_attr(row, key, value)
+        self.set_shared(row, device.shared_users)
+
+    def __getitem__(self, device_id):
+        """返回设备视图对象"""
+        row = self._rows[device_id]
+        view_class = _VIEW_CLASSES.get(self.get_name(row), DeviceView)
+        view = view_class.__new__(view_class)
+        view._store = self
+        view._row = row
+        return view
+
+    def __delitem__(self, device_id):
+        row = self._rows.pop(device_id)
+        self._clear_row(row)
+        self._ids[row] = None
+        self._free.append(row)
+
+    def __contains__(self, device_id):
+        return device_id in self._rows
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __repr__(self):
+        return f"DeviceStore({len(self._rows)} 个设备)"
+
+    # ---------------------------
+    # 行管理
+    # ---------------------------
+    def _alloc_row(self, device_id):
+        """分配一行（优先复用已删除的行）"""
+        if self._free:
+            row = self._free.pop()
+            self._ids[row] = device_id
+        else:
+            row = len(self._ids)
+            self._ids.append(device_id)
+            self._names.append(0)
+            self._status.append(0)
+            for col in self._int_cols.values():
+                col.append(_ABSENT_INT)
+            for col in self._bool_cols.values():
+                col.append(_ABSENT_CODE)
+            for col in self._enum_cols.values():
+                col.append(_ABSENT_CODE)
+            for col in self._obj_cols.values():
+                col.append(_ABSENT)
+        self._rows[device_id] = row
+        return row
+
+    def _clear_row(self, row):
+        """把一行的所有属性重置为"不存在\""""
+        for col in self._int_cols.values():
+            col[row] = _ABSENT_INT
+        for col in self._bool_cols.values():
+            col[row] = _ABSENT_CODE
+        for col in self._enum_cols.values():
+            col[row] = _ABSENT_CODE
+        for col in self._obj_cols.values():
+            col[row] = _ABSENT
+        with self._extras_lock:
+            self._extras.pop(row, None)
+        self._shared.pop(row, None)
+
+    # ---------------------------
+    # 按行读写（供视图对象使用）
+    # ---------------------------
+    def get_name(self, row):
+        return self._name_table.values[self._names[row]]
+
+    def get_status(self, row):
+        return self._status_table.values[self._status[row]]
+
+    def set_status(self, row, status):
+        code = self._status_table.intern(status)
+        if code is None:
+            raise ValueError(f"状态种类过多，无法保存: {status}")
+        self._status[row] = code
+
+    def get_attr(self, row, key):
+        """读取属性，不存在时抛出 KeyError"""
+        col = self._int_cols.get(key)
+        if col is not None and col[row] != _ABSENT_INT:
+            return col[row]
+        col = self._bool_cols.get(key)
+        if col is not None and col[row] != _ABSENT_CODE:
+            return bool(col[row])
+        col = self._enum_cols.get(key)
+        if col is not None and col[row] != _ABSENT_CODE:
+            return self._enum_tables[key].values[col[row]]
+        col = self._obj_cols.get(key)
+        if col is not None and col[row] is not _ABSENT:
+            return col[row]
+        extras = self._extras.get(row)
+        if extras is not None and key in extras:
+            return extras[key]
+        raise KeyError(key)
+
+    def set_attr(self, row, key, value):
+        """写入属性：值类型符合列类型时写入列，否则放入稀疏字典"""
+        self.del_attr(row, key)
+        if key in self._int_cols:
+            if type(value) is int and _ABSENT_INT < value <= 32767:
+                self._int_cols[key][row] = value
+                return
+        elif key in self._bool_cols:
+            if type(value) is bool:
+                self._bool_cols[key][row] = int(value)
+                return
+        elif key in self._enum_cols:
+            if value is None or isinstance(value, str):
+                code = self._enum_tables[key].intern(value)
+                if code is not None:
+                    self._enum_cols[key][row] = code
+                    return
+        elif key in self._obj_cols:
+            self._obj_cols[key][row] = value
+            return
+        with self._extras_lock:
+            self._extras.setdefault(row, {})[key] = value
+
+    def del_attr(self, row, key):
+        """删除属性，返回属性原来是否存在"""
+        found = False
+        if key in self._int_cols:
+            found = self._int_cols[key][row] != _ABSENT_INT
+            self._int_cols[key][row] = _ABSENT_INT
+        elif key in self._bool_cols:
+            found = self._bool_cols[key][row] != _ABSENT_CODE
+            self._bool_cols[key][row] = _ABSENT_CODE
+        elif key in self._enum_cols:
+            found = self._enum_cols[key][row] != _ABSENT_CODE
+            self._enum_cols[key][row] = _ABSENT_CODE
+        elif key in self._obj_cols:
+            found = self._obj_cols[key][row] is not _ABSENT
+            self._obj_cols[key][row] = _ABSENT
+        extras = self._extras.get(row)
+        if extras is not None and key in extras:
+            with self._extras_lock:
+                del extras[key]
+                if not extras:
+                    del self._extras[row]
+            found = True
+        return found
+
+    def attr_keys(self, row):
+        """列出某一行存在的属性名"""
+        keys = [key for key, col in self._int_cols.items() if col[row] != _ABSENT_INT]
+        keys += [key for key, col in self._bool_cols.items() if col[row] != _ABSENT_CODE]
+        keys += [key for key, col in self._enum_cols.items() if col[row] != _ABSENT_CODE]
+        keys += [key for key, col in self._obj_cols.items() if col[row] is not _ABSENT]
+        keys += list(self._extras.get(row, ()))
+        return keys
+
+    def get_shared(self, row):
+        return self._shared.get(row, [])
+
+    def set_shared(self, row, shared_users):
+        if shared_users:
+            self._shared[row] = list(shared_users)
+        else:
+            self._shared.pop(row, None)
+
+    def add_shared(self, row, username):
+        """把用户加入共享列表，已存在时返回 False"""
+        shared = self._shared.setdefault(row, [])
+        if username in shared:
+            return False
+        shared.append(username)
+        return True
+
+
+class ColumnAttributes(MutableMapping):
+    """设备属性字典的视图：读写都直接作用于 DeviceStore 的列"""
+
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, key):
+        return self._store.get_attr(self._row, key)
+
+    def __setitem__(self, key, value):
+        self._store.set_attr(self._row, key, value)
+
+    def __delitem__(self, key):
+        if not self._store.del_attr(self._row, key):
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._store.attr_keys(self._row))
+
+    def __len__(self):
+        return len(self._store.attr_keys(self._row))
+
+    def copy(self):
+        return dict(self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class DeviceView:
+    """
+    紧凑模式下的设备对象：
+    - 只保存所属的存储和行号（__slots__，没有 __dict__）
+    - 方法直接复用 device.py 中各设备类的实现
+    """
+
+    __slots__ = ("_store", "_row")
+
+    @property
+    def name(self):
+        return self._store.get_name(self._row)
+
+    @property
+    def device_id(self):
+        return self._store._ids[self._row]
+
+    @property
+    def status(self):
+        return self._store.get_status(self._row)
+
+    @status.setter
+    def status(self, value):
+        self._store.set_status(self._row, value)
+
+    @property
+    def attributes(self):
+        return ColumnAttributes(self._store, self._row)
+
+    @attributes.setter
+    def attributes(self, values):
+        for key in self._store.attr_keys(self._row):
+            self._store.del_attr(self._row, key)
+        for key, value in values.items():
+            self._store.set_attr(self._row, key, value)
+
+    @property
+    def _observer(self):
+        return self._store.observer
+
+    @property
+    def shared_users(self):
+        return self._store.get_shared(self._row)
+
+    @shared_users.setter
+    def shared_users(self, users):
+        self._store.set_shared(self._row, users)
+
+    def share(self, username):
+        """把设备共享给其他用户"""
+        return self._store.add_shared(self._row, username)
+
+    def __eq__(self, other):
+        return (isinstance(other, DeviceView)
+                and self._store is other._store and self._row == other._row)
+
+    def __hash__(self):
+        return hash((id(self._store), self._row))
+
+    turn_on = Device.turn_on
+    turn_off = Device.turn_off
+    set_attr = Device.set_attr
+    set_attr_checked = Device.set_attr_checked
+    get_attr = Device.get_attr
+    _changed = Device._changed
+    __repr__ = Device.__repr__
+
+
+class LightView(DeviceView):
+    __slots__ = ()
+    set_brightness = Light.set_brightness
+    set_color_temp = Light.set_color_temp
+
+
+class AirConditionerView(DeviceView):
+    __slots__ = ()
+    set_temperature = AirConditioner.set_temperature
+    set_mode = AirConditioner.set_mode
+
+
+class DoorLockView(DeviceView):
+    __slots__ = ()
+    lock = DoorLock.lock
+    unlock = DoorLock.unlock
+    set_locked = DoorLock.set_locked
+    turn_on = DoorLock.turn_on
+    turn_off = DoorLock.turn_off
+
+
+class CameraView(DeviceView):
+    __slots__ = ()
+    set_angle = Camera.set_angle
+    toggle_night_vision = Camera.toggle_night_vision
+    set_night_vision = Camera.set_night_vision
+
+
+class SmartCurtainView(DeviceView):
+    __slots__ = ()
+    set_openness = SmartCurtain.set_openness
+    turn_on = SmartCurtain.turn_on
+    turn_off = SmartCurtain.turn_off
+
+
+class MusicPlayerView(DeviceView):
+    __slots__ = ()
+    set_volume = MusicPlayer.set_volume
+    set_play_mode = MusicPlayer.set_play_mode
+    play_song = MusicPlayer.play_song
+
+
+class MoodLightView(DeviceView):
+    __slots__ = ()
+    set_color = MoodLight.set_color
+    auto_change_color = MoodLight.auto_change_color
+
+
+# 设备名称 -> 视图类
+_VIEW_CLASSES = {
+    "light": LightView,
+    "aircon": AirConditionerView,
+    "doorlock": DoorLockView,
+    "camera": CameraView,
+    "curtain": SmartCurtainView,
+    "musicplayer": MusicPlayerView,
+    "MoodLight": MoodLightView,
+}
+
+
+class LazyDeviceMap(MutableMapping):
+    """
+    延迟创建设备对象的字典（懒加载模式）：
+    - 加载数据时只保存原始记录（data.json 中的设备字典）
+    - 第一次通过 devices[设备ID] 访问时才创建 Light / Camera / ... 对象
+    - peek() 只读取名称和状态，不会创建设备对象
+    """
+
+    def __init__(self, factory):
+        """
+        :param factory: 把原始记录变成设备对象的函数，签名 factory(device_id, record) -> Device
+        """
+        self._factory = factory
+        self._entries = {}    # {设备ID: 原始记录(dict) 或 设备对象}
+        self._lock = threading.Lock()   # 多线程下同一设备只创建一个对象
+
+    def load_record(self, device_id, record):
+        """放入一条原始记录（不创建设备对象）"""
+        self._entries[device_id] = record
+
+    def raw(self, device_id):
+        """返回尚未创建对象的原始记录，已经创建对象时返回 None"""
+        entry = self._entries[device_id]
+        return entry if isinstance(entry, dict) else None
+
+    def peek(self, device_id):
+        """
+        读取设备名称和状态（不创建设备对象）
+
+        :return: (name, status)
+        """
+        entry = self._entries[device_id]
+        if isinstance(entry, dict):
+            return entry["name"], entry["status"]
+        return entry.name, entry.status
+
+    def materialized_count(self):
+        """已经创建的设备对象数量"""
+        return sum(1 for entry in self._entries.values() if not isinstance(entry, dict))
+
+    def __getitem__(self, device_id):
+        entry = self._entries[device_id]
+        if isinstance(entry, dict):
+            with self._lock:
+                # 加锁后再检查一次：另一个线程可能刚刚创建了这个设备对象
+                entry = self._entries[device_id]
+                if isinstance(entry, dict):
+                    entry = self._factory(device_id, entry)
+                    self._entries[device_id] = entry
+        return entry
+
+    def __setitem__(self, device_id, device):
+        self._entries[device_id] = device
+
+    def __delitem__(self, device_id):
+        del self._entries[device_id]
+
+    def __contains__(self, device_id):
+        return device_id in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"LazyDeviceMap({len(self._entries)} 个设备)"
@@ -6,7 +6,9 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
 import smart_home
-from automation import AutomationRule
+from automation import RULE_TEMPLATES
+from scene import SCENE_TEMPLATES
+from sensor_hub import SensorHub, simulated_sensors
 from logger import Logger
 
 class SmartHomeGUI:
@@ -17,8 +19,14 @@ class SmartHomeGUI:
         self.root.title("智能家居控制系统")
         self.root.geometry("1000x700")
         
-        # 创建系统实例
-        self.home = smart_home.SmartHome()
+        # 创建系统实例（懒加载：设备对象在第一次使用时才创建）
+        self.home = smart_home.SmartHome(storage="lazy")
+        # 规则中的提醒用弹窗显示
+        self.home.automation.notify = lambda message: messagebox.showwarning("警告", message)
+        # 传感器在后台线程轮询（这里是模拟传感器），读数由界面线程写入状态（见 tick_scheduler）
+        self.sensors = SensorHub(self.home, simulated_sensors(), deferred=True)
+        self.home.automation.state_provider = self.sensors.snapshot
+        self.sensors.start()
         self.logger = Logger()
         
         # 当前选中的用户和设备
@@ -31,6 +39,10 @@ class SmartHomeGUI:
         # 初始化显示
         self.refresh_user_list()
         self.refresh_device_list()
+        self.refresh_scenes()
+
+        # 定时规则：在界面线程中定期推进时间轮（规则动作可以直接更新界面）
+        self.tick_scheduler()
         
     def create_widgets(self):
         """创建所有界面组件"""
@@ -46,6 +58,19 @@ class SmartHomeGUI:
         tk.Button(toolbar, text="刷新", command=self.refresh_all, 
                  bg="#FF9800", fg="white", font=("Arial", 10)).pack(side=tk.LEFT, padx=5)
         
+        # 场景（工具栏右侧）
+        tk.Button(toolbar, text="删除场景", command=self.remove_scene, 
+                 bg="#f44336", fg="white", font=("Arial", 10)).pack(side=tk.RIGHT, padx=5)
+        tk.Button(toolbar, text="添加场景", command=self.add_scene, 
+                 bg="#2196F3", fg="white", font=("Arial", 10)).pack(side=tk.RIGHT, padx=5)
+        tk.Button(toolbar, text="应用场景", command=self.apply_scene, 
+                 bg="#4CAF50", fg="white", font=("Arial", 10)).pack(side=tk.RIGHT, padx=5)
+        self.scene_var = tk.StringVar()
+        self.scene_combo = ttk.Combobox(toolbar, textvariable=self.scene_var, state="readonly",
+                                        width=12, font=("Arial", 10))
+        self.scene_combo.pack(side=tk.RIGHT, padx=5)
+        tk.Label(toolbar, text="场景:", bg="#f0f0f0", font=("Arial", 10)).pack(side=tk.RIGHT)
+        
         # 主容器（左右分栏）
         main_container = tk.Frame(self.root)
         main_container.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
@@ -78,7 +103,8 @@ class SmartHomeGUI:
         device_frame.pack(fill=tk.BOTH, expand=True)
         
         tk.Label(device_frame, text="设备列表:", font=("Arial", 10)).pack(anchor=tk.W, padx=5, pady=2)
-        self.device_listbox = tk.Listbox(device_frame, font=("Arial", 10))
+        self.device_listbox = tk.Listbox(device_frame, font=("Arial", 10),
+                                         selectmode=tk.EXTENDED, exportselection=False)
         self.device_listbox.pack(fill=tk.BOTH, expand=True, padx=5, pady=2)
         self.device_listbox.bind("<<ListboxSelect>>", self.on_device_select)
         
@@ -113,6 +139,8 @@ class SmartHomeGUI:
                  bg="#f44336", fg="white", font=("Arial", 10), width=12).pack(side=tk.LEFT, padx=2)
         tk.Button(control_frame, text="共享设备", command=self.share_device, 
                  bg="#FF9800", fg="white", font=("Arial", 10), width=12).pack(side=tk.LEFT, padx=2)
+        tk.Button(control_frame, text="全部关闭", command=self.turn_off_all_devices, 
+                 bg="#9E9E9E", fg="white", font=("Arial", 10), width=12).pack(side=tk.LEFT, padx=2)
         
         # 属性设置区域（动态创建）
         self.attr_frame = tk.Frame(detail_frame)
@@ -133,6 +161,11 @@ class SmartHomeGUI:
                  bg="#2196F3", fg="white", font=("Arial", 9)).pack(side=tk.LEFT, padx=2)
         tk.Button(rule_btn_frame, text="删除规则", command=self.remove_automation_rule, 
                  bg="#f44336", fg="white", font=("Arial", 9)).pack(side=tk.LEFT, padx=2)
+        tk.Button(rule_btn_frame, text="规则统计", command=self.show_rule_stats,
+                 bg="#9E9E9E", fg="white", font=("Arial", 9)).pack(side=tk.LEFT, padx=2)
+        self.event_mode_var = tk.BooleanVar(value=self.home.automation.event_mode)
+        tk.Checkbutton(rule_btn_frame, text="事件驱动", variable=self.event_mode_var,
+                      command=self.toggle_event_mode, font=("Arial", 9)).pack(side=tk.LEFT, padx=2)
         
         # 日志显示区域
         log_frame = tk.LabelFrame(right_panel, text="最近日志", font=("Arial", 12, "bold"))
@@ -160,13 +193,14 @@ class SmartHomeGUI:
             all_device_ids = devices["all"]
             for device_id in all_device_ids:
                 if device_id in self.home.devices:
-                    device = self.home.devices[device_id]
-                    status_icon = "🟢" if device.status == "on" else "🔴"
-                    self.device_listbox.insert(tk.END, f"{status_icon} {device.name} ({device_id})")
+                    name, status = self.home.device_summary(device_id)
+                    status_icon = "🟢" if status == "on" else "🔴"
+                    self.device_listbox.insert(tk.END, f"{status_icon} {name} ({device_id})")
         else:
-            for device_id, device in self.home.devices.items():
-                status_icon = "🟢" if device.status == "on" else "🔴"
-                self.device_listbox.insert(tk.END, f"{status_icon} {device.name} ({device_id})")
+            for device_id in self.home.devices:
+                name, status = self.home.device_summary(device_id)
+                status_icon = "🟢" if status == "on" else "🔴"
+                self.device_listbox.insert(tk.END, f"{status_icon} {name} ({device_id})")
     
     def refresh_device_info(self):
         """刷新设备详情显示"""
@@ -178,12 +212,7 @@ class SmartHomeGUI:
         
         device = self.home.devices[self.current_device_id]
         
-        # 查找设备所有者
-        owner = None
-        for username, user in self.home.users.items():
-            if self.current_device_id in user.devices:
-                owner = username
-                break
+        owner = self.home.get_device_owner(self.current_device_id)
         
         info = f"设备名称: {device.name}\n"
         info += f"设备ID: {device.device_id}\n"
@@ -246,6 +275,13 @@ class SmartHomeGUI:
         for rule_desc in rules:
             self.rule_listbox.insert(tk.END, rule_desc)
     
+    def refresh_scenes(self):
+        """刷新场景下拉框"""
+        names = list(self.home.scenes)
+        self.scene_combo["values"] = names
+        if self.scene_var.get() not in names:
+            self.scene_var.set(names[0] if names else "")
+    
     def refresh_logs(self):
         """刷新日志显示"""
         self.log_text.delete(1.0, tk.END)
@@ -259,6 +295,7 @@ class SmartHomeGUI:
         self.refresh_device_list()
         self.refresh_device_info()
         self.refresh_automation_rules()
+        self.refresh_scenes()
         self.refresh_logs()
     
     def on_user_select(self, event):
@@ -397,27 +434,49 @@ class SmartHomeGUI:
                 self.refresh_device_info()
                 self.refresh_logs()
     
+    def selected_device_ids(self):
+        """返回设备列表中选中的设备ID（可以多选，Ctrl/Shift + 点击）"""
+        texts = [self.device_listbox.get(index) for index in self.device_listbox.curselection()]
+        device_ids = [device_id for device_id in map(parse_device_id, texts) if device_id]
+        if not device_ids and self.current_device_id:
+            device_ids.append(self.current_device_id)
+        return device_ids
+
+    def control_devices(self, device_ids, action):
+        """批量控制设备并刷新界面"""
+        results = self.home.control_many([(device_id, action, None) for device_id in device_ids])
+        if any(results):
+            self.refresh_device_list()
+            self.refresh_device_info()
+            self.refresh_logs()
+
     def turn_on_device(self):
-        """打开设备"""
-        if not self.current_device_id:
+        """打开选中的设备"""
+        device_ids = self.selected_device_ids()
+        if not device_ids:
             messagebox.showwarning("警告", "请先选择设备！")
             return
         
-        if self.home.control_device(self.current_device_id, "turn_on"):
-            self.refresh_device_list()
-            self.refresh_device_info()
-            self.refresh_logs()
+        self.control_devices(device_ids, "turn_on")
     
     def turn_off_device(self):
-        """关闭设备"""
-        if not self.current_device_id:
+        """关闭选中的设备"""
+        device_ids = self.selected_device_ids()
+        if not device_ids:
             messagebox.showwarning("警告", "请先选择设备！")
             return
         
-        if self.home.control_device(self.current_device_id, "turn_off"):
-            self.refresh_device_list()
-            self.refresh_device_info()
-            self.refresh_logs()
+        self.control_devices(device_ids, "turn_off")
+
+    def turn_off_all_devices(self):
+        """关闭设备列表中的所有设备"""
+        device_ids = [device_id for device_id in
+                      map(parse_device_id, self.device_listbox.get(0, tk.END)) if device_id]
+        if not device_ids:
+            messagebox.showinfo("提示", "设备列表为空。")
+            return
+        
+        self.control_devices(device_ids, "turn_off")
     
     def share_device(self):
         """共享设备"""
@@ -495,70 +554,18 @@ class SmartHomeGUI:
         
         tk.Label(dialog, text="选择规则模板:", font=("Arial", 11, "bold")).pack(pady=10)
         
-        rule_var = tk.StringVar()
-        rules = [
-            ("温度 > 30°C 自动打开空调", "temp_high"),
-            ("温度 < 20°C 自动关闭空调", "temp_low"),
-            ("无人时自动关灯", "no_person"),
-            ("门锁未关闭报警", "door_unlocked")
-        ]
-        
-        for desc, value in rules:
-            tk.Radiobutton(dialog, text=desc, variable=rule_var, value=value,
+        rule_var = tk.IntVar(value=-1)
+        for idx, template in enumerate(RULE_TEMPLATES):
+            tk.Radiobutton(dialog, text=template["description"], variable=rule_var, value=idx,
                           font=("Arial", 10)).pack(anchor=tk.W, padx=20, pady=2)
         
         def confirm():
-            rule_type = rule_var.get()
-            if not rule_type:
+            rule_index = rule_var.get()
+            if rule_index < 0:
                 messagebox.showwarning("警告", "请选择规则类型！")
                 return
             
-            # 创建规则
-            if rule_type == "temp_high":
-                def cond(state):
-                    return state.get("temperature", 0) > 30
-                def act(state):
-                    for device_id, device in self.home.devices.items():
-                        if device.name == "aircon":
-                            device.turn_on()
-                            self.logger.log_action("自动化规则触发：打开空调", device=device,
-                                                  extra_info={"reason": "温度过高"})
-                            break
-                rule = AutomationRule(cond, act, "温度 > 30°C 自动打开空调")
-                
-            elif rule_type == "temp_low":
-                def cond(state):
-                    return state.get("temperature", 0) < 20
-                def act(state):
-                    for device_id, device in self.home.devices.items():
-                        if device.name == "aircon":
-                            device.turn_off()
-                            self.logger.log_action("自动化规则触发：关闭空调", device=device,
-                                                  extra_info={"reason": "温度过低"})
-                            break
-                rule = AutomationRule(cond, act, "温度 < 20°C 自动关闭空调")
-                
-            elif rule_type == "no_person":
-                def cond(state):
-                    return not state.get("has_person", True)
-                def act(state):
-                    for device_id, device in self.home.devices.items():
-                        if device.name == "light" and device.status == "on":
-                            device.turn_off()
-                            self.logger.log_action("自动化规则触发：关闭灯光", device=device,
-                                                  extra_info={"reason": "无人"})
-                rule = AutomationRule(cond, act, "无人时自动关灯")
-                
-            elif rule_type == "door_unlocked":
-                def cond(state):
-                    return not state.get("door_locked", True)
-                def act(state):
-                    messagebox.showwarning("警告", "门锁未关闭！")
-                    self.logger.log_action("自动化规则触发：门锁未关闭警告",
-                                          extra_info={"reason": "门锁未关闭"})
-                rule = AutomationRule(cond, act, "门锁未关闭报警")
-            
-            if self.home.automation.add_rule(rule):
+            if self.home.automation.add_rule_spec(RULE_TEMPLATES[rule_index]):
                 self.refresh_automation_rules()
                 self.refresh_logs()
                 dialog.destroy()
@@ -578,27 +585,101 @@ class SmartHomeGUI:
                 self.refresh_automation_rules()
                 self.refresh_logs()
     
+    def show_rule_stats(self):
+        """显示最耗时、触发最频繁的规则"""
+        messagebox.showinfo("规则统计", "\n".join(self.home.automation.stats_report()))
+    
+    def apply_scene(self):
+        """应用选中的场景（任何设备拒绝修改时整个场景回滚）"""
+        name = self.scene_var.get()
+        if not name:
+            messagebox.showwarning("警告", "请先选择场景！")
+            return
+        
+        if self.home.apply_scene(name):
+            self.refresh_device_list()
+            self.refresh_device_info()
+        else:
+            messagebox.showerror("错误", f"场景 {name} 应用失败，所有设备已恢复原状。")
+        self.refresh_logs()
+    
+    def add_scene(self):
+        """从模板添加场景"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("添加场景")
+        dialog.geometry("400x250")
+        dialog.transient(self.root)
+        dialog.grab_set()
+        
+        tk.Label(dialog, text="选择场景模板:", font=("Arial", 11, "bold")).pack(pady=10)
+        
+        scene_var = tk.IntVar(value=-1)
+        for idx, template in enumerate(SCENE_TEMPLATES):
+            tk.Radiobutton(dialog, text=f"{template['name']}：{template['description']}",
+                          variable=scene_var, value=idx,
+                          font=("Arial", 10)).pack(anchor=tk.W, padx=20, pady=2)
+        
+        def confirm():
+            scene_index = scene_var.get()
+            if scene_index < 0:
+                messagebox.showwarning("警告", "请选择场景！")
+                return
+            
+            if self.home.add_scene(SCENE_TEMPLATES[scene_index]):
+                self.scene_var.set(SCENE_TEMPLATES[scene_index]["name"])
+                self.refresh_scenes()
+                self.refresh_logs()
+                dialog.destroy()
+        
+        tk.Button(dialog, text="确定", command=confirm, 
+                 bg="#4CAF50", fg="white", font=("Arial", 10)).pack(pady=10)
+    
+    def remove_scene(self):
+        """删除选中的场景"""
+        name = self.scene_var.get()
+        if not name:
+            messagebox.showwarning("警告", "请先选择场景！")
+            return
+        
+        if messagebox.askyesno("确认", f"确定要删除场景 {name} 吗？"):
+            if self.home.remove_scene(name):
+                self.refresh_scenes()
+                self.refresh_logs()
+    
+    def tick_scheduler(self):
+        """写入新的传感器读数并推进自动化规则的时间轮，有规则可能触发时刷新界面"""
+        scheduler = self.home.automation.scheduler
+        updated = self.sensors.flush() and self.home.automation.event_mode
+        if scheduler.advance() or updated:
+            self.refresh_all()
+        self.root.after(max(1, int(scheduler.tick * 1000)), self.tick_scheduler)
+    
+    def toggle_event_mode(self):
+        """开启/关闭事件驱动模式（设备状态变化时立即触发规则）"""
+        if self.event_mode_var.get():
+            self.home.automation.enable_events()
+        else:
+            self.home.automation.disable_events()
+    
     def run_automation(self):
-        """运行自动化规则"""
-        import random
-        
-        # 模拟当前系统状态
-        current_state = {
-            "temperature": random.randint(20, 35),
-            "has_person": random.choice([True, False]),
-            "door_locked": True,
-            "devices": self.home.devices
-        }
-        
-        # 检查门锁状态
-        for device in self.home.devices.values():
-            if device.name == "doorlock":
-                current_state["door_locked"] = device.attributes.get("locked", True)
-                break
-        
-        triggered = self.home.automation.run_all(current_state)
-        messagebox.showinfo("完成", f"自动化规则检查完成！\n当前温度: {current_state['temperature']}°C\n"
-                                   f"是否有人: {'是' if current_state['has_person'] else '否'}\n"
+        """运行自动化规则（使用传感器中心维护的当前状态）"""
+        self.sensors.flush()
+        current_state = self.sensors.snapshot()
+        lines = []
+        for name, reading in self.sensors.readings.items():
+            value = "暂无数据" if reading.updated is None else reading.value
+            lines.append(f"{name}: {value}" + ("（已过期）" if reading.stale else ""))
+        sensor_text = "\n".join(lines)
+        
+        if self.home.automation.event_mode:
+            # 事件驱动模式：传感器数据由后台轮询更新，相关规则在数据变化时立即触发
+            messagebox.showinfo("完成", f"事件驱动模式下规则在传感器数据变化时自动触发。\n{sensor_text}")
+            self.refresh_all()
+            return
+        
+        # 增量计算：只重新计算状态变化涉及的规则，条件持续满足的规则不会重复触发
+        triggered = self.home.automation.run_changed(current_state)
+        messagebox.showinfo("完成", f"自动化规则检查完成！\n{sensor_text}\n"
                                    f"触发了 {triggered} 条规则。")
         self.refresh_all()
     
@@ -610,6 +691,13 @@ class SmartHomeGUI:
         self.refresh_logs()
 
 
+def parse_device_id(device_text):
+    """从设备列表的显示文本 "🟢 light (L01)" 中取出设备ID（没有时返回 None）"""
+    if "(" in device_text and ")" in device_text:
+        return device_text.split("(")[1].split(")")[0]
+    return None
+
+
 def main():
     """主函数"""
     root = tk.Tk()
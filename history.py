@@ -0,0 +1,345 @@
+"""
+设备属性历史（时间序列）：
+- 每台设备的每个属性（以及开关状态）一条序列，设备变化时记录 (时间, 值)
+- 最近的原始数据放在固定大小的环形缓冲区中；同时自动降采样为 1 分钟和 1 小时两级汇总
+  （每个时间段保存 次数、总和、最小值、最大值），用于查询更长的时间范围
+- 缓冲区在创建序列时按容量一次分配好，写满后覆盖最旧的数据：每条序列的内存固定，与运行时间无关
+- 数值、布尔值和开关状态（on=1, off=0）可以计算最小/最大/平均值；
+  其他取值较少的文字属性（例如空调模式）按编号保存，只能查看原始记录；
+  取值太多的文字属性（例如门锁的最后操作时间）不记录
+- 安装了 NumPy 时缓冲区使用 NumPy 数组并向量化查询，否则使用 array 模块（结果相同）
+
+用法：
+    history = AttributeHistory()
+    history.record("L01", "brightness", 80)
+    history.stats("L01", "brightness", window=3600)   # 最近一小时
+    history.samples("L01", "status")
+"""
+
+import threading
+import time
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 是可选依赖
+    np = None
+
+# 降采样级别：(名称, 时间段长度（秒）)
+TIERS = (("1min", 60), ("1h", 3600))
+
+
+class _Ring:
+    """
+    多列环形缓冲区（每列一个定长 float 数组）：
+    创建时按 capacity 分配好全部空间，写满后循环覆盖最旧的数据
+    """
+
+    __slots__ = ("capacity", "count", "head", "columns", "use_numpy")
+
+    def __init__(self, n_columns, capacity, use_numpy):
+        self.capacity = capacity
+        self.count = 0
+        self.head = 0          # 下一次写入的位置
+        self.use_numpy = use_numpy
+        if use_numpy:
+            self.columns = [np.zeros(capacity) for _ in range(n_columns)]
+        else:
+            self.columns = [array("d", bytes(8 * capacity)) for _ in range(n_columns)]
+
+    def append(self, row):
+        for column, value in zip(self.columns, row):
+            column[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def ordered(self, index):
+        """按时间顺序返回第 index 列"""
+        column = self.columns[index]
+        if self.count < self.capacity:
+            return column[:self.count]
+        if self.use_numpy:
+            return np.concatenate((column[self.head:], column[:self.head]))
+        return column[self.head:] + column[:self.head]
+
+    def first(self, index):
+        """最旧的一行的第 index 列（没有数据时返回 None）"""
+        if not self.count:
+            return None
+        return self.columns[index][self.head if self.count == self.capacity else 0]
+
+    @property
+    def wrapped(self):
+        """是否已经覆盖过旧数据"""
+        return self.count == self.capacity
+
+    def nbytes(self):
+        return 8 * self.capacity * len(self.columns)
+
+
+class _Tier:
+    """一级降采样：按固定时间段汇总（开始时间、次数、总和、最小值、最大值）"""
+
+    __slots__ = ("width", "ring", "open")
+
+    def __init__(self, width, capacity, use_numpy):
+        self.width = width
+        self.ring = _Ring(5, capacity, use_numpy)
+        self.open = None       # 当前还没结束的时间段 [开始时间, 次数, 总和, 最小值, 最大值]
+
+    def add(self, t, value):
+        start = t - t % self.width
+        bucket = self.open
+        if bucket is not None and start > bucket[0]:
+            self.ring.append(bucket)
+            bucket = None
+        if bucket is None:
+            self.open = [start, 1, value, value, value]
+        else:
+            # 时钟回拨时早于当前时间段的数据也计入当前时间段
+            bucket[1] += 1
+            bucket[2] += value
+            if value < bucket[3]:
+                bucket[3] = value
+            if value > bucket[4]:
+                bucket[4] = value
+
+    def oldest(self):
+        first = self.ring.first(0)
+        if first is not None:
+            return first
+        return None if self.open is None else self.open[0]
+
+
+class _Series:
+    """一个属性的历史：原始数据 + 各级降采样"""
+
+    __slots__ = ("raw", "tiers", "labels", "disabled")
+
+    def __init__(self, raw_capacity, tier_capacities, use_numpy):
+        self.raw = _Ring(2, raw_capacity, use_numpy)
+        self.tiers = [_Tier(width, capacity, use_numpy)
+                      for (_, width), capacity in zip(TIERS, tier_capacities)]
+        self.labels = None      # 文字属性：编号 -> 取值
+        self.disabled = False   # 文字取值太多，不再记录
+
+    def nbytes(self):
+        return self.raw.nbytes() + sum(tier.ring.nbytes() for tier in self.tiers)
+
+
+class AttributeHistory:
+    """
+    设备属性历史：
+    - record(device_id, key, value)：记录一次变化（SmartHome 在设备变化时自动调用）
+    - 内存上限：每条序列在第一次记录时分配固定的
+      8 × (2 × raw_capacity + 5 × (minute_capacity + hour_capacity)) 字节（默认 20416 字节，
+      见 max_bytes_per_series()），之后不再增长；每台设备的上限为 记录过的属性数（含开关状态）× 该值。
+      使用 NumPy 和 array 模块时相同
+    - samples(device_id, key, ...)：原始记录 [(时间, 值), ...]
+    - stats(device_id, key, ...)：时间范围内的 次数/最小/最大/平均值
+    - forget(device_id)：删除设备的历史
+    """
+
+    def __init__(self, raw_capacity=256, minute_capacity=240, hour_capacity=168,
+                 max_labels=16, use_numpy=True, clock=time.time):
+        """
+        :param raw_capacity: 每条序列最多保留的原始记录数
+        :param minute_capacity: 最多保留的 1 分钟汇总数（默认 4 小时）
+        :param hour_capacity: 最多保留的 1 小时汇总数（默认 7 天）
+        :param max_labels: 文字属性最多记录多少种不同的取值
+        :param use_numpy: 是否使用 NumPy（未安装时自动使用 array 模块）
+        :param clock: 时间函数（默认 time.time）
+        """
+        if min(raw_capacity, minute_capacity, hour_capacity) < 1:
+            raise ValueError("历史记录的容量必须大于 0")
+        self.raw_capacity = raw_capacity
+        self.tier_capacities = (minute_capacity, hour_capacity)
+        self.max_labels = max_labels
+        self.use_numpy = use_numpy and np is not None
+        self._clock = clock
+        self._series = {}      # {设备ID: {属性名: _Series}}
+        self._lock = threading.Lock()
+
+    # ---------------------------
+    # 记录
+    # ---------------------------
+    def record(self, device_id, key, value, t=None):
+        """
+        记录一次属性变化
+
+        :param device_id: 设备ID
+        :param key: 属性名（开关状态为 "status"）
+        :param value: 新的值
+        :param t: 时间（默认为现在）
+        """
+        with self._lock:
+            by_key = self._series.get(device_id)
+            if by_key is None:
+                by_key = self._series[device_id] = {}
+            series = by_key.get(key)
+            if series is None:
+                series = by_key[key] = _Series(self.raw_capacity, self.tier_capacities,
+                                               self.use_numpy)
+            if series.disabled:
+                return
+            number = self._encode(series, key, value)
+            if number is None:
+                return
+            t = self._clock() if t is None else t
+            series.raw.append((t, number))
+            if series.labels is None:
+                for tier in series.tiers:
+                    tier.add(t, number)
+
+    def _encode(self, series, key, value):
+        """把值转为数字；无法记录时返回 None"""
+        if key == "status" and value in ("on", "off"):
+            return 1.0 if value == "on" else 0.0
+        if isinstance(value, (bool, int, float)) and series.labels is None:
+            return float(value)
+        if value is None:
+            return None
+        # 文字属性：按取值编号
+        if series.labels is None:
+            if series.raw.count:
+                return None    # 之前记录的是数字，不混用
+            series.labels = []
+        if value not in series.labels:
+            if len(series.labels) >= self.max_labels:
+                series.disabled = True
+                return None
+            series.labels.append(value)
+        return float(series.labels.index(value))
+
+    def forget(self, device_id):
+        """删除设备的全部历史"""
+        with self._lock:
+            return self._series.pop(device_id, None) is not None
+
+    # ---------------------------
+    # 查询
+    # ---------------------------
+    def keys(self, device_id):
+        """设备有历史记录的属性名列表"""
+        with self._lock:
+            return [key for key, series in self._series.get(device_id, {}).items()
+                    if series.raw.count and not series.disabled]
+
+    def _window(self, window, start, end):
+        if window is not None:
+            end = self._clock() if end is None else end
+            start = end - window
+        return (float("-inf") if start is None else start,
+                float("inf") if end is None else end)
+
+    def samples(self, device_id, key, window=None, start=None, end=None):
+        """
+        原始记录（只包含仍在原始缓冲区中的数据）
+
+        :param window: 最近多少秒（与 start/end 二选一）
+        :return: [(时间, 值), ...]，开关状态返回 "on"/"off"
+        """
+        start, end = self._window(window, start, end)
+        with self._lock:
+            series = self._series.get(device_id, {}).get(key)
+            if series is None:
+                return []
+            times, values = series.raw.ordered(0), series.raw.ordered(1)
+            labels = list(series.labels) if series.labels is not None else None
+        result = []
+        for t, value in zip(times, values):
+            if start <= t <= end:
+                if labels is not None:
+                    value = labels[int(value)]
+                elif key == "status":
+                    value = "on" if value else "off"
+                else:
+                    value = float(value)
+                result.append((float(t), value))
+        return result
+
+    def stats(self, device_id, key, window=None, start=None, end=None):
+        """
+        时间范围内的统计（按记录次数平均，不按时间加权）
+
+        原始缓冲区覆盖整个范围时用原始数据计算，否则用能覆盖范围的最细一级汇总
+        （此时范围边界按汇总时间段对齐）
+
+        :param window: 最近多少秒（与 start/end 二选一）
+        :return: {"count", "min", "max", "mean", "resolution"}；没有数据或不是数值属性时返回 None
+        """
+        start, end = self._window(window, start, end)
+        with self._lock:
+            series = self._series.get(device_id, {}).get(key)
+            if series is None or series.labels is not None or not series.raw.count:
+                return None
+            raw = series.raw
+            if not raw.wrapped or raw.first(0) <= start:
+                resolution = "raw"
+                result = self._raw_stats(raw, start, end)
+            else:
+                tier = None
+                for (name, _), candidate in zip(TIERS, series.tiers):
+                    tier, resolution = candidate, name
+                    if not candidate.ring.wrapped or candidate.oldest() <= start:
+                        break
+                result = self._tier_stats(tier, start, end)
+        if result is None:
+            return None
+        count, low, high, total = result
+        return {"count": count, "min": low, "max": high, "mean": total / count,
+                "resolution": resolution}
+
+    def _raw_stats(self, raw, start, end):
+        times, values = raw.ordered(0), raw.ordered(1)
+        if self.use_numpy:
+            selected = values[(times >= start) & (times <= end)]
+            if not selected.size:
+                return None
+            return int(selected.size), float(selected.min()), float(selected.max()), \
+                float(selected.sum())
+        selected = [v for t, v in zip(times, values) if start <= t <= end]
+        if not selected:
+            return None
+        return len(selected), min(selected), max(selected), sum(selected)
+
+    def _tier_stats(self, tier, start, end):
+        ring = tier.ring
+        width = tier.width
+        columns = [ring.ordered(i) for i in range(5)]
+        if self.use_numpy:
+            mask = (columns[0] + width > start) & (columns[0] <= end)
+            count, total = columns[1][mask].sum(), columns[2][mask].sum()
+            low = columns[3][mask].min() if mask.any() else None
+            high = columns[4][mask].max() if mask.any() else None
+            count, total = int(count), float(total)
+            low = None if low is None else float(low)
+            high = None if high is None else float(high)
+        else:
+            count, total, low, high = 0, 0.0, None, None
+            for bucket_start, n, s, lo, hi in zip(*columns):
+                if bucket_start + width > start and bucket_start <= end:
+                    count += int(n)
+                    total += s
+                    low = lo if low is None else min(low, lo)
+                    high = hi if high is None else max(high, hi)
+        bucket = tier.open
+        if bucket is not None and bucket[0] + width > start and bucket[0] <= end:
+            count += bucket[1]
+            total += bucket[2]
+            low = bucket[3] if low is None else min(low, bucket[3])
+            high = bucket[4] if high is None else max(high, bucket[4])
+        if not count:
+            return None
+        return count, low, high, total
+
+    def memory_bytes(self):
+        """所有缓冲区当前占用的字节数（不含 Python 对象本身的开销）"""
+        with self._lock:
+            return sum(series.nbytes() for by_key in self._series.values()
+                       for series in by_key.values())
+
+    def max_bytes_per_series(self):
+        """每条序列缓冲区的字节数上限"""
+        return 8 * (2 * self.raw_capacity + 5 * sum(self.tier_capacities))
@@ -0,0 +1,91 @@
+"""
+预写日志（journal）：
+- 每次修改只追加一条紧凑的 JSON 记录（每行一条），不重写整个 data.json
+- 定期做检查点：把完整状态写入快照文件，然后清空 journal
+- 启动时先加载快照，再重放 journal 中的剩余记录
+"""
+
+import json
+import os
+import threading
+
+
+class Journal:
+    """
+    追加写入的操作日志：
+    - append(record)：追加一条记录并立即刷新到操作系统
+    - replay()：按顺序读出所有记录（忽略崩溃时写了一半的最后一行）
+    - reset()：检查点完成后清空
+    """
+
+    def __init__(self, path="data.journal", checkpoint_every=1000, fsync=False):
+        """
+        :param path: journal 文件路径
+        :param checkpoint_every: 累积多少条记录后建议做一次检查点
+        :param fsync: 是否每条记录都调用 os.fsync（更安全但更慢）
+        """
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.fsync = fsync
+        self.pending = 0      # 上次检查点之后追加的记录数
+        self._file = None
+        self._lock = threading.Lock()   # 多个线程同时追加时保证每条记录完整
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        return self._file
+
+    def append(self, record):
+        """追加一条记录"""
+        self.append_many([record])
+
+    def append_many(self, records):
+        """一次写入多条记录"""
+        if not records:
+            return
+        data = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n"
+                       for r in records)
+        with self._lock:
+            f = self._open()
+            f.write(data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+            self.pending += len(records)
+
+    def needs_checkpoint(self):
+        """记录数是否已经达到检查点阈值"""
+        return self.pending >= self.checkpoint_every
+
+    def replay(self):
+        """
+        读出 journal 中的全部记录
+
+        :return: 记录生成器
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 崩溃时可能只写了半行，之后的内容不可信
+                        break
+                    self.pending += 1
+                    yield record
+        except FileNotFoundError:
+            return
+
+    def reset(self):
+        """清空 journal（检查点写入快照之后调用）"""
+        with self._lock:
+            self.close()
+            with open(self.path, "w", encoding="utf-8"):
+                pass
+            self.pending = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
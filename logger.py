@@ -1,81 +1,830 @@
+import atexit
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
 from datetime import datetime
+from functools import lru_cache
 
 class Logger:
     """
     日志记录类：
     - 记录所有设备操作和系统事件
     - 支持详细的日志信息（操作类型、用户、设备、状态变化等）
+    - 支持缓冲写入模式（buffered=True）：日志先进入队列，由后台线程批量写入文件
+    - 读取最近日志时从文件末尾向前读取，并缓存上次读到的位置
+    - 支持按大小/时间轮转日志（logs.txt.1、logs.txt.2 ...），每段附带索引文件，
+      query() 按时间范围、设备、用户查询时直接跳过无关的段
+    - fmt="jsonl" 时每行写一个 JSON 对象（结构化日志），iter_events() 流式读取并过滤
     """
 
-    def __init__(self, log_file="logs.txt"):
-        """初始化日志记录器"""
+    def __init__(self, log_file="logs.txt", buffered=False, batch_size=256,
+                 flush_interval=1.0, max_queue=10000, overflow="block",
+                 rotate_bytes=None, rotate_interval=None, fmt="text"):
+        """
+        初始化日志记录器
+
+        :param log_file: 日志文件路径
+        :param buffered: 是否启用缓冲写入（后台线程批量写文件）
+        :param batch_size: 队列中积累多少条日志后立即写入
+        :param flush_interval: 最长多少秒写入一次（即使没有达到 batch_size）
+        :param max_queue: 队列最大长度
+        :param overflow: 队列满时的处理方式
+            - "block"：等待后台线程写出后再放入（不丢日志）
+            - "drop_new"：丢弃新日志
+            - "drop_old"：丢弃队列中最旧的日志
+        :param rotate_bytes: 当前日志文件超过多少字节时轮转（None 表示不按大小轮转）
+        :param rotate_interval: 当前日志文件写了多少秒后轮转（None 表示不按时间轮转）
+        :param fmt: 日志格式
+            - "text"：[时间] 操作 | 用户: xx | 设备: name(ID) ...
+            - "jsonl"：每行一个 JSON 对象，字段见 _make_event
+        """
+        if overflow not in ("block", "drop_new", "drop_old"):
+            raise ValueError(f"未知的队列溢出策略: {overflow}")
+        if fmt not in ("text", "jsonl"):
+            raise ValueError(f"未知的日志格式: {fmt}")
         self.log_file = log_file
+        self.buffered = buffered
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.rotate_bytes = rotate_bytes
+        self.rotate_interval = rotate_interval
+        self.fmt = fmt
+        self.dropped = 0          # 因队列已满被丢弃的日志条数
+        # 时间戳缓存（同一秒内的日志复用格式化结果）；(秒, 文本) 整体替换，多线程下不会错配
+        self._ts = (None, "")
+
+        # 最近日志缓存：上次读到的文件位置和最后若干行
+        self._tail_lines = None   # deque，保存完整的最后若干行
+        self._tail_partial = b""  # 文件末尾还没有换行符的半行
+        self._tail_offset = 0     # 已经读到的文件位置
+        self._tail_inode = None   # 文件被替换（例如日志轮转）时缓存失效
+
+        # 当前段（log_file 本身）的状态：写同一个文件的所有 Logger 共用（见 _ActiveSegment）
+        self._active = _active_segment(log_file)
+        self._index_cache = {}    # 已轮转段的索引缓存 {路径: (修改时间, 索引)}
 
-    def log_action(self, action, device=None, username=None, extra_info=None):
+        if buffered:
+            self._queue = deque()
+            self._cond = threading.Condition()
+            self._writing = 0     # 后台线程正在写入的条数
+            self._threshold = min(batch_size, max_queue)
+            self._flush_requested = False
+            self._closed = False
+            self._thread = threading.Thread(target=self._writer_loop, name="log-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _timestamp(self):
+        """返回 (当前秒, 时间字符串)（同一秒内只格式化一次）"""
+        now = int(time.time())
+        ts = self._ts
+        if now != ts[0]:
+            ts = self._ts = (now, datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S"))
+        return ts
+
+    def log_action(self, action, device=None, username=None, extra_info=None, code=None):
         """
         记录操作日志
-        
+
         :param action: 操作描述（字符串）
         :param device: 设备对象或设备ID（可选）
         :param username: 用户名（可选）
         :param extra_info: 额外信息字典（可选）
+        :param code: 操作代码，例如 "device.turn_on"（可选，只写入结构化日志）
+        """
+        entry, text = self._make_entry(action, device, username, extra_info, code)
+        if self.buffered:
+            self._enqueue(entry)
+        else:
+            self._write_entries([entry])
+        return text
+
+    def log_many(self, records):
+        """
+        一次记录多条日志（同步模式下只打开、写入一次文件）
+
+        :param records: [(action, device, username, extra_info, code), ...]，
+                        每项与 log_action 的参数顺序相同，后面的参数可以省略
+        :return: 写入的日志行列表
         """
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
+        made = [self._make_entry(*record) for record in records]
+        if not made:
+            return []
+        if self.buffered:
+            for entry, _ in made:
+                self._enqueue(entry)
+        else:
+            self._write_entries([entry for entry, _ in made])
+        return [text for _, text in made]
+
+    def _make_entry(self, action, device=None, username=None, extra_info=None, code=None):
+        """构建一条日志，返回 (写入队列的条目, 日志行)"""
+        if self.fmt == "jsonl":
+            return self._make_event(action, device, username, extra_info, code)
+
         # 构建日志条目
-        log_entry = f"[{timestamp}] {action}"
-        
+        second, time_text = self._timestamp()
+        parts = [f"[{time_text}] {action}"]
+
         # 添加用户名信息
         if username:
-            log_entry += f" | 用户: {username}"
-        
+            parts.append(f"用户: {username}")
+
         # 添加设备信息
+        device_ids = ()
         if device:
             if isinstance(device, str):
                 # 如果是设备ID字符串
-                log_entry += f" | 设备ID: {device}"
+                parts.append(f"设备ID: {device}")
+                device_ids = (device,)
             else:
                 # 如果是设备对象
-                log_entry += f" | 设备: {device.name}({device.device_id})"
+                parts.append(f"设备: {device.name}({device.device_id})")
+                device_ids = (device.device_id,)
                 if device.status:
-                    log_entry += f" | 状态: {device.status}"
-        
+                    parts.append(f"状态: {device.status}")
+
         # 添加额外信息
         if extra_info:
             for key, value in extra_info.items():
-                log_entry += f" | {key}: {value}"
-        
-        # 写入文件
-        with open(self.log_file, "a", encoding="utf-8") as f:
-            f.write(log_entry + "\n")
-        
-        return log_entry
+                parts.append(f"{key}: {value}")
+            if "device_id" in extra_info:
+                device_ids += (str(extra_info["device_id"]),)
+
+        log_entry = " | ".join(parts)
+        return (log_entry + "\n", second, device_ids, username), log_entry
+
+    def _make_event(self, action, device, username, extra_info, code):
+        """
+        构建一条结构化日志，字段：
+            ts          时间戳（秒，保留到毫秒）
+            action      操作代码（例如 "device.turn_on"）
+            message     操作描述
+            username    用户名
+            device_id / device_name
+            old_status / new_status
+            extra       其余额外信息（保留原始类型）
+        """
+        now = time.time()
+        extra = dict(extra_info) if extra_info else {}
+        event = {"ts": round(now, 3), "action": code or _infer_code(action), "message": action,
+                 "username": username, "device_id": None, "device_name": None,
+                 "old_status": extra.pop("old_status", None), "new_status": None}
+
+        if isinstance(device, str):
+            event["device_id"] = device
+        elif device:
+            event["device_id"] = device.device_id
+            event["device_name"] = device.name
+            event["new_status"] = device.status
+        # extra_info 里的 device_id 与设备相同时不再重复保存
+        if "device_id" in extra and (event["device_id"] is None
+                                     or extra["device_id"] == event["device_id"]):
+            event["device_id"] = str(extra.pop("device_id"))
+        event["extra"] = extra
+
+        device_ids = (event["device_id"],) if event["device_id"] else ()
+        if "device_id" in extra:
+            device_ids += (str(extra["device_id"]),)
+
+        line = json.dumps(event, ensure_ascii=False, separators=(",", ":"), default=str)
+        return (line + "\n", int(now), device_ids, username), line
+
+    # ---------------------------
+    # 写入与轮转
+    # ---------------------------
+    def _write_entries(self, entries):
+        """
+        把日志写入当前段（需要时先轮转），并更新当前段的索引
+
+        :param entries: [(日志行, 时间戳秒, 设备ID元组, 用户名)]
+        """
+        active = self._active
+        with active.lock:
+            if active.size and self._rotation_due(entries[0][1]):
+                self.rotate()
+            with open(self.log_file, "a", encoding="utf-8") as f:
+                f.write("".join(entry[0] for entry in entries))
+                if self.rotate_bytes:
+                    f.flush()
+                    active.size = os.fstat(f.fileno()).st_size
+                else:
+                    active.size += 1   # 只需要知道文件是否为空
+
+            index = active.index
+            if index["start"] is None:
+                index["start"] = entries[0][1]
+            index["end"] = entries[-1][1]
+            index["lines"] += len(entries)
+            for _, _, device_ids, username in entries:
+                index["devices"].update(device_ids)
+                if username:
+                    index["users"].add(username)
+
+    def _rotation_due(self, now):
+        """当前段是否达到轮转条件"""
+        if self.rotate_bytes and self._active.size >= self.rotate_bytes:
+            return True
+        start = self._active.index["start"]
+        if self.rotate_interval and start is not None and now - start >= self.rotate_interval:
+            return True
+        return False
+
+    def rotate(self):
+        """
+        轮转日志：当前文件改名为 logs.txt.N，并写入索引文件 logs.txt.N.idx
+        """
+        active = self._active
+        with active.lock:
+            if not os.path.exists(self.log_file):
+                return
+            index = active.index
+            if not index["complete"]:
+                index = _build_index(self.log_file)
+
+            segments = self._segments()
+            number = segments[-1][0] + 1 if segments else 1
+            segment_path = f"{self.log_file}.{number}"
+            os.replace(self.log_file, segment_path)
+            with open(segment_path + ".idx", "w", encoding="utf-8") as f:
+                json.dump({
+                    "start": index["start"],
+                    "end": index["end"],
+                    "lines": index["lines"],
+                    "devices": sorted(index["devices"]),
+                    "users": sorted(index["users"]),
+                }, f, ensure_ascii=False)
+
+            active.index = _new_index()
+            active.size = 0
+
+    def _segments(self):
+        """已轮转的日志段 [(编号, 路径)]，按编号从旧到新排列"""
+        directory = os.path.dirname(self.log_file) or "."
+        pattern = re.compile(re.escape(os.path.basename(self.log_file)) + r"\.(\d+)$")
+        segments = []
+        for name in os.listdir(directory):
+            match = pattern.match(name)
+            if match:
+                segments.append((int(match.group(1)), os.path.join(directory, name)))
+        segments.sort()
+        return segments
+
+    def _segment_index(self, path):
+        """读取某个已轮转段的索引文件（带缓存），没有索引文件时现场生成"""
+        try:
+            mtime = os.path.getmtime(path + ".idx")
+        except FileNotFoundError:
+            return _build_index(path)
+        cached = self._index_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path + ".idx", "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = _new_index()
+        index.update(start=data["start"], end=data["end"], lines=data["lines"],
+                     devices=set(data["devices"]), users=set(data["users"]))
+        self._index_cache[path] = (mtime, index)
+        return index
+
+    # ---------------------------
+    # 查询
+    # ---------------------------
+    def query(self, start=None, end=None, device_id=None, username=None, action=None):
+        """
+        按时间范围、设备、用户查询日志（通过段索引跳过无关的段）
+
+        例如"谁在上周操作过 D01"：
+            logger.query(start=上周一, end=本周一, device_id="D01")
+
+        :param start: 开始时间（datetime、时间戳秒或 "YYYY-MM-DD HH:MM:SS"，包含）
+        :param end: 结束时间（同上，包含）
+        :param device_id: 设备ID（可选）
+        :param username: 用户名（可选）
+        :param action: 操作代码（可选）
+        :return: 匹配的日志行列表（从旧到新）
+        """
+        return [line for line, _ in self._iter_matching(start, end, device_id, username, action)]
+
+    def iter_events(self, start=None, end=None, device_id=None, username=None, action=None,
+                    predicate=None):
+        """
+        流式读取结构化日志事件（生成器，内存占用与日志总量无关）
+
+        过滤条件会尽量下推：先用段索引跳过整个文件，再用子串匹配跳过不相关的行，
+        只有可能匹配的行才会被解析。文本格式的旧日志也能读取（会转换为相同的字段）。
+
+        :param start: 开始时间（包含）
+        :param end: 结束时间（包含）
+        :param device_id: 设备ID（可选）
+        :param username: 用户名（可选）
+        :param action: 操作代码，例如 "device.turn_on"（可选）
+        :param predicate: 额外的过滤函数 predicate(event) -> bool（可选）
+        :return: 事件字典生成器（从旧到新）
+        """
+        for _, event in self._iter_matching(start, end, device_id, username, action):
+            if predicate is None or predicate(event):
+                yield event
+
+    def _iter_matching(self, start, end, device_id, username, action):
+        """依次扫描所有可能匹配的段，生成 (原始行, 事件)"""
+        self.flush()
+        start = _to_epoch(start)
+        end = _to_epoch(end)
+        segments = [(path, self._segment_index(path)) for _, path in self._segments()]
+        segments.append((self.log_file, self._active.index))
+
+        for path, index in segments:
+            if index["complete"] and not _index_may_match(index, start, end, device_id, username):
+                continue
+            try:
+                yield from _scan_segment(path, start, end, device_id, username, action)
+            except FileNotFoundError:
+                continue
+
+    # ---------------------------
+    # 缓冲写入
+    # ---------------------------
+    def _enqueue(self, entry):
+        """把一条日志放入队列（按溢出策略处理队列已满的情况）"""
+        with self._cond:
+            if self._closed:
+                # 已关闭（例如程序退出后仍有日志），直接同步写入
+                self._write_entries([entry])
+                return
+            if len(self._queue) >= self.max_queue:
+                if self.overflow == "drop_new":
+                    self.dropped += 1
+                    return
+                elif self.overflow == "drop_old":
+                    self._queue.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self._queue) >= self.max_queue and not self._closed:
+                        self._cond.notify_all()
+                        self._cond.wait()
+            self._queue.append(entry)
+            if len(self._queue) >= self._threshold:
+                self._cond.notify_all()
+
+    def _writer_loop(self):
+        """后台线程：按数量或时间阈值批量写入日志文件"""
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while (len(self._queue) < self._threshold
+                       and not self._flush_requested and not self._closed):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = list(self._queue)
+                self._queue.clear()
+                self._flush_requested = False
+                self._writing = len(batch)
+                closed = self._closed
+                self._cond.notify_all()   # 唤醒等待队列空位的生产者
+            if batch:
+                self._write_entries(batch)
+            with self._cond:
+                self._writing = 0
+                self._cond.notify_all()   # 唤醒等待 flush 完成的线程
+            if closed:
+                break
+
+    def flush(self):
+        """等待队列中的日志全部写入文件"""
+        if not self.buffered:
+            return
+        with self._cond:
+            while (self._queue or self._writing) and self._thread.is_alive():
+                # 让后台线程立即写出，不必等到 flush_interval
+                self._flush_requested = True
+                self._cond.notify_all()
+                self._cond.wait(0.05)
+
+    def close(self):
+        """写出剩余日志并停止后台线程（程序退出时自动调用）"""
+        if not self.buffered:
+            return
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
 
     def get_recent_logs(self, lines=10):
         """
         获取最近的日志条目
-        
+
         :param lines: 要获取的行数
         :return: 日志行列表
         """
+        self.flush()
         try:
-            with open(self.log_file, "r", encoding="utf-8") as f:
-                all_lines = f.readlines()
-                return all_lines[-lines:] if len(all_lines) > lines else all_lines
+            stat = os.stat(self.log_file)
         except FileNotFoundError:
             return []
 
+        cache = self._tail_lines
+        if (cache is None or cache.maxlen < lines or stat.st_ino != self._tail_inode
+                or stat.st_size < self._tail_offset):
+            # 没有可用缓存：从文件末尾向前读取
+            # 按缓存容量读取，之后请求更多行时（不超过容量）缓存仍然完整
+            size = max(lines, 100)
+            tail, partial = _read_tail(self.log_file, size, stat.st_size)
+            cache = deque(tail, maxlen=size)
+            self._tail_partial = partial
+        elif stat.st_size > self._tail_offset:
+            # 只读取上次之后新追加的内容
+            with open(self.log_file, "rb") as f:
+                f.seek(self._tail_offset)
+                data = self._tail_partial + f.read(stat.st_size - self._tail_offset)
+            *complete, self._tail_partial = data.split(b"\n")
+            cache.extend(line.decode("utf-8", errors="replace") + "\n" for line in complete)
+
+        self._tail_lines = cache
+        self._tail_offset = stat.st_size
+        self._tail_inode = stat.st_ino
+
+        result = list(cache)
+        if self._tail_partial:
+            result.append(self._tail_partial.decode("utf-8", errors="replace"))
+        result = result[-lines:] if lines > 0 else []
+        if self.fmt == "jsonl":
+            # 结构化日志转换回便于阅读的文本格式
+            result = [format_event(event) + "\n" if event else line
+                      for line, event in ((line, parse_event(line)) for line in result)]
+        return result
+
+
+class _ActiveSegment:
+    """
+    当前段的状态：文件大小、索引和写入锁。
+    同一进程中写同一个日志文件的 Logger（例如全局的 log() 和界面里另建的 Logger）共用一份，
+    其中一个轮转后，其他实例看到的也是新段的索引
+    """
+
+    __slots__ = ("size", "index", "lock")
+
+    def __init__(self, path):
+        self.lock = threading.RLock()   # 写文件、轮转、更新索引（多线程同时记录日志时）
+        self.index = _new_index()
+        try:
+            self.size = os.path.getsize(path)
+        except FileNotFoundError:
+            self.size = 0
+        if self.size:
+            # 文件里已有本进程之前写入的内容，索引不完整，查询时需要扫描
+            self.index["complete"] = False
+            self.index["start"] = _first_line_time(path)
+
+
+_active_segments = {}    # {日志文件绝对路径: _ActiveSegment}
+_active_segments_lock = threading.Lock()
+
+
+def _active_segment(path):
+    """返回日志文件对应的共享当前段状态（第一次使用时创建）"""
+    key = os.path.abspath(path)
+    with _active_segments_lock:
+        active = _active_segments.get(key)
+        if active is None or (active.size and not os.path.exists(path)):
+            # 第一次使用，或文件已被删除（不再沿用旧文件的大小和索引）
+            active = _active_segments[key] = _ActiveSegment(path)
+        return active
+
+
+def _new_index():
+    """创建一个空的段索引"""
+    return {"start": None, "end": None, "lines": 0, "devices": set(), "users": set(),
+            "complete": True}
+
+
+def _to_epoch(value):
+    """把 datetime / 时间戳 / "YYYY-MM-DD HH:MM:SS" 字符串统一转换为时间戳秒"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp()
+
+
+def _format_time(epoch):
+    """时间戳秒 -> 日志中使用的时间字符串"""
+    return datetime.fromtimestamp(int(epoch)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+@lru_cache(maxsize=4096)
+def _parse_time(text):
+    """日志中的时间字符串 -> 时间戳秒（同一秒的大量日志只解析一次）"""
+    return datetime.strptime(text, "%Y-%m-%d %H:%M:%S").timestamp()
+
+
+# 文本日志的操作描述前缀 -> 操作代码（导入旧日志时使用）
+LEGACY_ACTION_CODES = (
+    ("添加用户", "user.add"),
+    ("删除用户", "user.remove"),
+    ("添加设备", "device.add"),
+    ("删除设备", "device.remove"),
+    ("打开设备", "device.turn_on"),
+    ("关闭设备", "device.turn_off"),
+    ("设置设备属性", "device.set_attr"),
+    ("执行设备操作", "device.action"),
+    ("自动化规则触发", "automation.trigger"),
+    ("系统数据已保存", "system.save"),
+    ("journal 检查点完成", "system.checkpoint"),
+)
+
+
+def _infer_code(message):
+    """根据操作描述推断操作代码（无法识别时返回 None）"""
+    for prefix, code in LEGACY_ACTION_CODES:
+        if message.startswith(prefix):
+            return code
+    if message.startswith("设备 ") and "被共享给用户" in message:
+        return "device.share"
+    return None
+
+
+def parse_log_line(line):
+    """
+    解析一行文本日志
+
+    格式：[时间] 操作 | 用户: xx | 设备: name(ID) | 状态: on | key: value ...
+
+    :return: 字段字典（time/action/username/device_id/device_name/status/extra），
+             不是标准格式的行返回 None
+    """
+    line = line.rstrip("\n")
+    if not line.startswith("[") or "] " not in line:
+        return None
+    time_text, _, rest = line[1:].partition("] ")
+    fields = rest.split(" | ")
+    event = {"time": time_text, "action": fields[0], "username": None, "device_id": None,
+             "device_name": None, "status": None, "extra": {}}
+    for field in fields[1:]:
+        key, sep, value = field.partition(": ")
+        if not sep:
+            continue
+        if key == "用户":
+            event["username"] = value
+        elif key == "设备":
+            name, _, device_id = value.rpartition("(")
+            event["device_name"] = name
+            event["device_id"] = device_id.rstrip(")")
+        elif key == "设备ID":
+            event["device_id"] = value
+        elif key == "状态":
+            event["status"] = value
+        else:
+            event["extra"][key] = value
+    if event["device_id"] is None:
+        event["device_id"] = event["extra"].get("device_id")
+    return event
+
+
+def parse_event(line):
+    """
+    把一行日志（JSON 或文本格式）解析为结构化事件字典
+
+    :return: 与 fmt="jsonl" 写入的字段相同的字典，无法解析的行返回 None
+    """
+    if line.startswith("{"):
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+    parsed = parse_log_line(line)
+    if parsed is None:
+        return None
+    try:
+        ts = _parse_time(parsed["time"])
+    except ValueError:
+        return None
+    extra = parsed["extra"]
+    device_id = parsed["device_id"]
+    if "device_id" in extra and extra["device_id"] == device_id:
+        del extra["device_id"]
+    return {"ts": ts, "action": _infer_code(parsed["action"]), "message": parsed["action"],
+            "username": parsed["username"], "device_id": device_id,
+            "device_name": parsed["device_name"], "old_status": extra.pop("old_status", None),
+            "new_status": parsed["status"], "extra": extra}
+
+
+def format_event(event):
+    """把结构化事件格式化为文本日志行（不含换行符）"""
+    parts = [f"[{_format_time(event['ts'])}] {event['message']}"]
+    if event.get("username"):
+        parts.append(f"用户: {event['username']}")
+    if event.get("device_name"):
+        parts.append(f"设备: {event['device_name']}({event['device_id']})")
+        if event.get("new_status"):
+            parts.append(f"状态: {event['new_status']}")
+    elif event.get("device_id"):
+        parts.append(f"设备ID: {event['device_id']}")
+    if event.get("old_status") is not None:
+        parts.append(f"old_status: {event['old_status']}")
+    for key, value in (event.get("extra") or {}).items():
+        parts.append(f"{key}: {value}")
+    return " | ".join(parts)
+
+
+def _event_device_ids(event):
+    """事件涉及的设备ID（设备本身以及 extra 中的 device_id）"""
+    extra_id = (event.get("extra") or {}).get("device_id")
+    return [str(d) for d in (event.get("device_id"), extra_id) if d]
+
+
+def _first_line_time(path):
+    """读取文件第一行日志的时间戳（无法解析时返回 None）"""
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            event = parse_event(f.readline())
+        return int(event["ts"]) if event else None
+    except FileNotFoundError:
+        return None
+
+
+def _build_index(path):
+    """扫描整个日志文件生成段索引（用于没有索引的旧日志文件）"""
+    index = _new_index()
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            event = parse_event(line)
+            index["lines"] += 1
+            if event is None:
+                continue
+            ts = int(event["ts"])
+            if index["start"] is None:
+                index["start"] = ts
+            index["end"] = ts
+            index["devices"].update(_event_device_ids(event))
+            if event["username"]:
+                index["users"].add(event["username"])
+    return index
+
+
+def _index_may_match(index, start, end, device_id, username):
+    """根据段索引判断该段是否可能包含匹配的日志"""
+    if index["start"] is None:
+        return False
+    if start is not None and index["end"] < int(start):
+        return False
+    if end is not None and index["start"] > end:
+        return False
+    if device_id is not None and device_id not in index["devices"]:
+        return False
+    if username is not None and username not in index["users"]:
+        return False
+    return True
+
+
+def _scan_segment(path, start, end, device_id, username, action):
+    """逐行扫描一个日志段，生成匹配的 (原始行, 事件)"""
+    # 文本日志中的时间格式可以直接按字符串比较大小，不必解析
+    start_text = _format_time(start) if start is not None else None
+    end_text = _format_time(end) if end is not None else None
+    # 结构化日志中操作代码的固定写法，用于子串预过滤
+    action_needle = f'"action":{json.dumps(action, ensure_ascii=False)}' if action else None
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            # 先用子串判断快速排除，再完整解析
+            if device_id is not None and device_id not in line:
+                continue
+            if username is not None and username not in line:
+                continue
+            if line.startswith("{"):
+                if action_needle is not None and action_needle not in line:
+                    continue
+            elif line.startswith("["):
+                if start_text is not None and line[1:20] < start_text:
+                    continue
+                if end_text is not None and line[1:20] > end_text:
+                    continue
+            event = parse_event(line)
+            if event is None:
+                continue
+            if start is not None and event["ts"] < start:
+                continue
+            if end is not None and int(event["ts"]) > end:
+                continue
+            if device_id is not None and device_id not in _event_device_ids(event):
+                continue
+            if username is not None and event["username"] != username:
+                continue
+            if action is not None and event["action"] != action:
+                continue
+            yield line, event
+
+
+def _read_tail(path, lines, end, block_size=8192):
+    """
+    从文件末尾向前按块读取最后若干行（耗时只与行数有关，与文件大小无关）
+
+    :param path: 文件路径
+    :param lines: 需要的完整行数
+    :param end: 读取的结束位置（文件大小）
+    :return: (完整行列表, 末尾没有换行符的半行 bytes)
+    """
+    chunks = []
+    newlines = 0
+    pos = end
+    with open(path, "rb") as f:
+        # 多读一个换行符，保证最前面那一行是完整的
+        while pos > 0 and newlines <= lines:
+            size = min(block_size, pos)
+            pos -= size
+            f.seek(pos)
+            chunk = f.read(size)
+            chunks.append(chunk)
+            newlines += chunk.count(b"\n")
+    data = b"".join(reversed(chunks))
+    *complete, partial = data.split(b"\n")
+    if pos > 0:
+        complete = complete[1:]     # 第一段是被块边界截断的行
+    complete = complete[-lines:] if lines > 0 else []
+    return [line.decode("utf-8", errors="replace") + "\n" for line in complete], partial
+
 
 # 创建全局日志记录器实例
 _logger = Logger()
 
-def log(action, device=None, username=None, extra_info=None):
+def log(action, device=None, username=None, extra_info=None, code=None):
     """
     便捷的日志记录函数（保持向后兼容）
-    
+
     :param action: 操作描述
     :param device: 设备对象或设备ID
     :param username: 用户名
     :param extra_info: 额外信息
+    :param code: 操作代码（结构化日志使用）
+    """
+    return _logger.log_action(action, device, username, extra_info, code)
+
+
+def log_many(records):
+    """
+    一次记录多条日志（见 Logger.log_many）
+
+    :param records: [(action, device, username, extra_info, code), ...]
     """
-    return _logger.log_action(action, device, username, extra_info)
+    return _logger.log_many(records)
+
+
+def get_logger():
+    """当前的全局日志记录器"""
+    return _logger
+
+
+def configure(**kwargs):
+    """
+    替换全局日志记录器（例如启用缓冲写入：configure(buffered=True)）
+
+    :param kwargs: 传给 Logger 构造函数的参数
+    :return: 新的日志记录器
+    """
+    global _logger
+    old = _logger
+    _logger = Logger(**kwargs)
+    old.close()
+    return _logger
+
+
+def import_text_log(text_path, jsonl_path):
+    """
+    把旧的文本日志转换为结构化日志（JSONL）
+
+    :param text_path: 文本日志路径
+    :param jsonl_path: 输出的 JSONL 文件路径
+    :return: 转换的事件条数（无法解析的行会被跳过）
+    """
+    count = 0
+    with open(text_path, "r", encoding="utf-8", errors="replace") as src, \
+            open(jsonl_path, "w", encoding="utf-8") as dst:
+        for line in src:
+            event = parse_event(line)
+            if event is None:
+                continue
+            dst.write(json.dumps(event, ensure_ascii=False, separators=(",", ":"), default=str) + "\n")
+            count += 1
+    return count
+
+
+def main():
+    if len(sys.argv) != 4 or sys.argv[1] != "import":
+        print("用法: python logger.py import logs.txt logs.jsonl")
+        sys.exit(1)
+    count = import_text_log(sys.argv[2], sys.argv[3])
+    print(f"已导入 {count} 条日志: {sys.argv[2]} -> {sys.argv[3]}")
+
+
+if __name__ == "__main__":
+    main()
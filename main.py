@@ -1,38 +1,41 @@
 import smart_home
-from automation import AutomationRule
+from automation import RULE_TEMPLATES
+from scene import SCENE_TEMPLATES
+from sensor_hub import SensorHub, simulated_sensors
 from logger import Logger
 
-# 创建系统实例
-home = smart_home.SmartHome()
-logger = Logger()
-
-print("欢迎进入智能家居控制系统！")
 
-def get_current_state():
+def start_home():
     """
-    获取当前系统状态（用于自动化规则）
-    这里模拟一些传感器数据
+    创建系统实例并启动后台服务：定时规则的时间轮、传感器轮询
+    （性能指标默认不收集，在"数据管理 → 查看性能指标"中按需启用）
+    （懒加载：设备对象在第一次使用时才创建；后台线程会修改设备，所以使用线程安全模式）
+
+    :return: (SmartHome 对象, SensorHub 对象)
     """
-    # 模拟温度传感器（实际可以从真实传感器获取）
-    import random
-    temperature = random.randint(20, 35)  # 模拟温度 20-35度
-    
-    # 模拟是否有人（实际可以从运动传感器获取）
-    has_person = random.choice([True, False])
-    
-    # 检查门锁状态
-    door_locked = True
-    for device in home.devices.values():
-        if device.name == "doorlock":
-            door_locked = device.attributes.get("locked", True)
-            break
-    
-    return {
-        "temperature": temperature,
-        "has_person": has_person,
-        "door_locked": door_locked,
-        "devices": home.devices
-    }
+    new_home = smart_home.SmartHome(storage="lazy", thread_safe=True, history=True)
+    # 这里使用模拟的温度和人体传感器，接入真实传感器时替换为对应的 SensorProvider
+    # 读数先进入队列，由时间轮线程写入状态：事件模式下触发的规则动作再慢也不会挡住传感器轮询
+    new_sensors = SensorHub(new_home, simulated_sensors(), deferred=True)
+    new_home.automation.state_provider = new_sensors.snapshot
+    scheduler = new_home.automation.scheduler
+    scheduler.call_every(scheduler.tick, new_sensors.flush)
+    scheduler.start()
+    new_sensors.start()
+    return new_home, new_sensors
+
+
+def stop_home():
+    """停止后台服务"""
+    sensors.stop()
+    home.automation.scheduler.stop()
+    home.stop_metrics()
+
+
+home, sensors = start_home()
+logger = Logger()
+
+print("欢迎进入智能家居控制系统！")
 
 while True:
     print("\n" + "="*30)
@@ -46,6 +49,7 @@ while True:
     print("6. 查看日志")
     print("7. 数据管理")
     print("8. 运行自动化规则")
+    print("9. 场景")
     print("0. 退出系统")
     print("="*30)
 
@@ -85,6 +89,7 @@ while True:
         print("1. 添加设备")
         print("2. 删除设备")
         print("3. 查看所有设备")
+        print("4. 查看设备属性历史")
         sub_choice = input("请选择：").strip()
         
         if sub_choice == "1":
@@ -110,6 +115,28 @@ while True:
         elif sub_choice == "3":
             home.show_devices()
 
+        elif sub_choice == "4":
+            did = input("设备ID：").strip()
+            keys = home.history.keys(did)
+            if not keys:
+                print("该设备还没有历史记录。")
+                continue
+            for window, label in ((3600, "最近 1 小时"), (86400, "最近 24 小时")):
+                print(f"\n{label}：")
+                for key in keys:
+                    stats = home.history.stats(did, key, window=window)
+                    if stats is None:
+                        samples = home.history.samples(did, key, window=window)
+                        if samples:
+                            print(f"  {key}: 最近的值 {samples[-1][1]}（{len(samples)} 次变化）")
+                        continue
+                    if key == "status":
+                        print(f"  {key}: {stats['count']} 次变化"
+                              f"（开启 {round(stats['mean'] * stats['count'])} 次）")
+                    else:
+                        print(f"  {key}: 最小 {stats['min']:g}，最大 {stats['max']:g}，"
+                              f"平均 {stats['mean']:.1f}（{stats['count']} 次变化）")
+
     # ---------------------- 设备控制 -----------------------
     elif choice == "3":
         print("\n=== 设备控制 ===")
@@ -118,9 +145,10 @@ while True:
             continue
         
         print("\n可用设备：")
-        device_list = list(home.devices.items())
-        for idx, (device_id, device) in enumerate(device_list, 1):
-            print(f"{idx}. {device.name} (ID: {device_id}, 状态: {device.status})")
+        device_list = list(home.devices)
+        for idx, device_id in enumerate(device_list, 1):
+            name, status = home.device_summary(device_id)
+            print(f"{idx}. {name} (ID: {device_id}, 状态: {status})")
         
         try:
             device_idx = int(input("\n请选择设备编号：").strip()) - 1
@@ -128,7 +156,8 @@ while True:
                 print("选择无效。")
                 continue
             
-            device_id, device = device_list[device_idx]
+            device_id = device_list[device_idx]
+            device = home.devices[device_id]
             
             print(f"\n控制设备: {device.name} (ID: {device_id})")
             print("1. 打开设备")
@@ -246,85 +275,54 @@ while True:
         print("1. 添加规则")
         print("2. 查看所有规则")
         print("3. 删除规则")
+        mode = "开启" if home.automation.event_mode else "关闭"
+        print(f"4. 开启/关闭事件驱动模式（当前：{mode}）")
+        print("5. 规则统计（最耗时、触发最频繁的规则）")
         sub_choice = input("请选择：").strip()
         
         if sub_choice == "1":
             print("\n请选择规则模板：")
-            print("1. 温度 > 30°C 自动打开空调")
-            print("2. 温度 < 20°C 自动关闭空调")
-            print("3. 无人时自动关灯")
-            print("4. 门锁未关闭超过5分钟报警")
-            print("5. 自定义规则")
-            
+            for idx, template in enumerate(RULE_TEMPLATES, start=1):
+                print(f"{idx}. {template['description']}")
+            custom_choice = str(len(RULE_TEMPLATES) + 1)
+            print(f"{custom_choice}. 自定义规则")
+
             rule_template = input("请选择：").strip()
-            
-            if rule_template == "1":
-                def cond(state):
-                    return state.get("temperature", 0) > 30
-                
-                def act(state):
-                    print("自动化动作：温度过高，自动打开空调！")
-                    for device_id, device in home.devices.items():
-                        if device.name == "aircon":
-                            device.turn_on()
-                            logger.log_action("自动化规则触发：打开空调", device=device, 
-                                            extra_info={"reason": "温度过高"})
-                            break
-                
-                rule = AutomationRule(cond, act, "温度 > 30°C 自动打开空调")
-                home.automation.add_rule(rule)
-                print("规则已添加。")
-                
-            elif rule_template == "2":
-                def cond(state):
-                    return state.get("temperature", 0) < 20
-                
-                def act(state):
-                    print("自动化动作：温度过低，自动关闭空调！")
-                    for device_id, device in home.devices.items():
-                        if device.name == "aircon":
-                            device.turn_off()
-                            logger.log_action("自动化规则触发：关闭空调", device=device,
-                                            extra_info={"reason": "温度过低"})
-                            break
-                
-                rule = AutomationRule(cond, act, "温度 < 20°C 自动关闭空调")
-                home.automation.add_rule(rule)
-                print("规则已添加。")
-                
-            elif rule_template == "3":
-                def cond(state):
-                    return not state.get("has_person", True)
-                
-                def act(state):
-                    print("自动化动作：检测到无人，自动关闭所有灯光！")
-                    for device_id, device in home.devices.items():
-                        if device.name == "light" and device.status == "on":
-                            device.turn_off()
-                            logger.log_action("自动化规则触发：关闭灯光", device=device,
-                                            extra_info={"reason": "无人"})
-                
-                rule = AutomationRule(cond, act, "无人时自动关灯")
-                home.automation.add_rule(rule)
-                print("规则已添加。")
-                
-            elif rule_template == "4":
-                # 这个规则需要定时检查，这里简化处理
-                def cond(state):
-                    return not state.get("door_locked", True)
-                
-                def act(state):
-                    print("⚠️ 警告：门锁未关闭！")
-                    logger.log_action("自动化规则触发：门锁未关闭警告", 
-                                    extra_info={"reason": "门锁未关闭"})
-                
-                rule = AutomationRule(cond, act, "门锁未关闭报警")
-                home.automation.add_rule(rule)
-                print("规则已添加。")
-                
-            elif rule_template == "5":
-                print("自定义规则需要编写代码，请参考现有规则模板。")
-        
+
+            if rule_template.isdigit() and 1 <= int(rule_template) <= len(RULE_TEMPLATES):
+                if home.automation.add_rule_spec(RULE_TEMPLATES[int(rule_template) - 1]):
+                    print("规则已添加。")
+
+            elif rule_template == custom_choice:
+                print("条件表达式示例：temperature > 28 and has_person == true")
+                condition = input("条件：").strip()
+                action = input("动作（turn_on/turn_off/set_attr/notify）：").strip()
+                spec = {"condition": condition, "action": action}
+                if action == "notify":
+                    spec["params"] = {"message": input("提醒内容：").strip()}
+                else:
+                    spec["target"] = {"type": input("目标设备类型：").strip().lower()}
+                    if action == "set_attr":
+                        key = input("属性名：").strip()
+                        value = input("属性值：").strip()
+                        try:
+                            value = int(value)
+                        except ValueError:
+                            pass
+                        spec["params"] = {"key": key, "value": value}
+                duration = input("条件需要持续多少秒才触发（留空表示立即触发）：").strip()
+                if duration:
+                    try:
+                        spec["duration"] = float(duration)
+                    except ValueError:
+                        print("持续时间必须是数字。")
+                        continue
+                spec["description"] = input("规则描述（可留空）：").strip()
+                if home.automation.add_rule_spec(spec):
+                    print("规则已添加。")
+            else:
+                print("无效选项。")
+
         elif sub_choice == "2":
             print("\n当前自动化规则：")
             rules = home.automation.list_rules()
@@ -347,6 +345,18 @@ while True:
             except (ValueError, IndexError):
                 print("输入无效。")
 
+        elif sub_choice == "4":
+            if home.automation.event_mode:
+                home.automation.disable_events()
+                print("事件驱动模式已关闭，规则只在手动运行时检查。")
+            elif home.automation.enable_events():
+                print("事件驱动模式已开启，设备状态或传感器数据变化时立即触发规则。")
+
+        elif sub_choice == "5":
+            print()
+            for line in home.automation.stats_report():
+                print(line)
+
     # ---------------------- 查看日志 -----------------------
     elif choice == "6":
         print("\n=== 最近日志 ===")
@@ -362,6 +372,7 @@ while True:
         print("\n=== 数据管理 ===")
         print("1. 保存数据")
         print("2. 重新加载数据")
+        print("3. 查看性能指标")
         sub_choice = input("请选择：").strip()
         
         if sub_choice == "1":
@@ -371,24 +382,106 @@ while True:
             print("重新加载数据会丢失当前未保存的更改，是否继续？(y/n)")
             confirm = input().strip().lower()
             if confirm == "y":
-                home = smart_home.SmartHome()
+                stop_home()
+                home, sensors = start_home()
                 print("数据已重新加载。")
+        elif sub_choice == "3":
+            stats = home.metrics()
+            if stats is None:
+                print("尚未启用性能指标。启用后开始统计，并在 http://127.0.0.1:9464/metrics 提供 Prometheus 格式，是否启用？(y/n)")
+                if input().strip().lower() == "y":
+                    home.enable_metrics()
+                    home.serve_metrics()
+                continue
+            print(f"运行 {stats['uptime_s']:.0f} 秒，设备 {stats['gauges']['devices']} 个，"
+                  f"用户 {stats['gauges']['users']} 个")
+            for name, op in stats["operations"].items():
+                print(f"  {name}: {op['count']} 次，异常 {op['errors']} 次，"
+                      f"平均 {op['mean_us']:.0f} 微秒，p50 {op['p50_us']} / p99 {op['p99_us']} / "
+                      f"最大 {op['max_us']} 微秒")
+            for device_type, actions in stats["commands"].items():
+                counts = []
+                for action, c in actions.items():
+                    text = f"{action} {c['ok']} 次"
+                    if c["failed"]:
+                        text += f"（失败 {c['failed']} 次）"
+                    counts.append(text)
+                print(f"  {device_type}: {'，'.join(counts)}")
 
     # ---------------------- 运行自动化规则 -----------------------
     elif choice == "8":
         print("\n=== 运行自动化规则 ===")
-        current_state = get_current_state()
+        sensors.flush()
+        current_state = sensors.snapshot()
         print(f"当前系统状态：")
-        print(f"  温度: {current_state['temperature']}°C")
-        print(f"  是否有人: {'是' if current_state['has_person'] else '否'}")
-        print(f"  门锁状态: {'已锁' if current_state['door_locked'] else '未锁'}")
+        for name, reading in sensors.readings.items():
+            if reading.updated is None:
+                text = "暂无数据"
+            else:
+                text = f"{reading.value}（{reading.age:.0f} 秒前）"
+            if reading.stale:
+                text += " [已过期]"
+            if reading.error:
+                text += f" [读取失败：{reading.error}]"
+            print(f"  {name}: {text}")
+        print(f"  门锁状态: {'已锁' if current_state.get('door_locked', True) else '未锁'}")
         
-        triggered = home.automation.run_all(current_state)
-        print(f"\n共触发了 {triggered} 条规则。")
+        if home.automation.event_mode:
+            # 事件驱动模式：传感器数据由后台轮询更新，相关规则在数据变化时立即触发
+            print("\n事件驱动模式下规则在传感器数据变化时自动触发。")
+        else:
+            # 增量计算：只重新计算状态变化涉及的规则，条件持续满足的规则不会重复触发
+            triggered = home.automation.run_changed(current_state)
+            print(f"\n共触发了 {triggered} 条规则。")
+
+    # ---------------------- 场景 -----------------------
+    elif choice == "9":
+        print("\n=== 场景 ===")
+        print("1. 应用场景")
+        print("2. 查看所有场景")
+        print("3. 从模板添加场景")
+        print("4. 删除场景")
+        sub_choice = input("请选择：").strip()
+
+        if sub_choice in ("1", "4"):
+            names = list(home.scenes)
+            if not names:
+                print("当前没有场景。")
+                continue
+            for idx, name in enumerate(names, start=1):
+                print(f"{idx}. {name}")
+            scene_choice = input("请选择场景编号：").strip()
+            if not (scene_choice.isdigit() and 1 <= int(scene_choice) <= len(names)):
+                print("输入无效。")
+                continue
+            if sub_choice == "1":
+                home.apply_scene(names[int(scene_choice) - 1])
+            else:
+                home.remove_scene(names[int(scene_choice) - 1])
+
+        elif sub_choice == "2":
+            scenes = home.list_scenes()
+            if scenes:
+                print("\n当前场景：")
+                for scene_desc in scenes:
+                    print(f"  {scene_desc}")
+            else:
+                print("当前没有场景。")
+
+        elif sub_choice == "3":
+            print("\n请选择场景模板：")
+            for idx, template in enumerate(SCENE_TEMPLATES, start=1):
+                print(f"{idx}. {template['name']}：{template['description']}")
+            template_choice = input("请选择：").strip()
+            if template_choice.isdigit() and 1 <= int(template_choice) <= len(SCENE_TEMPLATES):
+                home.add_scene(SCENE_TEMPLATES[int(template_choice) - 1])
+            else:
+                print("无效选项。")
 
     # ---------------------- 退出系统 -----------------------
     elif choice == "0":
         print("\n退出系统，再见！")
+        stop_home()
         home.save_data()
         home.save_automation_rules()
         break
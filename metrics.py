@@ -0,0 +1,321 @@
+"""
+性能指标：
+- 计数器：调用次数、异常次数、按设备类型和操作统计的控制命令数
+- HDR 风格的延迟直方图：按 2 的幂分段，每段再分 32 个线性小桶，
+  从 1 微秒到数小时的延迟都只需要几百个整数计数，分位数的相对误差不超过约 3%
+- 只给启用了指标的对象替换计时版本的方法（instrument），未启用时原方法不受任何影响
+- snapshot() 返回字典；prometheus() 生成 Prometheus 文本格式，MetricsServer 在本地端口提供 /metrics
+
+用法：
+    metrics = Metrics()
+    metrics.instrument(home, "control_device")
+    metrics.snapshot()["operations"]["control_device"]["p99_us"]
+    server = MetricsServer(metrics.prometheus, port=9464)
+    server.start()               # curl http://127.0.0.1:9464/metrics
+"""
+
+import functools
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 导出到 Prometheus 时使用的直方图边界（秒）
+PROMETHEUS_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                      0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 快照中报告的分位数
+QUANTILES = (("p50_us", 0.5), ("p90_us", 0.9), ("p99_us", 0.99), ("p999_us", 0.999))
+
+_SUB_BITS = 5
+_SUB_COUNT = 1 << _SUB_BITS    # 每段的线性小桶数
+
+
+class LatencyHistogram:
+    """
+    HDR 风格的延迟直方图（单位：微秒）：
+    - 小于 64 微秒的值每微秒一个桶
+    - 更大的值保留最高 6 位：[2^k, 2^(k+1)) 分成 32 个等宽的桶
+    """
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (2 * _SUB_COUNT)
+        self.count = 0
+        self.total = 0.0    # 总耗时（秒）
+        self.max = 0        # 最大值（微秒）
+
+    @staticmethod
+    def bucket_index(us):
+        """值（整数微秒）所在桶的下标"""
+        if us < 2 * _SUB_COUNT:
+            return us
+        shift = us.bit_length() - _SUB_BITS - 1
+        return (shift << _SUB_BITS) + (us >> shift)
+
+    @staticmethod
+    def bucket_upper(index):
+        """桶内的最大值（微秒）"""
+        if index < 2 * _SUB_COUNT:
+            return index
+        shift = (index >> _SUB_BITS) - 1
+        top = (index & (_SUB_COUNT - 1)) + _SUB_COUNT
+        return ((top + 1) << shift) - 1
+
+    def record(self, seconds):
+        """记录一次耗时（秒）"""
+        us = int(seconds * 1e6)
+        index = self.bucket_index(us)
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if us > self.max:
+            self.max = us
+
+    def quantile(self, q):
+        """分位数（微秒，取所在桶的上界，不超过最大值）"""
+        if not self.count:
+            return 0
+        rank = max(1, int(q * self.count + 0.5))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.bucket_upper(index), self.max)
+        return self.max
+
+    def cumulative(self, bounds):
+        """
+        每个边界（秒）以内的累计次数（Prometheus 的 le 桶；按桶上界计算，误差在一个桶以内）
+
+        :return: 与 bounds 等长的列表
+        """
+        result = []
+        seen = 0
+        index = 0
+        counts = self.counts
+        for bound in bounds:
+            limit = bound * 1e6
+            while index < len(counts) and self.bucket_upper(index) <= limit:
+                seen += counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+    def copy(self):
+        other = LatencyHistogram()
+        other.counts = list(self.counts)
+        other.count = self.count
+        other.total = self.total
+        other.max = self.max
+        return other
+
+
+class Metrics:
+    """
+    指标登记表：
+    - instrument(obj, method)：把对象上的方法替换为计时版本（记录次数、异常和延迟直方图）
+    - count_command(device_type, action, ok)：按设备类型统计控制命令
+    - snapshot() / prometheus()：读取指标
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._histograms = {}    # {操作名称: LatencyHistogram}
+        self._errors = {}        # {操作名称: 异常次数}
+        self._commands = {}      # {(设备类型, 操作, 是否成功): 次数}
+        self._gauges = {}        # {名称: (说明, 取值函数)}
+        self.started = time.time()
+
+    # ---------------------------
+    # 记录
+    # ---------------------------
+    def instrument(self, obj, method, operation=None):
+        """
+        把 obj.method 替换为计时版本（只替换这个对象）。
+        已经被本对象替换过时不重复替换；被其他 Metrics 替换过时改为记录到本对象
+
+        :param operation: 指标中的操作名称，默认与方法名相同
+        :return: 是否替换
+        """
+        func = getattr(obj, method)
+        owner = getattr(func, "_metrics", None)
+        if owner is self:
+            return False
+        if owner is not None:
+            func = func.__wrapped__
+        setattr(obj, method, self.timed(operation or method, func))
+        return True
+
+    def timed(self, operation, func):
+        """返回 func 的计时版本"""
+        clock = self._clock
+        with self._lock:
+            self._histograms.setdefault(operation, LatencyHistogram())
+            self._errors.setdefault(operation, 0)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            except BaseException:
+                with self._lock:
+                    self._errors[operation] += 1
+                raise
+            finally:
+                self.observe(operation, clock() - start)
+
+        wrapper._metrics = self
+        return wrapper
+
+    def observe(self, operation, seconds):
+        """记录一次操作耗时（秒）"""
+        with self._lock:
+            histogram = self._histograms.get(operation)
+            if histogram is None:
+                histogram = self._histograms[operation] = LatencyHistogram()
+                self._errors[operation] = 0
+            histogram.record(seconds)
+
+    def count_command(self, device_type, action, ok):
+        """统计一条设备控制命令"""
+        key = (device_type, action, bool(ok))
+        with self._lock:
+            self._commands[key] = self._commands.get(key, 0) + 1
+
+    def gauge(self, name, description, func):
+        """登记一个读取时才计算的数值（例如设备数量）"""
+        self._gauges[name] = (description, func)
+
+    # ---------------------------
+    # 读取
+    # ---------------------------
+    def _copy(self):
+        with self._lock:
+            histograms = {name: h.copy() for name, h in self._histograms.items()}
+            return histograms, dict(self._errors), dict(self._commands)
+
+    def snapshot(self):
+        """
+        当前指标：
+        {"uptime_s", "operations": {操作: {count, errors, mean_us, p50_us, ..., max_us}},
+         "commands": {设备类型: {操作: {"ok": 次数, "failed": 次数}}}, "gauges": {名称: 值}}
+        """
+        histograms, errors, commands = self._copy()
+        operations = {}
+        for name, h in histograms.items():
+            stats = {"count": h.count, "errors": errors.get(name, 0),
+                     "mean_us": h.total / h.count * 1e6 if h.count else 0.0}
+            for key, q in QUANTILES:
+                stats[key] = h.quantile(q)
+            stats["max_us"] = h.max
+            operations[name] = stats
+        by_type = {}
+        for (device_type, action, ok), n in sorted(commands.items()):
+            entry = by_type.setdefault(device_type, {}).setdefault(action, {"ok": 0, "failed": 0})
+            entry["ok" if ok else "failed"] += n
+        return {
+            "uptime_s": time.time() - self.started,
+            "operations": operations,
+            "commands": by_type,
+            "gauges": {name: func() for name, (_, func) in self._gauges.items()},
+        }
+
+    def prometheus(self):
+        """Prometheus 文本格式（text/plain; version=0.0.4）"""
+        histograms, errors, commands = self._copy()
+        lines = [
+            "# HELP smarthome_operation_duration_seconds 操作耗时",
+            "# TYPE smarthome_operation_duration_seconds histogram",
+        ]
+        for name, h in sorted(histograms.items()):
+            label = f'operation="{_escape(name)}"'
+            for bound, n in zip(PROMETHEUS_BUCKETS, h.cumulative(PROMETHEUS_BUCKETS)):
+                lines.append(f'smarthome_operation_duration_seconds_bucket{{{label},le="{bound}"}} {n}')
+            lines.append(f'smarthome_operation_duration_seconds_bucket{{{label},le="+Inf"}} {h.count}')
+            lines.append(f"smarthome_operation_duration_seconds_sum{{{label}}} {h.total!r}")
+            lines.append(f"smarthome_operation_duration_seconds_count{{{label}}} {h.count}")
+        lines += [
+            "# HELP smarthome_operation_errors_total 操作抛出异常的次数",
+            "# TYPE smarthome_operation_errors_total counter",
+        ]
+        for name, n in sorted(errors.items()):
+            lines.append(f'smarthome_operation_errors_total{{operation="{_escape(name)}"}} {n}')
+        lines += [
+            "# HELP smarthome_commands_total 设备控制命令数（按设备类型、操作、结果）",
+            "# TYPE smarthome_commands_total counter",
+        ]
+        for (device_type, action, ok), n in sorted(commands.items()):
+            lines.append(f'smarthome_commands_total{{device_type="{_escape(device_type)}",'
+                         f'action="{_escape(action)}",result="{"ok" if ok else "failed"}"}} {n}')
+        for name, (description, func) in sorted(self._gauges.items()):
+            lines.append(f"# HELP smarthome_{name} {description}")
+            lines.append(f"# TYPE smarthome_{name} gauge")
+            lines.append(f"smarthome_{name} {func()}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    """Prometheus 标签值转义"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsServer:
+    """在本地端口提供 /metrics（Prometheus 文本格式），在后台线程中运行"""
+
+    def __init__(self, render, port=9464, host="127.0.0.1"):
+        """
+        :param render: 生成响应内容的函数（例如 Metrics.prometheus）
+        :param port: 端口（0 表示由系统分配，启动后见 self.port）
+        :param host: 监听地址，默认只监听本机
+        """
+        self.render = render
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """启动服务（端口被占用时抛出 OSError）"""
+        if self._server is not None:
+            return False
+        render = self.render
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass    # 不在控制台打印访问记录
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="MetricsServer", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """停止服务"""
+        if self._server is None:
+            return False
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+        return True
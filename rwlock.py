@@ -0,0 +1,140 @@
+"""
+读写锁：
+- 多个线程可以同时持有读锁；写锁独占
+- 公平：有线程在等待写锁时，新的读者等待（避免写者饿死）；写者按排队顺序获得锁；
+  写者释放锁时，已经在等待的读者先于下一个写者进入（避免读者饿死）
+- 可重入：持有读锁时可以再次获取读锁，持有写锁时可以再次获取读锁或写锁
+- 不支持升级：持有读锁时获取写锁会抛出 RuntimeError（两个线程同时升级会死锁）
+
+用法：
+    lock = RWLock()
+    with lock.read():
+        ...
+    with lock.write():
+        ...
+"""
+
+import threading
+from contextlib import contextmanager
+
+
+class RWLock:
+    """公平、可重入的读写锁"""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0            # 持有读锁的线程数（不含写者自己的读锁）
+        self._writer = None          # 持有写锁的线程ID
+        self._write_depth = 0
+        self._waiting_writers = 0
+        self._waiting_readers = 0
+        self._admit = 0              # 写者释放时放行的等待读者数量（这些读者不必再等写者）
+        self._next_ticket = 0        # 写者排队号
+        self._serving = 0            # 当前轮到的写者排队号
+        self._abandoned = set()      # 等待中被中断（异常）的写者排队号
+        self._local = threading.local()
+
+    def _read_depth(self):
+        return getattr(self._local, "depth", 0)
+
+    def acquire_read(self):
+        """获取读锁"""
+        depth = self._read_depth()
+        if depth or self._writer == threading.get_ident():
+            # 已经持有读锁或写锁：直接重入，不必等待排队的写者
+            self._local.depth = depth + 1
+            if depth == 0:
+                self._local.under_write = True
+            return
+        with self._cond:
+            self._waiting_readers += 1
+            try:
+                while self._writer is not None or (self._waiting_writers and not self._admit):
+                    self._cond.wait()
+            except BaseException:
+                # 被中断的读者不再占用放行名额
+                self._waiting_readers -= 1
+                self._admit = min(self._admit, self._waiting_readers)
+                self._cond.notify_all()
+                raise
+            self._waiting_readers -= 1
+            if self._admit:
+                self._admit -= 1
+            self._readers += 1
+        self._local.depth = 1
+        self._local.under_write = False
+
+    def release_read(self):
+        """释放读锁"""
+        depth = self._read_depth()
+        if not depth:
+            raise RuntimeError("没有持有读锁")
+        self._local.depth = depth - 1
+        if depth == 1 and not self._local.under_write:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def acquire_write(self):
+        """获取写锁"""
+        me = threading.get_ident()
+        if self._writer == me:
+            self._write_depth += 1
+            return
+        if self._read_depth():
+            raise RuntimeError("持有读锁时不能获取写锁")
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self._waiting_writers += 1
+            try:
+                while (self._writer is not None or self._readers or self._admit
+                       or ticket != self._serving):
+                    self._cond.wait()
+            except BaseException:
+                # 被中断的写者放弃排队号，后面的写者不必等它
+                self._waiting_writers -= 1
+                self._abandoned.add(ticket)
+                self._skip_abandoned()
+                self._cond.notify_all()
+                raise
+            self._waiting_writers -= 1
+            self._writer = me
+            self._write_depth = 1
+
+    def release_write(self):
+        """释放写锁"""
+        if self._writer != threading.get_ident():
+            raise RuntimeError("没有持有写锁")
+        self._write_depth -= 1
+        if not self._write_depth:
+            with self._cond:
+                self._writer = None
+                self._serving += 1
+                self._skip_abandoned()
+                self._admit = self._waiting_readers
+                self._cond.notify_all()
+
+    def _skip_abandoned(self):
+        while self._serving in self._abandoned:
+            self._abandoned.discard(self._serving)
+            self._serving += 1
+
+    @contextmanager
+    def read(self):
+        """读锁上下文管理器"""
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        """写锁上下文管理器"""
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
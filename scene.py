@@ -0,0 +1,147 @@
+"""
+场景：一组设备的目标状态，例如 "离家模式" = 门锁上锁、窗帘关闭、所有灯和空调关闭
+- 每个目标用设备类型（"type"）或设备ID列表（"ids"）选择设备，
+  给出目标开关状态（"status"）和/或目标属性（"attributes"）
+- 场景按设备展开后缓存，设备增删后才重新展开
+- 应用时只生成与当前状态不同的部分（每台设备一个差异），状态已经一致的设备不会被操作
+- 由 SmartHome.apply_scene() 原子地应用：任何设备拒绝修改时全部回滚
+
+场景定义示例：
+    {
+        "name": "离家模式",
+        "targets": [
+            {"type": "doorlock", "attributes": {"locked": True}},
+            {"type": "curtain", "attributes": {"openness": 0}},
+            {"type": "light", "status": "off"},
+            {"type": "aircon", "status": "off"},
+        ],
+    }
+"""
+
+# 预设场景模板（命令行和图形界面共用）
+SCENE_TEMPLATES = [
+    {
+        "name": "离家模式",
+        "description": "门锁上锁，关闭窗帘、所有灯和空调",
+        "targets": [
+            {"type": "doorlock", "attributes": {"locked": True}},
+            {"type": "curtain", "attributes": {"openness": 0}},
+            {"type": "light", "status": "off"},
+            {"type": "aircon", "status": "off"},
+        ],
+    },
+    {
+        "name": "回家模式",
+        "description": "打开所有灯，空调制冷 26°C，窗帘打开一半",
+        "targets": [
+            {"type": "light", "status": "on", "attributes": {"brightness": 80}},
+            {"type": "aircon", "status": "on", "attributes": {"temperature": 26, "mode": "cool"}},
+            {"type": "curtain", "attributes": {"openness": 50}},
+        ],
+    },
+    {
+        "name": "睡眠模式",
+        "description": "灯光调暗为暖光，关闭音乐，门锁上锁",
+        "targets": [
+            {"type": "light", "attributes": {"brightness": 10, "color_temp": "warm"}},
+            {"type": "musicplayer", "status": "off"},
+            {"type": "doorlock", "attributes": {"locked": True}},
+        ],
+    },
+]
+
+
+class Scene:
+    """
+    场景：
+    - spec：场景定义（可以直接保存为 JSON）
+    - plan(home)：按设备展开的目标状态 {设备ID: (目标状态, 目标属性)}
+    - diff(home)：需要修改的设备列表 [(设备, 目标状态或 None, {属性: 目标值}), ...]
+    """
+
+    def __init__(self, spec):
+        """
+        :param spec: 场景定义字典（name、targets，可选 description）
+        """
+        name = spec.get("name")
+        if not isinstance(name, str) or not name.strip():
+            raise ValueError("场景必须有名称")
+        targets = spec.get("targets")
+        if not isinstance(targets, list) or not targets:
+            raise ValueError(f"场景 {name} 没有目标设备")
+        for target in targets:
+            if not target.get("type") and not target.get("ids"):
+                raise ValueError(f"场景 {name} 的目标需要 type 或 ids")
+            if target.get("status") not in (None, "on", "off"):
+                raise ValueError(f"场景 {name} 的目标状态只能是 on 或 off: {target['status']}")
+            if not isinstance(target.get("attributes", {}), dict):
+                raise ValueError(f"场景 {name} 的 attributes 必须是字典")
+            if target.get("status") is None and not target.get("attributes"):
+                raise ValueError(f"场景 {name} 的目标需要 status 或 attributes")
+        self.spec = spec
+        self.name = name
+        self._plan = None
+        self._plan_version = None
+
+    def to_dict(self):
+        """转为可保存的字典"""
+        return self.spec
+
+    def plan(self, home):
+        """
+        按设备展开目标状态（缓存，设备增删后重新展开）；
+        同一设备被多个目标选中时，后面的目标覆盖前面的
+
+        :param home: SmartHome 对象
+        :return: {设备ID: (目标状态或 None, {属性: 目标值})}
+        """
+        if self._plan is not None and self._plan_version == home.topology_version:
+            return self._plan
+        plan = {}
+        for target in self.spec["targets"]:
+            if target.get("ids"):
+                device_ids = [d for d in target["ids"] if d in home.devices]
+            else:
+                device_ids = [d.device_id for d in home.devices_of_type(target["type"])]
+            for device_id in device_ids:
+                status, attributes = plan.get(device_id, (None, {}))
+                if target.get("status") is not None:
+                    status = target["status"]
+                plan[device_id] = (status, {**attributes, **target.get("attributes", {})})
+        self._plan = plan
+        self._plan_version = home.topology_version
+        return plan
+
+    def diff(self, home):
+        """
+        与当前设备状态比较，只保留需要修改的部分
+
+        :param home: SmartHome 对象
+        :return: [(设备, 目标状态或 None, {属性: 目标值}), ...]
+        """
+        changes = []
+        for device_id, (status, attributes) in self.plan(home).items():
+            device = home.devices[device_id]
+            current = device.attributes
+            changed = {key: value for key, value in attributes.items()
+                       if current.get(key) != value}
+            if status == device.status:
+                status = None
+            if changed or status is not None:
+                changes.append((device, status, changed))
+        return changes
+
+
+def apply_change(device, status, attributes):
+    """
+    把一个差异应用到设备上（属性通过设备的设置方法修改，会检查取值范围）
+
+    :return: 设备是否接受全部修改
+    """
+    for key, value in attributes.items():
+        if not device.set_attr_checked(key, value):
+            return False
+    # 设置属性可能已经改变了开关状态（例如窗帘开合度）
+    if status is not None and device.status != status:
+        return device.turn_on() if status == "on" else device.turn_off()
+    return True
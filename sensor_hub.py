@@ -0,0 +1,327 @@
+"""
+传感器中心：
+- 每个传感器是一个提供者（SensorProvider），通过 async read() 读取一次数据
+- 每个传感器在自己的 asyncio 任务中轮询：读取一次后等待 ttl 秒再读（ttl 即缓存有效期），
+  慢的传感器只会推迟它自己，不会挡住其他传感器；阻塞的同步读取放到线程池中执行
+- 每次读取有超时；超时或出错时保留上一次的值，并在元数据中记录错误和数据年龄（是否过期）
+- 读到的值写入 SmartHome.state（通过 update_sensor，值变化时发布事件），
+  自动化规则直接读取这个增量维护的状态，每次运行规则不需要重新收集数据（O(1)）
+
+用法：
+    hub = SensorHub(home)
+    hub.add_sensor(FunctionSensor("temperature", read_thermometer, ttl=5, blocking=True))
+    hub.start()                  # 后台线程运行事件循环
+    home.automation.run_changed(hub.snapshot())
+"""
+
+import asyncio
+import collections
+import inspect
+import random
+import threading
+import time
+
+
+class SensorProvider:
+    """
+    传感器提供者接口：子类实现 async read()，返回传感器当前的值
+
+    - name：状态键（例如 "temperature"）
+    - ttl：缓存有效期（秒），也就是轮询间隔
+    - timeout：单次读取的超时时间（秒）
+    - max_age：数据超过多少秒没有更新视为过期（默认 3 个 ttl 加上超时时间）
+    """
+
+    def __init__(self, name, ttl=5.0, timeout=2.0, max_age=None):
+        if ttl <= 0 or timeout <= 0:
+            raise ValueError(f"传感器 {name} 的 ttl 和 timeout 必须大于 0")
+        self.name = name
+        self.ttl = ttl
+        self.timeout = timeout
+        self.max_age = max_age if max_age is not None else ttl * 3 + timeout
+
+    async def read(self):
+        """读取一次传感器数据"""
+        raise NotImplementedError
+
+
+class FunctionSensor(SensorProvider):
+    """用函数读取的传感器：func 可以是普通函数或 async 函数"""
+
+    def __init__(self, name, func, ttl=5.0, timeout=2.0, max_age=None, blocking=False):
+        """
+        :param func: 读取函数 func() -> 值
+        :param blocking: 普通函数是否会阻塞（例如读串口、网络）；阻塞的函数在线程池中执行
+        """
+        super().__init__(name, ttl, timeout, max_age)
+        self.func = func
+        self.blocking = blocking
+
+    async def read(self):
+        if inspect.iscoroutinefunction(self.func):
+            return await self.func()
+        if self.blocking:
+            return await asyncio.get_running_loop().run_in_executor(None, self.func)
+        return self.func()
+
+
+class SimulatedSensor(SensorProvider):
+    """
+    模拟传感器（没有真实硬件时使用）：
+    每次读取等待 latency 秒，然后返回 generate(上一次的值) 的结果
+    """
+
+    def __init__(self, name, generate, initial=None, latency=0.0, ttl=5.0, timeout=2.0):
+        super().__init__(name, ttl, timeout)
+        self.generate = generate
+        self.value = initial
+        self.latency = latency
+
+    async def read(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.value = self.generate(self.value)
+        return self.value
+
+
+def simulated_sensors(seed=None):
+    """
+    默认的模拟传感器：温度（20-35°C 之间随机漂移）和是否有人（偶尔变化）
+
+    :return: SensorProvider 列表
+    """
+    rnd = random.Random(seed)
+
+    def temperature(previous):
+        if previous is None:
+            return rnd.randint(20, 35)
+        return min(35, max(20, previous + rnd.choice((-1, 0, 0, 1))))
+
+    def has_person(previous):
+        if previous is None or rnd.random() < 0.2:
+            return rnd.choice([True, False])
+        return previous
+
+    return [
+        SimulatedSensor("temperature", temperature, latency=0.05, ttl=5.0),
+        SimulatedSensor("has_person", has_person, latency=0.02, ttl=2.0),
+    ]
+
+
+class SensorReading:
+    """一个传感器的最新读数及元数据"""
+
+    __slots__ = ("name", "value", "updated", "updated_at", "latency", "error", "reads",
+                 "failures", "max_age")
+
+    def __init__(self, name, max_age):
+        self.name = name
+        self.value = None
+        self.updated = None       # 最后一次成功读取的时间（time.monotonic()）
+        self.updated_at = None    # 最后一次成功读取的时间（time.time()，用于显示）
+        self.latency = None       # 最后一次成功读取的耗时（秒）
+        self.error = None         # 最后一次读取的错误（成功时为 None）
+        self.reads = 0
+        self.failures = 0
+        self.max_age = max_age
+
+    @property
+    def age(self):
+        """数据年龄（秒），从未读取成功时为 None"""
+        return None if self.updated is None else time.monotonic() - self.updated
+
+    @property
+    def stale(self):
+        """数据是否过期（从未读取成功，或超过 max_age 没有更新）"""
+        return self.updated is None or self.age > self.max_age
+
+    def to_dict(self):
+        return {
+            "name": self.name, "value": self.value, "age": self.age, "stale": self.stale,
+            "updated_at": self.updated_at, "latency": self.latency, "error": self.error,
+            "reads": self.reads, "failures": self.failures,
+        }
+
+
+class SensorHub:
+    """
+    传感器中心：
+    - add_sensor()/remove_sensor() 管理传感器
+    - start()/stop()：在后台线程中运行事件循环，每个传感器一个轮询任务
+    - refresh()：没有后台线程时，并发读取所有缓存已过期的传感器一次
+    - snapshot()：当前状态（就是 home.state，O(1)）；readings 中是每个传感器的元数据
+    """
+
+    def __init__(self, home=None, sensors=(), deferred=False):
+        """
+        :param home: SmartHome 对象（读数通过 home.update_sensor 写入 home.state）
+        :param sensors: 初始的传感器列表
+        :param deferred: 读数是否先放进队列，由调用方在自己的线程中 flush()
+                         （规则动作可能很慢，不应在事件循环中执行：图形界面在界面线程中 flush，
+                         命令行在时间轮线程中 flush）
+        """
+        self.home = home
+        self.state = home.state if home is not None else {}
+        self.providers = {}
+        self.readings = {}
+        self.deferred = deferred
+        self._inbox = collections.deque()
+        self._tasks = {}
+        self._loop = None
+        self._stopping = None
+        self._thread = None
+        self._ready = threading.Event()
+        for sensor in sensors:
+            self.add_sensor(sensor)
+
+    # ---------------------------
+    # 传感器管理
+    # ---------------------------
+    def add_sensor(self, sensor):
+        """添加传感器（同名传感器会被替换）"""
+        if not isinstance(sensor, SensorProvider):
+            print("错误：只能添加 SensorProvider 对象。")
+            return False
+        self.remove_sensor(sensor.name)
+        self.providers[sensor.name] = sensor
+        self.readings[sensor.name] = SensorReading(sensor.name, sensor.max_age)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._spawn, sensor)
+        return True
+
+    def remove_sensor(self, name):
+        """删除传感器（状态中保留最后一次的值）"""
+        if name not in self.providers:
+            return False
+        sensor = self.providers.pop(name)
+        self.readings.pop(name, None)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._cancel, sensor)
+        return True
+
+    # ---------------------------
+    # 读取
+    # ---------------------------
+    def snapshot(self):
+        """自动化规则使用的当前状态（增量维护，直接返回同一个字典）"""
+        return self.state
+
+    def stale_sensors(self):
+        """数据已过期的传感器名称列表"""
+        return [name for name, reading in self.readings.items() if reading.stale]
+
+    async def refresh(self, force=False):
+        """
+        并发读取所有缓存已过期（或 force=True 时全部）的传感器一次
+
+        :return: 当前状态
+        """
+        due = [sensor for name, sensor in list(self.providers.items())
+               if force or self.readings[name].updated is None
+               or self.readings[name].age >= sensor.ttl]
+        await asyncio.gather(*(self._read(sensor) for sensor in due))
+        self.flush()
+        return self.snapshot()
+
+    async def _read(self, sensor):
+        """读取一次传感器并更新元数据和状态（不抛出异常）"""
+        reading = self.readings.get(sensor.name)
+        if reading is None:
+            return
+        start = time.monotonic()
+        reading.reads += 1
+        try:
+            value = await asyncio.wait_for(sensor.read(), sensor.timeout)
+        except asyncio.TimeoutError:
+            reading.failures += 1
+            reading.error = f"超时（{sensor.timeout}s）"
+            return
+        except Exception as e:
+            reading.failures += 1
+            reading.error = str(e) or type(e).__name__
+            return
+        reading.latency = time.monotonic() - start
+        reading.value = value
+        reading.updated = time.monotonic()
+        reading.updated_at = time.time()
+        reading.error = None
+        if self.deferred:
+            self._inbox.append((sensor.name, value))
+        else:
+            self._apply(sensor.name, value)
+
+    def _apply(self, name, value):
+        if self.home is not None:
+            self.home.update_sensor(name, value)
+        else:
+            self.state[name] = value
+
+    def flush(self):
+        """
+        把队列中的读数写入状态（deferred 模式下由调用方定期调用）
+
+        :return: 写入的读数数量
+        """
+        count = 0
+        while self._inbox:
+            name, value = self._inbox.popleft()
+            self._apply(name, value)
+            count += 1
+        return count
+
+    # ---------------------------
+    # 后台轮询
+    # ---------------------------
+    def start(self):
+        """启动后台线程，每个传感器按自己的 ttl 轮询"""
+        if self._thread is not None and self._thread.is_alive():
+            return False
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._thread_main, name="SensorHub", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return True
+
+    def stop(self):
+        """停止后台线程"""
+        thread, loop = self._thread, self._loop
+        if thread is None or loop is None:
+            return False
+        loop.call_soon_threadsafe(self._stopping.set)
+        thread.join()
+        self._thread = None
+        return True
+
+    def _thread_main(self):
+        asyncio.run(self._run())
+
+    async def _run(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        for sensor in list(self.providers.values()):
+            self._spawn(sensor)
+        self._ready.set()
+        try:
+            await self._stopping.wait()
+        finally:
+            tasks = list(self._tasks.values())
+            self._tasks.clear()
+            self._loop = None
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, sensor):
+        if self.providers.get(sensor.name) is sensor:
+            self._tasks[sensor.name] = self._loop.create_task(self._poll(sensor))
+
+    def _cancel(self, sensor):
+        task = self._tasks.get(sensor.name)
+        if task is not None and self.providers.get(sensor.name) is not sensor:
+            self._tasks.pop(sensor.name).cancel()
+
+    async def _poll(self, sensor):
+        """一个传感器的轮询任务：读取，等待 ttl，再读取"""
+        while True:
+            await self._read(sensor)
+            await asyncio.sleep(sensor.ttl)
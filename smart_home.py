@@ -1,11 +1,58 @@
+import functools
 import json
+import os
+import threading
 from automation import AutomationManager
 from user import User
 from device import (
     Device, Light, AirConditioner, DoorLock, Camera, 
     SmartCurtain, MusicPlayer, MoodLight
 )
-from logger import log
+from device_store import DeviceStore, LazyDeviceMap
+from journal import Journal
+import snapshot
+from logger import log, log_many, get_logger
+from metrics import Metrics, MetricsServer
+from scene import Scene, apply_change
+from rwlock import RWLock
+from history import AttributeHistory
+
+
+class _EventHold(threading.local):
+    """每个线程各自的事件暂存状态"""
+
+    def __init__(self):
+        self.depth = 0     # 大于 0 时先暂存事件（例如 control_device 执行期间）
+        self.keys = []
+
+
+def _reading(method):
+    """只读的公开方法：线程安全模式下持有读锁"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._lock is None:
+            return method(self, *args, **kwargs)
+        with self._lock.read():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _writing(method):
+    """
+    修改系统的公开方法：线程安全模式下持有写锁；
+    变化事件和到期的检查点在释放锁之后才处理（订阅者可以继续调用 SmartHome 的方法）
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._lock is None:
+            return method(self, *args, **kwargs)
+        self._hold.depth += 1
+        try:
+            with self._lock.write():
+                return method(self, *args, **kwargs)
+        finally:
+            self._release_events()
+    return wrapper
 
 
 class SmartHome:
@@ -16,22 +63,102 @@ class SmartHome:
     - 支持设备管理（添加、删除、控制、共享）
     - 支持数据保存/加载（JSON格式）
     - 集成自动化规则管理器
+    - 支持紧凑存储模式（storage="compact"），适合超大规模设备
+    - 支持懒加载模式（storage="lazy"），设备对象在第一次访问时才创建
+    - 支持预写日志（journal=True），修改即时追加，定期做检查点
+    - 支持二进制快照（snapshot_format="binary"），加快生产环境重启
+    - 设备状态变化、传感器更新会发布事件（subscribe），用于事件驱动的自动化
+    - 支持场景（add_scene / apply_scene）：多个设备的目标状态，原子地应用，失败时回滚
+    - 支持线程安全模式（thread_safe=True）：用户/设备表使用读写锁，控制设备时使用单个设备的锁
+    - 支持属性历史（history=True）：记录设备属性和开关状态的变化，可以查询一段时间内的最小/最大/平均值
+    - 记录修改过的用户、设备（脏标记）：保存时没有修改就不写文件，否则只把修改追加到增量文件，
+      增量文件过大时才重写完整快照
+    - 支持性能指标（metrics=True）：控制设备、运行规则、保存数据、写日志的次数和延迟直方图，
+      按设备类型统计控制命令；metrics() 查看，serve_metrics() 在本地端口提供 Prometheus 格式
     """
 
-    def __init__(self):
+    def __init__(self, storage="dict", journal=False, snapshot_format="json", thread_safe=False,
+                 history=False, metrics=False):
+        """
+        :param storage: 设备存储方式
+            - "dict"：普通字典 + Device 对象（默认）
+            - "compact"：列式 DeviceStore，每个设备只占用少量内存
+            - "lazy"：LazyDeviceMap，加载时只保存原始记录，访问时才创建设备对象
+        :param journal: 是否启用预写日志（True 或 Journal 对象）
+        :param snapshot_format: 快照格式，"json"（data.json）或 "binary"（data.bin）
+        :param thread_safe: 是否允许多个线程同时调用（例如后台线程运行自动化，界面线程控制设备）
+        :param history: 是否记录设备属性历史（True 或 AttributeHistory 对象）
+        :param metrics: 是否收集性能指标（True 或 Metrics 对象）；不启用时不替换任何方法，没有额外开销
+        """
+        if storage not in ("dict", "compact", "lazy"):
+            raise ValueError(f"未知的存储方式: {storage}")
+        if snapshot_format not in ("json", "binary"):
+            raise ValueError(f"未知的快照格式: {snapshot_format}")
+        self.snapshot_format = snapshot_format
+        self.data_file = "data.bin" if snapshot_format == "binary" else "data.json"
+        self.delta_file = self.data_file + ".delta"
         self.users = {}      # {用户名: User对象}
         self.devices = {}    # {设备ID: Device对象}
+        if storage == "compact":
+            self.devices = DeviceStore()
+        elif storage == "lazy":
+            self.devices = LazyDeviceMap(self._hydrate_device)
+        self._device_owner = {}   # 反向索引 {设备ID: 所有者用户名}
+        self._shared_index = {}   # 反向索引 {用户名: {被共享的设备ID: None}}（有序集合）
+        self._type_index = {}     # 类型索引 {设备类型(小写): {设备ID: None}}
+        self.topology_version = 0   # 设备增删时加 1（场景据此判断是否需要重新展开）
+        self.scenes = {}          # {场景名称: Scene对象}
+
+        # 事件：系统状态（传感器数据 + 设备）及订阅者
+        self.state = {"devices": self.devices}
+        self._subscribers = []
+        self._hold = _EventHold()
+        self._observer = self._on_device_change   # 所有设备共用同一个回调对象
+        if storage == "compact":
+            self.devices.observer = self._observer
+
+        # 线程安全模式：读写锁保护用户/设备表，每个设备一把锁（控制设备时使用）
+        self._lock = RWLock() if thread_safe else None
+        self._device_locks = {}
+        self._checkpoint_due = False   # 线程安全模式下检查点推迟到释放锁之后
+
+        # 脏标记：上次保存之后修改过（或删除）的用户、设备、场景
+        self._dirty_users = set()
+        self._dirty_devices = set()
+        self._removed_users = set()
+        self._removed_devices = set()
+        self._scenes_dirty = False
+        self._generation = 0           # 当前快照的代号（增量记录只对同一代号的快照有效）
+        self._delta_lines = 0          # 当前快照之后已经写入增量文件的记录数
+        self._full_save_due = False    # 增量文件损坏时，下次保存写完整快照
+
+        if journal is True:
+            journal = Journal()
+        self.journal = journal or None
+        self.history = None  # 加载数据（重放 journal）时不记录历史
+        self._metrics = None
+        self._metrics_server = None
         self.load_data()     # 启动时自动尝试加载数据
-        self.automation = AutomationManager()  # 自动化规则管理器
+        if history is True:
+            history = AttributeHistory()
+        self.history = history or None
+        for device in self.devices_of_type("doorlock"):
+            self.state["door_locked"] = device.attributes.get("locked", True)
+            break
+        self.automation = AutomationManager(self)  # 自动化规则管理器
         self.load_automation_rules()  # 加载自动化规则
+        if metrics:
+            self.enable_metrics(metrics)
 
     # ---------------------------
     # 用户管理
     # ---------------------------
+    @_writing
     def add_user(self, username):
         """添加新用户"""
         if username not in self.users:
-            self.users[username] = User(username)
+            self._add_user(username)
+            self._journal({"op": "add_user", "u": username})
             log(f"添加用户 {username}", username=username)
             print(f"用户 {username} 已创建。")
             return True
@@ -39,6 +166,12 @@ class SmartHome:
             print("用户已存在。")
             return False
 
+    def _add_user(self, username):
+        """登记新用户（不打印、不记日志）"""
+        self.users[username] = User(username)
+        self._mark_user(username)
+
+    @_writing
     def remove_user(self, username):
         """删除用户（同时删除该用户拥有的所有设备）"""
         if username not in self.users:
@@ -51,11 +184,29 @@ class SmartHome:
             self.remove_device(device_id)
         
         # 删除用户
-        del self.users[username]
+        self._remove_user(username)
+        self._journal({"op": "remove_user", "u": username})
         log(f"删除用户 {username}", username=username)
         print(f"用户 {username} 及其所有设备已删除。")
         return True
 
+    def _remove_user(self, username):
+        """删除用户本身及其设备、共享关系（不打印、不记日志）"""
+        for device_id in self.users[username].devices.copy():
+            self._remove_device(device_id)
+        
+        # 取消共享给该用户的设备（只遍历共享索引，不扫描全部设备）
+        for device_id in self._shared_index.pop(username, {}):
+            shared_users = self.devices[device_id].shared_users
+            if username in shared_users:
+                shared_users.remove(username)
+                self._mark_device(device_id)
+        
+        del self.users[username]
+        self._dirty_users.discard(username)
+        self._removed_users.add(username)
+
+    @_reading
     def list_users(self):
         """列出所有用户"""
         if not self.users:
@@ -69,6 +220,7 @@ class SmartHome:
             print(f"- {username} (拥有 {device_count} 个设备)")
         return user_list
 
+    @_reading
     def get_user_devices(self, username):
         """
         获取用户的所有设备（包括自己拥有的和共享给他的）
@@ -82,11 +234,8 @@ class SmartHome:
         # 用户自己拥有的设备
         own_devices = self.users[username].devices.copy()
         
-        # 共享给该用户的设备
-        shared_devices = []
-        for device_id, device in self.devices.items():
-            if username in device.shared_users:
-                shared_devices.append(device_id)
+        # 共享给该用户的设备（来自共享反向索引）
+        shared_devices = list(self._shared_index.get(username, ()))
         
         return {
             "own": own_devices,
@@ -97,6 +246,7 @@ class SmartHome:
     # ---------------------------
     # 设备管理
     # ---------------------------
+    @_writing
     def add_device(self, device_type, device_id, owner):
         """
         添加设备
@@ -121,14 +271,24 @@ class SmartHome:
             return False
 
         # 添加设备
-        self.devices[device_id] = device
-        self.users[owner].add_device(device_id)
+        self._add_device(device_id, device, owner)
+        self._journal({"op": "add_device", "i": device_id, "t": device_type, "u": owner})
 
         log(f"添加设备 {device_type}", device=device, username=owner, 
             extra_info={"device_id": device_id})
         print(f"设备 {device_type} (ID: {device_id}) 添加成功。")
         return True
 
+    def _add_device(self, device_id, device, owner):
+        """登记设备并更新索引（不打印、不记日志）"""
+        device._observer = self._observer
+        self.devices[device_id] = device
+        self.topology_version += 1
+        self.users[owner].add_device(device_id)
+        self._index_device(device_id, device.name, device.shared_users, owner)
+        self._mark_device(device_id)
+        self._mark_user(owner)
+
     def _create_device(self, device_type, device_id):
         """根据设备类型创建设备对象"""
         device_type_lower = device_type.lower()
@@ -151,26 +311,45 @@ class SmartHome:
             # 默认创建基础设备
             return Device(device_type, device_id)
 
+    @_writing
     def remove_device(self, device_id):
         """删除设备"""
         if device_id not in self.devices:
             print("设备不存在。")
             return False
         
-        device = self.devices[device_id]
-        
-        # 从所有用户的设备列表中移除
-        for user in self.users.values():
-            user.remove_device(device_id)
-        
-        # 删除设备
-        del self.devices[device_id]
+        device = self._remove_device(device_id)
+        self._journal({"op": "remove_device", "i": device_id})
         
         log(f"删除设备 {device.name}", device=device_id, 
             extra_info={"device_id": device_id})
         print(f"设备 {device.name} (ID: {device_id}) 已删除。")
         return True
 
+    def _remove_device(self, device_id):
+        """删除设备并更新索引（不打印、不记日志），返回被删除的设备"""
+        device = self.devices[device_id]
+        
+        # 只从所有者和共享用户处移除（通过反向索引定位）
+        owner = self._device_owner.pop(device_id, None)
+        if owner in self.users:
+            self.users[owner].remove_device(device_id)
+            self._mark_user(owner)
+        for username in device.shared_users:
+            self._shared_index.get(username, {}).pop(device_id, None)
+        self._type_index.get(device.name.lower(), {}).pop(device_id, None)
+        
+        # 删除设备
+        del self.devices[device_id]
+        self._device_locks.pop(device_id, None)
+        if self.history is not None:
+            self.history.forget(device_id)
+        self._dirty_devices.discard(device_id)
+        self._removed_devices.add(device_id)
+        self.topology_version += 1
+        return device
+
+    @_reading
     def show_devices(self):
         """显示所有设备"""
         if not self.devices:
@@ -179,12 +358,7 @@ class SmartHome:
         
         print("\n=== 所有设备列表 ===")
         for device_id, device in self.devices.items():
-            # 查找设备所有者
-            owner = None
-            for username, user in self.users.items():
-                if device_id in user.devices:
-                    owner = username
-                    break
+            owner = self._device_owner.get(device_id)
             
             print(f"\n设备: {device.name}")
             print(f"  ID: {device_id}")
@@ -195,61 +369,90 @@ class SmartHome:
             if device.shared_users:
                 print(f"  共享给: {', '.join(device.shared_users)}")
 
+    @_reading
+    def device_ids(self):
+        """返回所有设备ID的列表（线程安全模式下可以在其他线程增删设备时调用）"""
+        return list(self.devices)
+
+    @_reading
     def get_device(self, device_id):
         """获取设备对象"""
         return self.devices.get(device_id)
 
+    @_reading
+    def get_device_owner(self, device_id):
+        """获取设备所有者用户名（不存在时返回 None）"""
+        return self._device_owner.get(device_id)
+
+    @_reading
+    def devices_of_type(self, device_type):
+        """
+        按类型获取设备（通过类型索引，不扫描全部设备）
+        
+        :param device_type: 设备类型（light/aircon/doorlock/...，不区分大小写）
+        :return: 设备对象列表
+        """
+        device_ids = self._type_index.get(device_type.lower(), ())
+        return [self.devices[device_id] for device_id in device_ids]
+
+    @_reading
+    def device_summary(self, device_id):
+        """
+        获取设备名称和状态（懒加载模式下不会创建设备对象，适合列表显示）
+        
+        :return: (name, status)
+        """
+        if isinstance(self.devices, LazyDeviceMap):
+            return self.devices.peek(device_id)
+        device = self.devices[device_id]
+        return device.name, device.status
+
+    def _index_device(self, device_id, name, shared_users, owner=None):
+        """把设备登记到类型索引和所有者/共享反向索引中"""
+        self._type_index.setdefault(name.lower(), {})[device_id] = None
+        if owner is not None:
+            self._device_owner[device_id] = owner
+        for username in shared_users:
+            self._shared_index.setdefault(username, {})[device_id] = None
+
     # ---------------------------
     # 设备控制
     # ---------------------------
     def control_device(self, device_id, action, **kwargs):
         """
-        控制设备
+        控制设备（操作完成、写好日志后再发布设备变化事件）
         
         :param device_id: 设备ID
         :param action: 操作类型（turn_on/turn_off/set_attr等）
         :param kwargs: 额外参数（如属性名、属性值等）
         :return: 是否操作成功
         """
+        self._hold.depth += 1
+        try:
+            if self._lock is None:
+                return self._control_device(device_id, action, **kwargs)
+            with self._lock.read(), self._device_lock(device_id):
+                return self._control_device(device_id, action, **kwargs)
+        finally:
+            self._release_events()
+
+    def _control_device(self, device_id, action, **kwargs):
+        """执行设备操作（见 control_device）"""
         if device_id not in self.devices:
             print("设备不存在。")
             return False
         
         device = self.devices[device_id]
-        old_status = device.status
-        old_attrs = device.attributes.copy()
         
         # 执行操作
-        success = False
-        if action == "turn_on":
-            success = device.turn_on()
-            if success:
-                log(f"打开设备 {device.name}", device=device, 
-                    extra_info={"device_id": device_id, "old_status": old_status})
-        elif action == "turn_off":
-            success = device.turn_off()
-            if success:
-                log(f"关闭设备 {device.name}", device=device,
-                    extra_info={"device_id": device_id, "old_status": old_status})
-        elif action == "set_attr":
-            key = kwargs.get("key")
-            value = kwargs.get("value")
-            if key and value is not None:
-                device.set_attr(key, value)
-                success = True
-                log(f"设置设备属性 {device.name}.{key} = {value}", device=device,
-                    extra_info={"device_id": device_id, "key": key, "value": value})
-        else:
-            # 尝试调用设备的其他方法
-            if hasattr(device, action):
-                method = getattr(device, action)
-                if callable(method):
-                    result = method(*kwargs.get("args", []), **kwargs.get("kwargs", {}))
-                    success = result if isinstance(result, bool) else True
-                    log(f"执行设备操作 {device.name}.{action}", device=device,
-                        extra_info={"device_id": device_id, "action": action})
-        
+        success, message, extra_info = self._apply_action(device, action, kwargs)
+        if self._metrics is not None:
+            self._metrics.count_command(device.name, action, success)
         if success:
+            log(message, device=device, extra_info=extra_info)
+            if self.journal is not None:   # 没有 journal 时不复制属性
+                self._journal({"op": "state", "i": device_id, "s": device.status,
+                               "a": dict(device.attributes)})
             print(f"设备 {device.name} (ID: {device_id}) 操作成功。")
             print(f"  当前状态: {device.status}")
             if device.attributes:
@@ -257,9 +460,360 @@ class SmartHome:
         
         return success
 
+    @_writing
+    def control_many(self, commands, save=False):
+        """
+        批量控制设备：先检查全部命令，再一次执行完，
+        日志和 journal 各只写入一次，设备变化事件在最后统一发布
+
+        :param commands: [(设备ID, 操作类型, 参数字典), ...]，参数字典可以为 None
+        :param save: 有操作成功时是否保存一次数据
+        :return: 每条命令是否成功的列表（与 commands 顺序相同）
+        """
+        commands = [(device_id, action, kwargs or {}) for device_id, action, kwargs in commands]
+        results = [False] * len(commands)
+
+        # 先检查全部命令
+        valid = []
+        errors = []
+        for i, (device_id, action, kwargs) in enumerate(commands):
+            error = self._check_command(device_id, action, kwargs)
+            if error:
+                errors.append(f"{device_id}.{action}：{error}")
+            else:
+                valid.append(i)
+
+        records = []
+        journal_records = []
+        unchanged = 0
+        self._hold.depth += 1
+        try:
+            for i in valid:
+                device_id, action, kwargs = commands[i]
+                device = self.devices[device_id]
+                if action in ("turn_on", "turn_off") and device.status == action[5:]:
+                    unchanged += 1    # 已经处于目标开关状态，不再操作
+                    continue
+                success, message, extra_info = self._apply_action(device, action, kwargs)
+                if self._metrics is not None:
+                    self._metrics.count_command(device.name, action, success)
+                if success:
+                    results[i] = True
+                    records.append((message, device, None, extra_info))
+                    if self.journal is not None:
+                        journal_records.append({"op": "state", "i": device_id, "s": device.status,
+                                                "a": dict(device.attributes)})
+            log_many(records)
+            self._journal(*journal_records)
+        finally:
+            self._release_events()
+
+        succeeded = sum(results)
+        summary = f"批量操作完成：成功 {succeeded}/{len(commands)}"
+        if unchanged:
+            summary += f"，{unchanged} 个设备已处于目标状态"
+        print(summary + "。")
+        for error in errors:
+            print(f"  跳过 {error}")
+        if save and succeeded:
+            self.save_data()
+        return results
+
+    def _device_lock(self, device_id):
+        """返回设备的锁（第一次使用时创建）"""
+        lock = self._device_locks.get(device_id)
+        if lock is None:
+            lock = self._device_locks.setdefault(device_id, threading.Lock())
+        return lock
+
+    def _check_command(self, device_id, action, kwargs):
+        """检查一条控制命令，返回错误信息（没有问题时返回 None）"""
+        if device_id not in self.devices:
+            return "设备不存在"
+        if action in ("turn_on", "turn_off"):
+            return None
+        if action == "set_attr":
+            if not kwargs.get("key") or kwargs.get("value") is None:
+                return "缺少属性名或属性值"
+            return None
+        if not callable(getattr(self.devices[device_id], action, None)):
+            return "设备不支持该操作"
+        return None
+
+    def _apply_action(self, device, action, kwargs):
+        """
+        对设备执行一个操作（不打印、不写日志）
+
+        :return: (是否成功, 日志描述, 日志额外信息)
+        """
+        device_id = device.device_id
+        old_status = device.status
+        if action == "turn_on":
+            return (device.turn_on(), f"打开设备 {device.name}",
+                    {"device_id": device_id, "old_status": old_status})
+        if action == "turn_off":
+            return (device.turn_off(), f"关闭设备 {device.name}",
+                    {"device_id": device_id, "old_status": old_status})
+        if action == "set_attr":
+            key = kwargs.get("key")
+            value = kwargs.get("value")
+            if key and value is not None:
+                device.set_attr(key, value)
+                return (True, f"设置设备属性 {device.name}.{key} = {value}",
+                        {"device_id": device_id, "key": key, "value": value})
+            return False, None, None
+        # 尝试调用设备的其他方法
+        method = getattr(device, action, None)
+        if callable(method):
+            result = method(*kwargs.get("args", []), **kwargs.get("kwargs", {}))
+            success = result if isinstance(result, bool) else True
+            return (success, f"执行设备操作 {device.name}.{action}",
+                    {"device_id": device_id, "action": action})
+        return False, None, None
+
+    # ---------------------------
+    # 场景
+    # ---------------------------
+    @_writing
+    def add_scene(self, spec):
+        """
+        添加（或替换同名）场景
+
+        :param spec: 场景定义字典（见 scene.py）
+        :return: 是否添加成功
+        """
+        try:
+            scene = Scene(spec)
+        except ValueError as e:
+            print(f"场景无效：{e}")
+            return False
+        self.scenes[scene.name] = scene
+        self._scenes_dirty = True
+        if self.journal is not None:
+            self._journal({"op": "add_scene", "scene": scene.to_dict()})
+        log(f"添加场景 {scene.name}", code="scene.add")
+        print(f"场景 {scene.name} 已添加。")
+        return True
+
+    @_writing
+    def remove_scene(self, name):
+        """删除场景"""
+        if name not in self.scenes:
+            print("场景不存在。")
+            return False
+        del self.scenes[name]
+        self._scenes_dirty = True
+        self._journal({"op": "remove_scene", "name": name})
+        log(f"删除场景 {name}", code="scene.remove")
+        print(f"场景 {name} 已删除。")
+        return True
+
+    @_reading
+    def list_scenes(self):
+        """返回场景描述列表"""
+        return [f"{name}：{scene.spec.get('description', '')}".rstrip("：")
+                for name, scene in self.scenes.items()]
+
+    @_writing
+    def apply_scene(self, name):
+        """
+        原子地应用场景：只修改状态与场景不同的设备；
+        任何设备拒绝修改（例如温度超出范围）时，已修改的设备全部恢复原状
+
+        :param name: 场景名称
+        :return: 是否应用成功
+        """
+        scene = self.scenes.get(name)
+        if scene is None:
+            print("场景不存在。")
+            return False
+        changes = scene.diff(self)
+        if not changes:
+            print(f"场景 {name} 已经生效，无需修改设备。")
+            return True
+
+        backups = []
+        mark = len(self._hold.keys)
+        self._hold.depth += 1
+        try:
+            failed = None
+            for device, status, attributes in changes:
+                backups.append((device, device.status, dict(device.attributes)))
+                try:
+                    accepted = apply_change(device, status, attributes)
+                except (TypeError, ValueError):
+                    accepted = False
+                if not accepted:
+                    failed = device
+                    break
+
+            if failed is not None:
+                for device, old_status, old_attrs in reversed(backups):
+                    self._restore_device(device, old_status, old_attrs)
+                del self._hold.keys[mark:]    # 状态已恢复，不发布这次的变化事件
+                log(f"场景回滚 {name}", device=failed, code="scene.rollback")
+                print(f"设备 {failed.name} (ID: {failed.device_id}) 拒绝修改，场景 {name} 已回滚。")
+                return False
+
+            log_many([(f"应用场景 {name}", device, None,
+                       {"device_id": device.device_id, "scene": name}, "scene.apply")
+                      for device, _, _ in changes])
+            if self.journal is not None:
+                self._journal(*({"op": "state", "i": device.device_id, "s": device.status,
+                                 "a": dict(device.attributes)} for device, _, _ in changes))
+        finally:
+            self._release_events()
+
+        print(f"场景 {name} 已应用，修改了 {len(changes)} 个设备。")
+        return True
+
+    def _restore_device(self, device, status, attributes):
+        """把设备恢复为备份的状态和属性（不做取值检查）"""
+        current = dict(device.attributes)
+        for key in current:
+            if key not in attributes:
+                del device.attributes[key]
+        for key, value in attributes.items():
+            if current.get(key) != value:
+                device.set_attr(key, value)
+        if device.status != status:
+            device.status = status
+            device._changed("status")
+
+    # ---------------------------
+    # 事件
+    # ---------------------------
+    def subscribe(self, callback):
+        """
+        订阅状态变化事件
+
+        :param callback: callback(state, changed_keys)，state 为 self.state，
+                         changed_keys 例如 ["temperature"]、["D01.status"]
+        """
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """取消订阅"""
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def update_sensor(self, key, value):
+        """
+        更新传感器数据（例如温度、是否有人），值变化时发布事件
+
+        :return: 值是否发生变化
+        """
+        if key in self.state and self.state[key] == value:
+            return False
+        self.state[key] = value
+        self._publish([key])
+        return True
+
+    def _on_device_change(self, device, key, value):
+        """设备的变化回调：标记设备已修改，记录历史，并转换为 "设备ID.属性名" 事件"""
+        self._dirty_devices.add(device.device_id)
+        if self.history is not None:
+            self.history.record(device.device_id, key, value)
+        keys = [f"{device.device_id}.{key}"]
+        if key == "locked":
+            # 门锁状态同时作为 door_locked 传感器数据
+            self.state["door_locked"] = value
+            keys.append("door_locked")
+        self._publish(keys)
+
+    def _release_events(self):
+        """结束一次暂存；最外层结束时发布暂存的事件，并执行推迟的检查点"""
+        hold = self._hold
+        hold.depth -= 1
+        if hold.depth:
+            return
+        if hold.keys:
+            keys, hold.keys = hold.keys, []
+            self._publish(keys)
+        if self._checkpoint_due:
+            self._checkpoint_due = False
+            self.checkpoint()
+
+    def _publish(self, keys):
+        """通知所有订阅者（暂存期间先记下来）"""
+        if self._hold.depth:
+            self._hold.keys.extend(keys)
+            return
+        for callback in list(self._subscribers):
+            callback(self.state, keys)
+
+    # ---------------------------
+    # 性能指标
+    # ---------------------------
+    def enable_metrics(self, metrics=True):
+        """
+        开始收集性能指标（运行中也可以启用；已经启用时不重复替换）
+
+        :param metrics: True 或 Metrics 对象
+        :return: 使用的 Metrics 对象
+        """
+        if self._metrics is None:
+            self._metrics = Metrics() if metrics is True else metrics
+            self._instrument()
+        return self._metrics
+
+    def _instrument(self):
+        """给入口方法换上计时版本（只替换本对象的方法），登记读取时计算的数值"""
+        metrics = self._metrics
+        metrics.instrument(self, "control_device")
+        metrics.instrument(self, "save_data")
+        metrics.instrument(self.automation, "run_all")
+        metrics.instrument(self.automation, "run_changed")
+        metrics.instrument(get_logger(), "log_action")   # 全局日志记录器（logger.configure 之后需要重新启用）
+        metrics.gauge("devices", "设备数量", lambda: len(self.devices))
+        metrics.gauge("users", "用户数量", lambda: len(self.users))
+        metrics.gauge("unsaved_changes", "上次保存之后是否有修改",
+                      lambda: int(self.has_unsaved_changes()))
+
+    def metrics(self):
+        """
+        性能指标快照（见 Metrics.snapshot）：各操作的次数、异常次数、平均/分位数/最大耗时（微秒），
+        按设备类型和操作统计的控制命令数，设备数、用户数
+
+        :return: 字典；没有启用指标时返回 None
+        """
+        if self._metrics is None:
+            return None
+        return self._metrics.snapshot()
+
+    def serve_metrics(self, port=9464, host="127.0.0.1"):
+        """
+        在本地端口提供 Prometheus 文本格式的指标（GET /metrics）
+
+        :return: MetricsServer 对象；没有启用指标或端口被占用时返回 None
+        """
+        if self._metrics is None:
+            print("没有启用性能指标（SmartHome(metrics=True) 或 enable_metrics()）。")
+            return None
+        if self._metrics_server is None:
+            server = MetricsServer(self._metrics.prometheus, port, host)
+            try:
+                server.start()
+            except OSError as e:
+                print(f"指标服务启动失败: {e}")
+                return None
+            self._metrics_server = server
+            print(f"指标服务已启动: http://{host}:{server.port}/metrics")
+        return self._metrics_server
+
+    def stop_metrics(self):
+        """停止指标服务"""
+        if self._metrics_server is None:
+            return False
+        self._metrics_server.stop()
+        self._metrics_server = None
+        return True
+
     # ---------------------------
     # 设备共享
     # ---------------------------
+    @_writing
     def share_device(self, device_id, username):
         """共享设备给其他用户"""
         if device_id not in self.devices:
@@ -269,7 +823,8 @@ class SmartHome:
             print("用户不存在。")
             return False
 
-        if self.devices[device_id].share(username):
+        if self._share_device(device_id, username):
+            self._journal({"op": "share", "i": device_id, "u": username})
             log(f"设备 {device_id} 被共享给用户 {username}", 
                 device=self.devices[device_id], username=username)
             print(f"设备 {device_id} 已共享给用户 {username}。")
@@ -278,80 +833,344 @@ class SmartHome:
             print(f"设备 {device_id} 已经共享给用户 {username}。")
             return False
 
+    def _share_device(self, device_id, username):
+        """共享设备并更新共享索引（不打印、不记日志）"""
+        if self.devices[device_id].share(username):
+            self._shared_index.setdefault(username, {})[device_id] = None
+            self._mark_device(device_id)
+            return True
+        return False
+
     # ---------------------------
     # 数据保存 / 加载
     # ---------------------------
+    @_writing
     def save_data(self):
-        """保存系统到 data.json"""
-        data = {
+        """
+        保存修改：没有修改时不写文件；否则把修改过的用户、设备追加到增量文件
+        （data.json.delta 或 data.bin.delta），增量文件过大时重写完整快照。
+        启用 journal 时同时清空 journal
+        """
+        if not self.has_unsaved_changes() and os.path.exists(self.data_file):
+            print("没有未保存的修改。")
+            return
+        full = self._persist()
+
+        log("系统数据已保存")
+        if full:
+            print(f"系统数据已保存到 {self.data_file}。")
+        else:
+            print(f"系统修改已保存到 {self.delta_file}。")
+
+    @_writing
+    def checkpoint(self):
+        """检查点：把 journal 中的修改写入快照（或增量文件），然后清空 journal"""
+        if self.has_unsaved_changes():
+            self._persist()
+        elif self.journal is not None:
+            self.journal.reset()
+        log("journal 检查点完成")
+
+    def has_unsaved_changes(self):
+        """上次保存之后是否有修改"""
+        return bool(self._dirty_users or self._dirty_devices or self._removed_users
+                    or self._removed_devices or self._scenes_dirty)
+
+    def _mark_user(self, username):
+        self._dirty_users.add(username)
+        self._removed_users.discard(username)
+
+    def _mark_device(self, device_id):
+        self._dirty_devices.add(device_id)
+        self._removed_devices.discard(device_id)
+
+    def _persist(self):
+        """
+        写入未保存的修改并清除脏标记：
+        快照文件不存在、增量文件超过快照的一半或增量文件损坏时写完整快照（并删除增量文件），
+        否则追加一条增量记录
+
+        :return: 是否写了完整快照
+        """
+        delta = self._delta_record()
+        line = json.dumps(delta, ensure_ascii=False) + "\n"
+        try:
+            limit = os.path.getsize(self.data_file) // 2
+            size = os.path.getsize(self.delta_file) if os.path.exists(self.delta_file) else 0
+            full = self._full_save_due or size + len(line) > limit
+        except FileNotFoundError:
+            full = True
+
+        if full:
+            self._write_snapshot()
+            if os.path.exists(self.delta_file):
+                os.remove(self.delta_file)
+            self._full_save_due = False
+            self._delta_lines = 0
+        else:
+            with open(self.delta_file, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._delta_lines += 1
+
+        self._dirty_users.clear()
+        self._dirty_devices.clear()
+        self._removed_users.clear()
+        self._removed_devices.clear()
+        self._scenes_dirty = False
+        if self.journal is not None:
+            self.journal.reset()
+        return full
+
+    def _delta_record(self):
+        """一条增量记录：只包含修改过的部分（"g" 为所属快照的代号）"""
+        delta = {"g": self._generation}
+        if self._dirty_users:
+            delta["users"] = {u: self.users[u].__dict__ for u in self._dirty_users}
+        if self._dirty_devices:
+            delta["devices"] = {d: self._device_record(d) for d in self._dirty_devices}
+        if self._removed_users:
+            delta["removed_users"] = list(self._removed_users)
+        if self._removed_devices:
+            delta["removed_devices"] = list(self._removed_devices)
+        if self._scenes_dirty:
+            delta["scenes"] = [scene.to_dict() for scene in self.scenes.values()]
+        return delta
+
+    def _snapshot_data(self):
+        """把系统状态整理成可序列化的字典（data.json 的结构）"""
+        return {
             "users": {u: self.users[u].__dict__ for u in self.users},
-            "devices": {
-                d: {
-                    "name": self.devices[d].name,
-                    "device_id": self.devices[d].device_id,
-                    "status": self.devices[d].status,
-                    "attributes": self.devices[d].attributes,
-                    "shared_users": self.devices[d].shared_users,
-                }
-                for d in self.devices
-            }
+            "devices": {d: self._device_record(d) for d in self.devices},
+            "scenes": [scene.to_dict() for scene in self.scenes.values()],
         }
 
-        with open("data.json", "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+    def _device_record(self, device_id):
+        """单个设备的可序列化记录（懒加载模式下未创建对象的设备直接使用原始记录）"""
+        if isinstance(self.devices, LazyDeviceMap):
+            record = self.devices.raw(device_id)
+            if record is not None:
+                return record
+        device = self.devices[device_id]
+        return {
+            "name": device.name,
+            "device_id": device.device_id,
+            "status": device.status,
+            "attributes": dict(device.attributes),
+            "shared_users": list(device.shared_users),
+        }
 
-        log("系统数据已保存")
-        print("系统数据已保存到 data.json。")
+    def _write_snapshot(self):
+        """
+        把完整系统状态写入快照文件（先写临时文件再替换，避免写到一半崩溃）。
+        每次写入使用新的代号，替换后、删除旧增量文件前崩溃时，旧的增量记录不会再被应用
+        """
+        data = self._snapshot_data()
+        data["generation"] = self._generation + 1
+        tmp_file = self.data_file + ".tmp"
+        if self.snapshot_format == "binary":
+            snapshot.dump(data, tmp_file)
+        else:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_file, self.data_file)
+        self._generation = data["generation"]
+
+    def _read_snapshot(self):
+        """读取快照文件，返回 data.json 结构的字典"""
+        if self.snapshot_format == "binary":
+            return snapshot.load(self.data_file)
+        with open(self.data_file, "r", encoding="utf-8") as f:
+            return json.load(f)
 
     def load_data(self):
         """启动时加载数据"""
         try:
-            with open("data.json", "r", encoding="utf-8") as f:
-                data = json.load(f)
+            data = self._read_snapshot()
+            self._generation = data.get("generation", 0)
+            merged = self._delta_lines = self._merge_delta(data)
 
             # 还原用户
             for username in data["users"]:
                 self.users[username] = User(username)
                 self.users[username].devices = data["users"][username]["devices"]
 
-            # 还原设备
+            # 还原设备（懒加载模式下只保存原始记录）
+            lazy = isinstance(self.devices, LazyDeviceMap)
             for device_id, dev_data in data["devices"].items():
-                device = self._create_device(dev_data["name"], device_id)
-                if device:
-                    device.status = dev_data["status"]
-                    device.attributes = dev_data["attributes"]
-                    device.shared_users = dev_data["shared_users"]
-                    self.devices[device_id] = device
+                if lazy:
+                    self.devices.load_record(device_id, dev_data)
+                else:
+                    self.devices[device_id] = self._hydrate_device(device_id, dev_data)
+                self._index_device(device_id, dev_data["name"], dev_data["shared_users"])
+
+            # 还原场景
+            for spec in data.get("scenes", []):
+                try:
+                    scene = Scene(spec)
+                except ValueError as e:
+                    print(f"跳过无效场景：{e}")
+                    continue
+                self.scenes[scene.name] = scene
 
-            print("系统数据已从 data.json 加载。")
+            # 重建所有者索引
+            for username, user in self.users.items():
+                for device_id in user.devices:
+                    if device_id in self.devices:
+                        self._device_owner[device_id] = username
+
+            print(f"系统数据已从 {self.data_file} 加载。")
+            if merged:
+                print(f"已合并 {merged} 条增量记录。")
 
         except FileNotFoundError:
             print("首次启动，无保存数据。")
         except Exception as e:
             print(f"加载数据时出错: {e}")
 
+        if self.journal is not None:
+            self._replay_journal()
+
+    def _merge_delta(self, data):
+        """
+        把增量文件中属于当前快照的记录按顺序合并进快照字典
+
+        :return: 合并的记录数
+        """
+        try:
+            f = open(self.delta_file, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return 0
+        count = 0
+        with f:
+            for line in f:
+                try:
+                    delta = json.loads(line)
+                except ValueError:
+                    # 写到一半的记录：之后追加的记录无法再读取，下次保存时重写完整快照
+                    self._full_save_due = True
+                    break
+                if delta.get("g") != self._generation:
+                    continue
+                for username in delta.get("removed_users", ()):
+                    data["users"].pop(username, None)
+                for device_id in delta.get("removed_devices", ()):
+                    data["devices"].pop(device_id, None)
+                data["users"].update(delta.get("users", {}))
+                data["devices"].update(delta.get("devices", {}))
+                if "scenes" in delta:
+                    data["scenes"] = delta["scenes"]
+                count += 1
+        return count
+
+    def _hydrate_device(self, device_id, dev_data):
+        """根据保存的记录创建设备对象"""
+        device = self._create_device(dev_data["name"], device_id)
+        device.status = dev_data["status"]
+        device.attributes = dev_data["attributes"]
+        device.shared_users = dev_data["shared_users"]
+        device._observer = self._observer
+        return device
+
+    # ---------------------------
+    # 预写日志（journal）
+    # ---------------------------
+    def _journal(self, *records):
+        """
+        追加 journal 记录（可以一次多条），达到阈值时自动做检查点。
+        每条记录带上写入时的保存位置（"g" 快照代号、"n" 增量记录数），
+        保存之后、清空 journal 之前崩溃时，重放会跳过已经保存过的记录
+        """
+        if self.journal is None or not records:
+            return
+        for record in records:
+            record["g"] = self._generation
+            record["n"] = self._delta_lines
+        self.journal.append_many(records)
+        if self.journal.needs_checkpoint():
+            if self._lock is None:
+                self.checkpoint()
+            else:
+                self._checkpoint_due = True
+
+    def _replay_journal(self):
+        """
+        在快照基础上重放 journal（每种记录都可以重复执行而不出错）。
+        只重放在当前保存位置之后写入的记录：较早的记录已经包含在快照或增量文件中，
+        再次执行可能把旧设备的状态套到复用了同一ID的新设备上
+        """
+        count = 0
+        position = (self._generation, self._delta_lines)
+        for record in self.journal.replay():
+            if "g" in record and (record["g"], record.get("n", 0)) != position:
+                continue
+            self._apply_record(record)
+            count += 1
+        if count:
+            print(f"已从 journal 恢复 {count} 条未保存的修改。")
+
+    def _apply_record(self, record):
+        """执行一条 journal 记录"""
+        op = record.get("op")
+        if op == "add_user":
+            if record["u"] not in self.users:
+                self._add_user(record["u"])
+        elif op == "remove_user":
+            if record["u"] in self.users:
+                self._remove_user(record["u"])
+        elif op == "add_device":
+            if record["i"] not in self.devices and record["u"] in self.users:
+                device = self._create_device(record["t"], record["i"])
+                self._add_device(record["i"], device, record["u"])
+        elif op == "remove_device":
+            if record["i"] in self.devices:
+                self._remove_device(record["i"])
+        elif op == "state":
+            if record["i"] in self.devices:
+                device = self.devices[record["i"]]
+                device.status = record["s"]
+                device.attributes = record["a"]
+                self._mark_device(record["i"])
+        elif op == "share":
+            if record["i"] in self.devices and record["u"] in self.users:
+                self._share_device(record["i"], record["u"])
+        elif op == "add_scene":
+            scene = Scene(record["scene"])
+            self.scenes[scene.name] = scene
+            self._scenes_dirty = True
+        elif op == "remove_scene":
+            self.scenes.pop(record["name"], None)
+            self._scenes_dirty = True
+
     def load_automation_rules(self):
-        """加载自动化规则（从JSON文件）"""
+        """加载自动化规则（从JSON文件，声明式规则加载时编译）"""
         try:
             with open("automation_rules.json", "r", encoding="utf-8") as f:
                 rules_data = json.load(f)
-                # 注意：自动化规则包含函数，无法直接序列化
-                # 这里只加载规则描述，实际规则需要在运行时重新添加
-                print(f"找到 {len(rules_data)} 条已保存的规则描述。")
         except FileNotFoundError:
-            pass  # 没有保存的规则文件是正常的
+            return  # 没有保存的规则文件是正常的
         except Exception as e:
             print(f"加载自动化规则时出错: {e}")
+            return
+
+        loaded = 0
+        for spec in rules_data:
+            # 旧版本只保存了规则描述，无法恢复
+            if "condition" in spec and self.automation.add_rule_spec(spec):
+                loaded += 1
+        if loaded:
+            print(f"已加载 {loaded} 条自动化规则。")
+        if loaded < len(rules_data):
+            print(f"有 {len(rules_data) - loaded} 条规则无法恢复（旧格式或定义无效）。")
 
     def save_automation_rules(self):
-        """保存自动化规则描述（仅保存描述，不保存函数）"""
-        rules_data = []
-        for rule in self.automation.rules:
-            rules_data.append({
-                "description": rule.description
-            })
-        
+        """保存自动化规则（声明式规则保存完整定义，函数规则无法保存）"""
+        rules_data, skipped = self.automation.to_specs()
+
         with open("automation_rules.json", "w", encoding="utf-8") as f:
             json.dump(rules_data, f, indent=4, ensure_ascii=False)
-        
-        print("自动化规则描述已保存。")
+
+        print(f"已保存 {len(rules_data)} 条自动化规则。")
+        if skipped:
+            print(f"有 {skipped} 条自定义函数规则无法保存。")
@@ -0,0 +1,338 @@
+"""
+二进制快照格式：
+- 用于生产环境快速重启，JSON 仍然用于数据交换
+- 文件结构：文件头 + 若干带长度前缀的分段
+
+文件头：
+    魔数 b"SHSNAP" | 版本号 uint16 | 分段数 uint16
+
+每个分段：
+    分段标签 4 字节 | 分段长度 uint64 | 分段内容
+
+分段：
+    STRS：字符串表（所有用户名、设备ID、属性名、字符串值只保存一次，用 \x00 分隔）
+    STRL：有字符串包含 \x00 时代替 STRS：字符个数数组 + 连续的字符串内容
+    USER：用户（用户名、拥有的设备ID）
+    DEVS：设备（ID、名称、状态、共享用户、属性）
+    SCEN：场景定义（JSON，可选；没有场景时不写入）
+    GENR：快照代号 int64（可选；增量文件据此判断记录属于哪个快照）
+
+所有整数数组都是小端序，一次性用 array.frombytes 读入，避免逐字段解析。
+
+用法：
+    python snapshot.py to-binary data.json data.bin
+    python snapshot.py to-json data.bin data.json
+"""
+
+import json
+import struct
+import sys
+from array import array
+
+MAGIC = b"SHSNAP"
+VERSION = 1
+
+_HEADER = struct.Struct("<6sHH")
+_SECTION = struct.Struct("<4sQ")
+_ARRAY = struct.Struct("<cQ")
+_COUNT = struct.Struct("<I")
+_FLOAT = struct.Struct("<d")
+_INT64 = struct.Struct("<q")
+
+# 属性值类型标签
+TAG_NONE, TAG_FALSE, TAG_TRUE, TAG_INT, TAG_FLOAT, TAG_STR, TAG_JSON = range(7)
+
+_SEPARATOR = "\x00"
+
+
+class SnapshotError(Exception):
+    """快照文件格式错误"""
+
+
+class _StringTable:
+    """写入时使用的字符串表：相同字符串只保存一次"""
+
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+        self.has_separator = False   # 有字符串包含分隔符时改用 STRL 分段
+
+    def add(self, value):
+        idx = self.index.get(value)
+        if idx is None:
+            if _SEPARATOR in value:
+                self.has_separator = True
+            idx = len(self.strings)
+            self.strings.append(value)
+            self.index[value] = idx
+        return idx
+
+
+def _pack_array(arr):
+    """数组 -> 类型码 + 元素个数 + 小端序数据"""
+    if sys.byteorder == "big":
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return _ARRAY.pack(arr.typecode.encode(), len(arr)) + arr.tobytes()
+
+
+def _unpack_array(buf, offset):
+    """从 buf 的 offset 处读出一个数组，返回 (数组, 新的 offset)"""
+    typecode, count = _ARRAY.unpack_from(buf, offset)
+    offset += _ARRAY.size
+    arr = array(typecode.decode())
+    end = offset + count * arr.itemsize
+    arr.frombytes(buf[offset:end])
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr, end
+
+
+def _unpack_strings(buf):
+    """解码 STRL 分段：按字符个数切分一次解码出的全部内容"""
+    lengths, offset = _unpack_array(buf, 0)
+    text = bytes(buf[offset:]).decode("utf-8")
+    strings = []
+    pos = 0
+    for n in lengths:
+        strings.append(text[pos:pos + n])
+        pos += n
+    if pos != len(text):
+        raise SnapshotError("字符串表损坏")
+    return strings
+
+
+def _encode_value(value, strings):
+    """属性值 -> (类型标签, int64 数据)"""
+    if value is None:
+        return TAG_NONE, 0
+    if value is True:
+        return TAG_TRUE, 0
+    if value is False:
+        return TAG_FALSE, 0
+    if type(value) is int and -2**63 <= value < 2**63:
+        return TAG_INT, value
+    if type(value) is float:
+        return TAG_FLOAT, _INT64.unpack(_FLOAT.pack(value))[0]
+    if type(value) is str:
+        return TAG_STR, strings.add(value)
+    return TAG_JSON, strings.add(json.dumps(value, ensure_ascii=False))
+
+
+def _decode_value(tag, raw, strings):
+    """(类型标签, int64 数据) -> 属性值"""
+    if tag == TAG_INT:
+        return raw
+    if tag == TAG_STR:
+        return strings[raw]
+    if tag == TAG_TRUE:
+        return True
+    if tag == TAG_FALSE:
+        return False
+    if tag == TAG_NONE:
+        return None
+    if tag == TAG_FLOAT:
+        return _FLOAT.unpack(_INT64.pack(raw))[0]
+    if tag == TAG_JSON:
+        return json.loads(strings[raw])
+    raise SnapshotError(f"未知的属性类型标签: {tag}")
+
+
+def dumps(data):
+    """
+    把系统数据（与 data.json 结构相同的字典）编码为二进制快照
+
+    :param data: {"users": {...}, "devices": {...}, "scenes": [...]（可选）, "generation": 代号（可选）}
+    :return: bytes
+    """
+    strings = _StringTable()
+
+    # 用户
+    user_names = array("I")
+    user_device_counts = array("I")
+    user_devices = array("I")
+    for username, user_data in data["users"].items():
+        user_names.append(strings.add(username))
+        user_device_counts.append(len(user_data["devices"]))
+        user_devices.extend(strings.add(d) for d in user_data["devices"])
+
+    # 设备
+    dev_ids = array("I")
+    dev_names = array("I")
+    dev_status = array("I")
+    shared_counts = array("I")
+    shared_users = array("I")
+    attr_counts = array("I")
+    attr_keys = array("I")
+    attr_tags = array("B")
+    attr_values = array("q")
+    for device_id, dev_data in data["devices"].items():
+        dev_ids.append(strings.add(device_id))
+        dev_names.append(strings.add(dev_data["name"]))
+        dev_status.append(strings.add(dev_data["status"]))
+        shared_counts.append(len(dev_data["shared_users"]))
+        shared_users.extend(strings.add(u) for u in dev_data["shared_users"])
+        attr_counts.append(len(dev_data["attributes"]))
+        for key, value in dev_data["attributes"].items():
+            tag, raw = _encode_value(value, strings)
+            attr_keys.append(strings.add(key))
+            attr_tags.append(tag)
+            attr_values.append(raw)
+
+    if strings.has_separator:
+        lengths = array("I", map(len, strings.strings))
+        strs_section = (b"STRL", _pack_array(lengths) + "".join(strings.strings).encode("utf-8"))
+    else:
+        strs_section = (b"STRS", _COUNT.pack(len(strings.strings))
+                        + _SEPARATOR.join(strings.strings).encode("utf-8"))
+    sections = [
+        strs_section,
+        (b"USER", b"".join(_pack_array(a) for a in (
+            user_names, user_device_counts, user_devices))),
+        (b"DEVS", b"".join(_pack_array(a) for a in (
+            dev_ids, dev_names, dev_status, shared_counts, shared_users,
+            attr_counts, attr_keys, attr_tags, attr_values))),
+    ]
+    if data.get("scenes"):
+        sections.append((b"SCEN", json.dumps(data["scenes"], ensure_ascii=False).encode("utf-8")))
+    if data.get("generation"):
+        sections.append((b"GENR", _INT64.pack(data["generation"])))
+
+    parts = [_HEADER.pack(MAGIC, VERSION, len(sections))]
+    for tag, payload in sections:
+        parts.append(_SECTION.pack(tag, len(payload)))
+        parts.append(payload)
+    return b"".join(parts)
+
+
+def loads(buf):
+    """
+    解码二进制快照
+
+    :param buf: bytes
+    :return: 与 data.json 结构相同的字典
+    """
+    magic, version, section_count = _HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise SnapshotError("不是智能家居二进制快照文件")
+    if version > VERSION:
+        raise SnapshotError(f"不支持的快照版本: {version}（当前支持 {VERSION}）")
+
+    # 读出所有分段（未知分段直接跳过，便于以后扩展）
+    sections = {}
+    offset = _HEADER.size
+    for _ in range(section_count):
+        tag, length = _SECTION.unpack_from(buf, offset)
+        offset += _SECTION.size
+        sections[tag] = memoryview(buf)[offset:offset + length]
+        offset += length
+
+    try:
+        users_buf, devs_buf = sections[b"USER"], sections[b"DEVS"]
+    except KeyError as e:
+        raise SnapshotError(f"快照缺少分段: {e}")
+    if b"STRS" in sections:
+        strs = sections[b"STRS"]
+        count = _COUNT.unpack_from(strs, 0)[0]
+        strings = bytes(strs[_COUNT.size:]).decode("utf-8").split(_SEPARATOR) if count else []
+        if len(strings) != count:
+            raise SnapshotError("字符串表损坏")
+    elif b"STRL" in sections:
+        strings = _unpack_strings(sections[b"STRL"])
+    else:
+        raise SnapshotError("快照缺少分段: b'STRS'")
+
+    # 用户
+    arrays = []
+    offset = 0
+    for _ in range(3):
+        arr, offset = _unpack_array(users_buf, offset)
+        arrays.append(arr.tolist())
+    user_names, user_device_counts, user_devices = arrays
+    users = {}
+    pos = 0
+    for name_idx, n in zip(user_names, user_device_counts):
+        username = strings[name_idx]
+        users[username] = {
+            "username": username,
+            "devices": [strings[i] for i in user_devices[pos:pos + n]],
+        }
+        pos += n
+
+    # 设备
+    arrays = []
+    offset = 0
+    for _ in range(9):
+        arr, offset = _unpack_array(devs_buf, offset)
+        arrays.append(arr.tolist())
+    (dev_ids, dev_names, dev_status, shared_counts, shared_users,
+     attr_counts, attr_keys, attr_tags, attr_values) = arrays
+    # 先批量解码所有属性名和属性值（整数、字符串是最常见的情况，直接内联处理）
+    keys = [strings[i] for i in attr_keys]
+    values = [raw if tag == TAG_INT else strings[raw] if tag == TAG_STR
+              else _decode_value(tag, raw, strings)
+              for tag, raw in zip(attr_tags, attr_values)]
+    devices = {}
+    shared_pos = 0
+    attr_pos = 0
+    for id_idx, name_idx, status_idx, n_shared, n_attrs in zip(
+            dev_ids, dev_names, dev_status, shared_counts, attr_counts):
+        device_id = strings[id_idx]
+        end = attr_pos + n_attrs
+        devices[device_id] = {
+            "name": strings[name_idx],
+            "device_id": device_id,
+            "status": strings[status_idx],
+            "attributes": dict(zip(keys[attr_pos:end], values[attr_pos:end])),
+            "shared_users": [strings[i] for i in shared_users[shared_pos:shared_pos + n_shared]]
+                            if n_shared else [],
+        }
+        attr_pos = end
+        shared_pos += n_shared
+
+    result = {"users": users, "devices": devices}
+    if b"SCEN" in sections:
+        result["scenes"] = json.loads(bytes(sections[b"SCEN"]).decode("utf-8"))
+    if b"GENR" in sections:
+        result["generation"] = _INT64.unpack_from(sections[b"GENR"], 0)[0]
+    return result
+
+
+def dump(data, path):
+    """写入二进制快照文件"""
+    with open(path, "wb") as f:
+        f.write(dumps(data))
+
+
+def load(path):
+    """读取二进制快照文件"""
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def json_to_binary(json_path, binary_path):
+    """data.json -> 二进制快照"""
+    with open(json_path, "r", encoding="utf-8") as f:
+        dump(json.load(f), binary_path)
+
+
+def binary_to_json(binary_path, json_path):
+    """二进制快照 -> data.json"""
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(load(binary_path), f, indent=4, ensure_ascii=False)
+
+
+def main():
+    if len(sys.argv) != 4 or sys.argv[1] not in ("to-binary", "to-json"):
+        print("用法: python snapshot.py to-binary data.json data.bin")
+        print("      python snapshot.py to-json data.bin data.json")
+        sys.exit(1)
+    if sys.argv[1] == "to-binary":
+        json_to_binary(sys.argv[2], sys.argv[3])
+    else:
+        binary_to_json(sys.argv[2], sys.argv[3])
+    print(f"已转换: {sys.argv[2]} -> {sys.argv[3]}")
+
+
+if __name__ == "__main__":
+    main()
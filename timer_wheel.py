@@ -0,0 +1,279 @@
+"""
+分层时间轮（hierarchical timer wheel）：
+- 定时器按到期时间放进轮子的槽里，添加和取消都是 O(1)（不需要堆或排序）
+- 第 0 层每个槽是一个 tick（默认 0.1 秒），第 1 层每个槽是第 0 层转一圈的时间，依此类推；
+  高层的定时器快到期时逐层移到低层（cascade）。默认 4 层 × 256 槽，可以覆盖 13 年以上，
+  更远的定时器先放在最高层最远的槽里，移动时重新计算位置
+- 每个 tick 只处理一个槽，等待中的定时器再多（例如 10 万个）也不会增加每个 tick 的开销
+- 回调在锁外执行。回调耗时过长或线程被延迟时，错过的 tick 在下一次一起处理，
+  周期定时器错过的多次触发合并为一次（不会堆积），这些情况都记录在 stats 中
+
+用法：
+    wheel = TimerWheel()
+    timer = wheel.call_later(300, print, "5 分钟到了")
+    wheel.cancel(timer)
+    wheel.call_every(3600, report)   # 每小时一次
+    wheel.start()                    # 后台线程驱动；也可以由界面定时调用 wheel.advance()
+"""
+
+import math
+import threading
+import time
+
+
+class Timer:
+    """定时器（由 TimerWheel.call_later / call_every 返回，用于取消）"""
+
+    __slots__ = ("due", "interval", "callback", "args", "cancelled", "_slot")
+
+    def __init__(self, due, interval, callback, args):
+        self.due = due              # 到期的 tick
+        self.interval = interval    # 周期（tick 数），None 表示只触发一次
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self._slot = None           # 所在的槽；已经取出（正在触发）或已取消时为 None
+
+    @property
+    def pending(self):
+        """是否还在轮子里等待触发"""
+        return self._slot is not None
+
+    def __repr__(self):
+        state = "已取消" if self.cancelled else ("等待中" if self.pending else "已到期")
+        return f"Timer(tick={self.due}, {state})"
+
+
+class TimerWheel:
+    """
+    分层时间轮：
+    - call_later(delay, callback, *args)：delay 秒后调用一次
+    - call_every(interval, callback, *args)：每 interval 秒调用一次
+    - cancel(timer)：取消
+    - advance()：处理到当前时间为止到期的定时器；start() 在后台线程中定期调用
+    """
+
+    def __init__(self, tick=0.1, slots=256, levels=4, clock=time.monotonic):
+        """
+        :param tick: 时间精度（秒）
+        :param slots: 每层的槽数
+        :param levels: 层数
+        :param clock: 单调时钟函数（测试时可以替换）
+        """
+        if tick <= 0:
+            raise ValueError(f"tick 必须大于 0: {tick}")
+        if slots < 2 or levels < 1:
+            raise ValueError(f"slots 至少为 2，levels 至少为 1: {slots}, {levels}")
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._clock = clock
+        self._origin = clock()
+        self._now = 0                                  # 已经处理到的 tick
+        self._spans = [slots ** level for level in range(levels + 1)]   # 每层一个槽的 tick 数
+        self._wheel = [[{} for _ in range(slots)] for _ in range(levels)]
+        self._count = 0
+        self._lock = threading.Lock()                  # 保护轮子（添加、取消、移动）
+        self._advance_lock = threading.RLock()         # 同一时间只有一个线程推进（回调可以再推进）
+        self._thread = None
+        self._stop = threading.Event()
+        self.stats = {
+            "ticks": 0,        # 处理过的 tick 数
+            "fired": 0,        # 触发的回调次数
+            "errors": 0,       # 回调抛出的异常次数
+            "overruns": 0,     # 推进时已经落后超过一个 tick 的次数
+            "late_ticks": 0,   # 落后而合并处理的 tick 数
+            "max_lag": 0.0,    # 最大延迟（秒）：tick 的实际处理时间晚于应处理时间
+            "merged": 0,       # 周期定时器被合并掉的触发次数
+        }
+
+    def __len__(self):
+        """等待中的定时器数量"""
+        return self._count
+
+    # ---------------------------
+    # 添加和取消
+    # ---------------------------
+    def call_later(self, delay, callback, *args):
+        """
+        delay 秒后调用 callback(*args) 一次
+
+        :return: Timer 对象
+        """
+        if delay < 0:
+            raise ValueError(f"delay 不能为负数: {delay}")
+        timer = Timer(None, None, callback, args)
+        with self._lock:
+            timer.due = self._due_after(delay)
+            self._insert(timer)
+            self._count += 1
+        return timer
+
+    def call_every(self, interval, callback, *args, first=None):
+        """
+        每 interval 秒调用 callback(*args) 一次
+
+        :param first: 第一次调用前的等待时间（秒），默认等于 interval
+        :return: Timer 对象
+        """
+        if interval <= 0:
+            raise ValueError(f"interval 必须大于 0: {interval}")
+        timer = Timer(None, self._to_ticks(interval), callback, args)
+        with self._lock:
+            timer.due = self._due_after(interval if first is None else first)
+            self._insert(timer)
+            self._count += 1
+        return timer
+
+    def cancel(self, timer):
+        """
+        取消定时器（周期定时器在回调执行期间取消时，不会再安排下一次）
+
+        :return: 定时器取消前是否还在等待
+        """
+        with self._lock:
+            timer.cancelled = True
+            slot = timer._slot
+            if slot is None:
+                return False
+            del slot[timer]
+            timer._slot = None
+            self._count -= 1
+            return True
+
+    def remaining(self, timer):
+        """距离定时器到期的秒数（不在等待中时返回 None）"""
+        if not timer.pending:
+            return None
+        return max(0.0, self._origin + timer.due * self.tick - self._clock())
+
+    def _to_ticks(self, seconds):
+        # 减去一个很小的数，避免 0.3 / 0.1 这类浮点误差多算一个 tick
+        return max(1, math.ceil(seconds / self.tick - 1e-9))
+
+    def _due_after(self, delay):
+        """从当前时间算起 delay 秒后的 tick（轮子落后时定时器仍然按真实时间到期）"""
+        due = math.ceil((self._clock() - self._origin + delay) / self.tick - 1e-9)
+        return max(due, self._now + 1)
+
+    def _insert(self, timer):
+        """把定时器放进对应的槽（调用方持有 _lock）"""
+        delta = timer.due - self._now
+        level = 0
+        while level < self.levels - 1 and delta >= self._spans[level + 1]:
+            level += 1
+        # 超出最高层范围的定时器先放在最远的槽里，移到低层时按真实到期时间重新放置
+        due = min(timer.due, self._now + self._spans[level + 1] - 1)
+        slot = self._wheel[level][(due // self._spans[level]) % self.slots]
+        slot[timer] = None
+        timer._slot = slot
+
+    # ---------------------------
+    # 推进
+    # ---------------------------
+    def advance(self):
+        """
+        处理到当前时间为止到期的定时器（在调用线程中执行回调）
+
+        :return: 触发的回调数量
+        """
+        with self._advance_lock:
+            with self._lock:
+                target = int((self._clock() - self._origin) / self.tick)
+                behind = target - self._now
+                if behind <= 0:
+                    return 0
+                lag = self._clock() - (self._origin + (self._now + 1) * self.tick)
+                self.stats["max_lag"] = max(self.stats["max_lag"], lag)
+                if behind > 1:
+                    self.stats["overruns"] += 1
+                    self.stats["late_ticks"] += behind - 1
+                self.stats["ticks"] += behind
+
+                expired = []
+                while self._now < target:
+                    if not self._count:
+                        self._now = target   # 轮子是空的：直接跳到当前时间
+                        break
+                    self._now += 1
+                    self._collect(expired)
+
+            for timer in expired:
+                self._fire(timer)
+            return len(expired)
+
+    def _collect(self, expired):
+        """处理一个 tick：把高层到期的槽移到低层，取出第 0 层到期的定时器（调用方持有 _lock）"""
+        now = self._now
+        if now % self.slots == 0:
+            for level in range(self.levels - 1, 0, -1):
+                span = self._spans[level]
+                if now % span:
+                    continue
+                slot = self._wheel[level][(now // span) % self.slots]
+                if slot:
+                    timers = list(slot)
+                    slot.clear()
+                    for timer in timers:
+                        self._insert(timer)
+        slot = self._wheel[0][now % self.slots]
+        if slot:
+            for timer in slot:
+                timer._slot = None
+            expired.extend(slot)
+            self._count -= len(slot)
+            slot.clear()
+
+    def _fire(self, timer):
+        """执行回调；周期定时器安排下一次（错过的次数合并）"""
+        if timer.cancelled:
+            return
+        self.stats["fired"] += 1
+        try:
+            timer.callback(*timer.args)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"定时器回调出错: {e}")
+        if timer.interval is None:
+            return
+        with self._lock:
+            if timer.cancelled:
+                return
+            due = timer.due + timer.interval
+            if due <= self._now:
+                missed = (self._now - due) // timer.interval + 1
+                due += missed * timer.interval
+                self.stats["merged"] += missed
+            timer.due = due
+            self._insert(timer)
+            self._count += 1
+
+    # ---------------------------
+    # 后台线程
+    # ---------------------------
+    def start(self):
+        """启动后台线程，每个 tick 推进一次"""
+        if self._thread is not None and self._thread.is_alive():
+            return False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="TimerWheel", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """停止后台线程（等待正在执行的回调结束）"""
+        thread = self._thread
+        if thread is None:
+            return False
+        self._stop.set()
+        if thread is not threading.current_thread():
+            thread.join()
+        self._thread = None
+        return True
+
+    def _run(self):
+        while True:
+            self.advance()
+            wait = self._origin + (self._now + 1) * self.tick - self._clock()
+            if self._stop.wait(max(wait, 0.0)):
+                break